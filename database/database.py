@@ -10,13 +10,22 @@ The module structure is the following:
 - ``DatabaseTorch`` implements is a derived class that use PyTorch to
   load images from a folder containing a dataset and convert those image
   into torch.Tensor format
+- ``LazyImageTensor`` is the tensor-like view of a folder returned by
+  ``DatabaseTorch`` in lazy mode, its images are decoded on demand into
+  an on-disk uint8 cache and read back by slices
 """
 
 from timeit import default_timer as timer
+from concurrent.futures import ThreadPoolExecutor
 import glob
 import os
+import json
+import threading
+import numpy as np
 import torch
 import torchvision
+from PIL import Image
+from tqdm import tqdm
 from torchvision import datasets, models, transforms
 
 
@@ -36,8 +45,7 @@ class DatabaseLoader:
         """Default __call__ returning the converted dataset """
         raise NotImplementedError
 
-    def _to_tensor(self, inds, inde,
-                   ds):
+    def _to_tensor(self, files, name, num_workers):
         """Default private function to step-wise process data """
         raise NotImplementedError
 
@@ -97,11 +105,11 @@ class DatabaseTorch(DatabaseLoader):
                 'Incorrect path for validation folders selection')
         else:
             self.test_folders = test_folders
+        self.ext = ext
         # Extract the # of files in folders as list in alphabetical
         # order from the folder names
-        self.sizes = [len(glob.glob1(root + next(
-            os.walk(root))[1][x] + '/', "*." + ext))
-            for x in range(len(next(os.walk(root))[1]))]
+        self.sizes = [len(glob.glob1(root + folder + '/', "*." + ext))
+                      for folder in sorted(next(os.walk(root))[1])]
 
         if not len(next(os.walk(root))[1]) == len(
                 train_folders + test_folders):
@@ -114,80 +122,314 @@ class DatabaseTorch(DatabaseLoader):
 
     def __call__(self, batch_size=1,
                  shuffle=False,
-                 num_workers=4):
+                 num_workers=4,
+                 lazy=False,
+                 cache_dir=None):
         """Process the data at call after initialization.
 
+        The images of every folder are decoded by a pool of num_workers
+        threads straight into one tensor preallocated per folder, only
+        the images being decoded are held besides the output. In lazy
+        mode nothing is decoded here, every folder is a
+        ``LazyImageTensor`` decoding its images when they are indexed.
+
         Parameters
         ---------
         batch_size : int
-            The batch_size.
+            Unused, kept for compatibility (the whole images are loaded).
 
         shuffle : bool
-            The shuffling parameter for the data loading.
+            Unused, kept for compatibility (the images are in file order).
 
         num_workers: int
-            The number of workers employed in the dataloading.
+            The number of threads decoding the images.
+
+        lazy : bool
+            If True the folders are returned as ``LazyImageTensor``.
+
+        cache_dir : str
+            The folder of the lazy caches, the sibling folder
+            <root>_cache of the dataset if None (a subfolder of root
+            would be taken for a split).
 
         Returns
         -------
         output : dict(str, torch.Tensor)
+            The (N, C, H, W) float images in [0, 1] of every folder, keyed
+            by the folder name.
         """
-
-        parent_folder = self.root.split('/')[len(
-            self.root.split('/')) - 2] + '/'
-        newroot = self.root.replace(parent_folder, '')
-        # create a dataset of images converted to Tensor from Folders
-        image_datasets = {x: datasets.ImageFolder(os.path.join(
-            newroot, x), transforms.ToTensor()) for x in [parent_folder]}
-
-        dataset_sizes = [len(image_datasets[x]) for x in [parent_folder]]
-
-        # usage of dataloader to adopt the possibility of multi threading
-        tmp_dataloaders = [torch.utils.data.DataLoader(
-            image_datasets[parent_folder][ind][0],
-            batch_size=batch_size,
-            shuffle=shuffle,
-            num_workers=num_workers)
-            for ind in range(sum(dataset_sizes))]
-
-        if not sum(self.sizes) == dataset_sizes[0]:
-            raise NotImplementedError
-
-        # sort the name of folders to fit the sizes in self.sizes
-        temporary_folders = sorted(self.train_folders + self.test_folders)
-
-        # for each folders and size, convert to tensor and push in dict
-        inds = 0
-        for key, conc in enumerate(zip(temporary_folders, self.sizes)):
-            inde = inds + conc[1]
-            _conc = conc[0].replace('/', '')
-            self.output[_conc] = self._to_tensor(inds=inds,
-                                                 inde=inde,
-                                                 ds=tmp_dataloaders)
-            inds = inde
+        if lazy and cache_dir is None:
+            cache_dir = os.path.normpath(self.root) + '_cache'
+        for folder in sorted(self.train_folders + self.test_folders):
+            files = sorted(glob.glob(os.path.join(self.root, folder,
+                                                  '*.' + self.ext)))
+            _folder = folder.replace('/', '')
+            if lazy:
+                self.output[_folder] = LazyImageTensor(
+                    files, os.path.join(cache_dir, _folder + '.cache'),
+                    num_workers=num_workers)
+            else:
+                self.output[_folder] = self._to_tensor(files, _folder,
+                                                       num_workers)
         print('Data Loaded - Time Elapsed: ' + str(
             timer() - self.time) + 's')
         return self.output
 
-    def _to_tensor(self, inds, inde, ds):
-        """Convert a dictionnary of toch.Tensor into a toch.Tensor.
-
-        Sub-divide a dictionnary into a tensor considering sizes predefined.
+    def _to_tensor(self, files, name, num_workers):
+        """Decode images into a preallocated torch.Tensor.
 
         Parameters
         ---------
-        inds : int
-            The starting index.
+        files : List[str]
+            The paths of the images, all of the same size.
 
-        inds : bool
-            The ending index.
+        name : str
+            The name of the folder shown in the progress bar.
 
-        ds: List[dataloaders]
-            The list to sub-divide.
+        num_workers: int
+            The number of threads decoding the images.
 
         Returns
         -------
         output : torch.Tensor
+            The (N, C, H, W) float images in [0, 1].
+        """
+        if not files:
+            raise AttributeError('No *.' + self.ext + ' image in ' + name)
+        first = _read_image(files[0])
+        output = torch.empty((len(files),) + tuple(first.shape),
+                             dtype=torch.float32)
+
+        def load(index):
+            image = first if index == 0 else _read_image(files[index])
+            if not image.shape == first.shape:
+                raise AttributeError('Image ' + files[index] + ' of shape ' +
+                                     str(tuple(image.shape)) + ' instead of ' +
+                                     str(tuple(first.shape)))
+            output[index].copy_(image).div_(255.)
+
+        with ThreadPoolExecutor(max_workers=max(1, num_workers)) as pool:
+            # the decoded images are released as soon as they are copied
+            for _ in tqdm(pool.map(load, range(len(files))),
+                          total=len(files), desc=name):
+                pass
+        return output
+
+
+def _read_image(path):
+    """(C, H, W) uint8 tensor of an RGB image, as ImageFolder reads it"""
+    with open(path, 'rb') as f:
+        image = np.array(Image.open(f).convert('RGB'))
+    return torch.from_numpy(image).permute(2, 0, 1)
+
+
+class LazyImageTensor(object):
+    """Tensor-like (N, C, H, W) view of images decoded on demand
+
+    Indexing returns float torch.Tensor in [0, 1] as the eager
+    ``DatabaseTorch`` output. The images are decoded the first time they
+    are indexed and stored as uint8 in a cache file, later accesses read
+    the cache. The cache is read with positioned reads instead of a
+    memory map: only the indexed images are resident, whatever the size
+    of the dataset. The cache is kept on disk and reused while the image
+    files do not change.
+
+    Which images are decoded is kept in cache_file.done, one byte per
+    image written once the image is in the cache. The copies of the view
+    in DataLoader workers share it through the file, an image decoded by
+    a worker is read from the cache by the others and by a later view.
+
+    Attributes
+    ----------
+    files : List[str]
+        The paths of the images, all of the same size.
+
+    cache_file : str
+        The uint8 cache, next to cache_file.json describing it and
+        cache_file.done.
+
+    num_workers : int
+        The number of threads decoding the missing images of an index.
+    """
+    def __init__(self, files, cache_file, num_workers=4):
+        if not files:
+            raise AttributeError('No image for ' + cache_file)
+        self.files = list(files)
+        self.cache_file = cache_file
+        self.num_workers = num_workers
+        self._lock = threading.Lock()
+        self._fd = None
+        self._done_fd = None
+        self._flags = None
+
+        folder = os.path.dirname(cache_file)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        header = {'files': [[f, os.path.getsize(f), os.path.getmtime(f)]
+                            for f in self.files]}
+        previous = None
+        if os.path.isfile(cache_file + '.json'):
+            try:
+                with open(cache_file + '.json') as f:
+                    previous = json.load(f)
+            except ValueError:
+                previous = None
+        if previous is not None and \
+                previous.get('files') == header['files'] and \
+                os.path.isfile(cache_file) and \
+                os.path.isfile(self._done_file) and \
+                os.path.getsize(self._done_file) == len(self.files):
+            self.image_shape = tuple(previous['image_shape'])
+        else:
+            self.image_shape = tuple(_read_image(self.files[0]).shape)
+            with open(cache_file, 'wb') as f:
+                f.truncate(len(self.files) * self._item_bytes)
+            with open(self._done_file, 'wb') as f:
+                f.truncate(len(self.files))
+            # written aside then renamed, a reader never sees half a file
+            header['image_shape'] = list(self.image_shape)
+            tmp = cache_file + '.json.tmp%d' % os.getpid()
+            with open(tmp, 'w') as f:
+                json.dump(header, f)
+            os.replace(tmp, cache_file + '.json')
+
+    @property
+    def _done_file(self):
+        return self.cache_file + '.done'
+
+    @property
+    def _item_bytes(self):
+        return int(np.prod(self.image_shape))
+
+    @property
+    def _done(self):
+        """Whether each image is in the cache, as on disk now"""
+        return np.array(self._done_flags()) > 0
+
+    @property
+    def shape(self):
+        return torch.Size((len(self.files),) + self.image_shape)
+
+    @property
+    def dtype(self):
+        return torch.float32
+
+    def size(self, dim=None):
+        """Shape of the view, as torch.Tensor.size"""
+        if dim is None:
+            return self.shape
+        return self.shape[dim]
+
+    def dim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return len(self.files)
+
+    def _file(self):
+        if self._fd is None:
+            self._fd = os.open(self.cache_file, os.O_RDWR)
+        return self._fd
+
+    def _done_flags(self):
+        """Read only map of cache_file.done, sees every process writes"""
+        if self._flags is None:
+            self._flags = np.memmap(self._done_file, dtype=np.uint8,
+                                    mode='r')
+        return self._flags
+
+    def _decode(self, index):
+        image = _read_image(self.files[index])
+        if not tuple(image.shape) == self.image_shape:
+            raise AttributeError('Image ' + self.files[index] +
+                                 ' of shape ' + str(tuple(image.shape)) +
+                                 ' instead of ' + str(self.image_shape))
+        os.pwrite(self._file(), image.numpy().tobytes(),
+                  index * self._item_bytes)
+        # flagged only once the image is written
+        if self._done_fd is None:
+            self._done_fd = os.open(self._done_file, os.O_WRONLY)
+        os.pwrite(self._done_fd, b'\x01', int(index))
+
+    def _decode_missing(self, indices):
+        indices = np.unique(indices)
+        if self._done_flags()[indices].all():
+            return
+        with self._lock:
+            # another thread or process may have decoded them meanwhile
+            missing = indices[self._done_flags()[indices] == 0]
+            with ThreadPoolExecutor(
+                    max_workers=max(1, self.num_workers)) as pool:
+                list(pool.map(self._decode, missing))
+
+    def _read(self, indices):
+        """(len(indices), C, H, W) uint8 images, by runs of indices"""
+        out = np.empty((len(indices),) + self.image_shape, dtype=np.uint8)
+        flat = out.reshape(len(indices), -1)
+        size = self._item_bytes
+        start = 0
+        while start < len(indices):
+            end = start + 1
+            while end < len(indices) and \
+                    indices[end] == indices[end - 1] + 1:
+                end += 1
+            data = os.pread(self._file(), (end - start) * size,
+                            int(indices[start]) * size)
+            flat[start:end] = np.frombuffer(data, dtype=np.uint8).reshape(
+                end - start, size)
+            start = end
+        return out
+
+    def _indices(self, index):
+        if isinstance(index, slice):
+            return np.arange(len(self))[index]
+        if isinstance(index, torch.Tensor):
+            index = index.cpu().numpy()
+        indices = np.asarray(index)
+        if indices.dtype == bool:
+            return np.nonzero(indices)[0]
+        indices = indices.astype(np.int64)
+        indices[indices < 0] += len(self)
+        if ((indices < 0) | (indices >= len(self))).any():
+            raise IndexError('index out of range for ' +
+                             str(len(self)) + ' images')
+        return indices
+
+    def __getitem__(self, index):
+        """Images of an int, slice, list, array or tensor index
+
+        A tuple indexes the images with its first element and the
+        returned tensor with the others.
         """
-       return torch.stack([next(iter(ds[indx])) \
-                           for indx in range(inds,inde)])
+        rest = ()
+        if isinstance(index, tuple):
+            index, rest = index[0], index[1:]
+        indices = self._indices(index)
+        flat = indices.reshape(-1)
+        self._decode_missing(flat)
+        images = torch.from_numpy(self._read(flat)).float().div_(255.)
+        images = images.reshape(indices.shape + self.image_shape)
+        if rest:
+            images = images[(slice(None),) * indices.ndim + rest]
+        return images
+
+    def to_tensor(self):
+        """The whole (N, C, H, W) float tensor, in memory"""
+        return self[:]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_fd'] = None
+        state['_done_fd'] = None
+        state['_flags'] = None
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __del__(self):
+        for name in ('_fd', '_done_fd'):
+            if getattr(self, name, None) is not None:
+                os.close(getattr(self, name))
@@ -4,12 +4,515 @@ Creating a Dataloader for segmentation taks
 
 import os
 import glob
+import json
+import fnmatch
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
 from PIL import Image
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, get_worker_info
 from torch.autograd import Variable
 
 
+class SharedSampleCache(object):
+    """
+        A LRU cache of decoded samples shared across DataLoader workers
+
+        Decoded images and labels are stored as uint8 in fixed-size slots
+        of a single shared memory block. The slot table, the LRU stamps
+        and the hit/miss counters live in shared arrays, so that every
+        worker process fills and reads the same cache and the counters
+        are readable from the training process.
+
+        Parameters
+        ----------
+        max_bytes : int
+            byte budget of the cache
+        length : int
+            number of samples in the dataset
+        image_shape : tuple of int
+            shape of a decoded image
+        label_shape : tuple of int
+            shape of a decoded label
+
+        Attributes
+        ----------
+        capacity : int
+            number of samples fitting in the byte budget
+    """
+
+    def __init__(self, max_bytes, length, image_shape, label_shape):
+        self.image_shape = tuple(image_shape)
+        self.label_shape = tuple(label_shape)
+        self._image_bytes = int(np.prod(self.image_shape))
+        self._slot_bytes = self._image_bytes + int(np.prod(self.label_shape))
+        self.capacity = int(max_bytes) // self._slot_bytes
+        if self.capacity < 1:
+            raise ValueError('Cache budget of ' + str(max_bytes) +
+                             ' bytes is smaller than a single sample')
+
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=self.capacity * self._slot_bytes)
+        self._creator = os.getpid()
+        self._lock = mp.Lock()
+        self._slot_of = mp.RawArray('q', length)
+        self._owner = mp.RawArray('q', self.capacity)
+        self._stamp = mp.RawArray('q', self.capacity)
+        # clock, hits, misses
+        self._counters = mp.RawArray('q', 3)
+        self._views()
+        self._slot_of_np[:] = -1
+        self._owner_np[:] = -1
+        self._stamp_np[:] = -1
+
+    def _views(self):
+        self._buffer = np.ndarray((self.capacity, self._slot_bytes),
+                                  dtype=np.uint8, buffer=self._shm.buf)
+        self._slot_of_np = np.frombuffer(self._slot_of, dtype=np.int64)
+        self._owner_np = np.frombuffer(self._owner, dtype=np.int64)
+        self._stamp_np = np.frombuffer(self._stamp, dtype=np.int64)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('_buffer', '_slot_of_np', '_owner_np', '_stamp_np'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._views()
+
+    def get(self, index):
+        """Return copies of the cached (image, label) or None"""
+        with self._lock:
+            slot = self._slot_of_np[index]
+            if slot < 0:
+                self._counters[2] += 1
+                return None
+            self._counters[0] += 1
+            self._counters[1] += 1
+            self._stamp_np[slot] = self._counters[0]
+            row = self._buffer[slot]
+            image = row[:self._image_bytes].reshape(self.image_shape).copy()
+            label = row[self._image_bytes:].reshape(self.label_shape).copy()
+        return image, label
+
+    def put(self, index, image, label):
+        """Store a decoded sample, evicting the least recently used one"""
+        if not (image.shape == self.image_shape and
+                label.shape == self.label_shape):
+            return False
+        with self._lock:
+            if self._slot_of_np[index] >= 0:
+                return True
+            # free slots keep a stamp of -1 and are therefore used first
+            slot = int(np.argmin(self._stamp_np))
+            if self._owner_np[slot] >= 0:
+                self._slot_of_np[self._owner_np[slot]] = -1
+            row = self._buffer[slot]
+            row[:self._image_bytes] = image.reshape(-1)
+            row[self._image_bytes:] = label.reshape(-1)
+            self._owner_np[slot] = index
+            self._slot_of_np[index] = slot
+            self._counters[0] += 1
+            self._stamp_np[slot] = self._counters[0]
+        return True
+
+    def stats(self):
+        """Return the hit/miss counters and the occupancy of the cache"""
+        with self._lock:
+            entries = int((self._owner_np >= 0).sum())
+            return {'hits': int(self._counters[1]),
+                    'misses': int(self._counters[2]),
+                    'entries': entries,
+                    'capacity': self.capacity,
+                    'bytes': entries * self._slot_bytes}
+
+    def close(self):
+        """Release the shared memory (unlinked by the creating process)"""
+        if self._shm is None:
+            return
+        del self._buffer
+        self._shm.close()
+        if os.getpid() == self._creator:
+            self._shm.unlink()
+        self._shm = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+_MANIFESTS = {}
+
+
+def _stem(path):
+    return os.path.basename(os.path.splitext(path)[0])
+
+
+def _scan(folder, pattern):
+    """(path, size, mtime) of the files of folder matching pattern"""
+    files = []
+    if not os.path.isdir(folder or os.curdir):
+        return files
+    hidden = pattern.startswith('.')
+    with os.scandir(folder or os.curdir) as entries:
+        for entry in entries:
+            # as glob, '*' does not match the hidden files
+            if (hidden or not entry.name.startswith('.')) and \
+                    fnmatch.fnmatch(entry.name, pattern) and \
+                    entry.is_file():
+                stat = entry.stat()
+                files.append((os.path.join(folder, entry.name),
+                              stat.st_size, stat.st_mtime))
+    return files
+
+
+def _scan_pattern(path, pool):
+    """Files matching a glob pattern, its folders scanned in parallel"""
+    folder, pattern = os.path.split(path)
+    if glob.has_magic(folder):
+        folders = sorted(f for f in glob.glob(folder) if os.path.isdir(f))
+    else:
+        folders = [folder]
+    return [f for files in pool.map(lambda f: _scan(f, pattern), folders)
+            for f in files]
+
+
+def _image_size(path):
+    """(width, height) of an image, only its header is read"""
+    with Image.open(path) as im:
+        return list(im.size)
+
+
+def build_manifest(images_path, label_path, manifest_file=None,
+                   workers=8, refresh=False):
+    """
+        Index of the image/label pairs of a dataset
+
+        The folders are listed with ``os.scandir`` and the image headers
+        read by a pool of threads. The manifest is kept in memory for
+        the next calls of the process and, if ``manifest_file`` is
+        given, saved as JSON for the later processes. Every call lists
+        the folders again, but only reads the headers of the files added
+        or modified since the last manifest (same path, size and mtime
+        are reused), the manifest in memory is returned as is when no
+        file changed.
+
+        Parameters
+        ----------
+        images_path : str
+            path of the images with selector
+            image_path = '/image/*.png'
+        label_path : str
+            path of the labals with selector
+        manifest_file : str
+            JSON file of the manifest (None to keep it in memory only)
+        workers : int
+            number of threads listing the folders and reading headers
+        refresh : bool
+            read the headers of all the files again, ignoring the known
+            manifests
+
+        Returns
+        -------
+        manifest : dict
+            'images_path', 'label_path', 'samples' : the sorted list of
+            [name, image, label, width, height] and 'files' : {path :
+            [size, mtime, width, height]}
+
+        Raises
+        ------
+        ValueError
+            if an image has no label (or the reverse), two files share a
+            name or an image and its label differ in size
+    """
+    key = (images_path, label_path, manifest_file)
+    cached = None if refresh else _MANIFESTS.get(key)
+
+    previous = {}
+    if cached is not None:
+        previous = cached['files']
+    elif not refresh and manifest_file is not None and \
+            os.path.isfile(manifest_file):
+        with open(manifest_file, 'r') as f:
+            previous = json.load(f)['files']
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        images = _scan_pattern(images_path, pool)
+        labels = _scan_pattern(label_path, pool)
+
+        files = {}
+        changed = []
+        for path, size, mtime in images + labels:
+            known = previous.get(path)
+            if known is not None and known[:2] == [size, mtime]:
+                files[path] = known
+            else:
+                files[path] = [size, mtime]
+                changed.append(path)
+        if cached is not None and not changed and \
+                len(files) == len(previous):
+            return cached
+        for path, dims in zip(changed, pool.map(_image_size, changed)):
+            files[path] += dims
+
+    image_of, label_of = {}, {}
+    for found, by_name in ((images, image_of), (labels, label_of)):
+        for path, _, _ in found:
+            name = _stem(path)
+            if name in by_name:
+                raise ValueError('Files ' + by_name[name] + ' and ' + path +
+                                 ' have the same name')
+            by_name[name] = path
+
+    no_label = sorted(set(image_of) - set(label_of))
+    no_image = sorted(set(label_of) - set(image_of))
+    if no_label or no_image:
+        raise ValueError(
+            str(len(image_of)) + ' images and ' + str(len(label_of)) +
+            ' labels, ' + str(len(no_label)) + ' images without label ' +
+            str(no_label[:5]) + ' and ' + str(len(no_image)) +
+            ' labels without image ' + str(no_image[:5]))
+
+    samples = []
+    for name, image in sorted(image_of.items(), key=lambda x: x[1]):
+        label = label_of[name]
+        if not files[image][2:] == files[label][2:]:
+            raise ValueError('Image ' + image + ' of size ' +
+                             str(files[image][2:]) + ' and label of size ' +
+                             str(files[label][2:]))
+        samples.append([name, image, label] + files[image][2:])
+
+    manifest = {'images_path': images_path,
+                'label_path': label_path,
+                'samples': samples,
+                'files': files}
+    if manifest_file is not None and (changed or
+                                      len(previous) != len(files) or
+                                      not os.path.isfile(manifest_file)):
+        folder = os.path.dirname(manifest_file)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        # written aside then renamed, a reader never sees half a file
+        tmp = manifest_file + '.tmp%d' % os.getpid()
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, manifest_file)
+    _MANIFESTS[key] = manifest
+    return manifest
+
+
+class BatchTransformLoader(object):
+    """
+        A DataLoader wrapper transforming whole batches
+
+        The workers of the loader return raw (e.g. uint8) samples, the
+        transforms are applied to the collated batches in the main
+        process, vectorized over the batch. The other attributes are the
+        ones of the wrapped loader.
+
+        Parameters
+        ----------
+        loader : DataLoader
+            the wrapped loader of (images, labels) batches
+        transform : callable
+            transformation applied on the batches of images
+        label_transform : callable
+            transformation applied on the batches of labels
+        device : str or torch.device
+            device the batches are copied to before the transforms
+            (None to keep them where the loader puts them)
+    """
+
+    def __init__(self, loader, transform=None, label_transform=None,
+                 device=None):
+        self.loader = loader
+        self.transform = transform
+        self.label_transform = label_transform
+        self.device = device
+
+    def wrap(self, loader):
+        """The same transforms around another loader"""
+        return BatchTransformLoader(loader, self.transform,
+                                    self.label_transform, self.device)
+
+    def __iter__(self):
+        for images, labels in self.loader:
+            if self.device is not None:
+                images = images.to(self.device, non_blocking=True)
+                labels = labels.to(self.device, non_blocking=True)
+            if self.transform is not None:
+                images = self.transform(images)
+            if self.label_transform is not None:
+                labels = self.label_transform(labels)
+            yield images, labels
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __getattr__(self, name):
+        if name == 'loader':
+            raise AttributeError(name)
+        return getattr(self.loader, name)
+
+
+class PinnedBatchRing(object):
+    """
+        A collate function writing the batches into reusable buffers
+
+        The ring holds ``slots`` preallocated (pinned if possible) buffers
+        per element of the samples, every batch is stacked straight into
+        the next slot instead of new tensors, in place of the fresh
+        batch and pinned copy of ``pin_memory=True``.
+
+        The ring is only used by loaders without workers
+        (``num_workers=0``): the batches of the workers are built in
+        their own processes, before the ring could be used.
+
+        A batch stays valid until ``slots - 1`` other batches are drawn,
+        the buffers are reallocated only when a batch does not fit (a
+        larger batch or another sample shape).
+
+        Parameters
+        ----------
+        slots : int
+            number of batches in the ring
+        pin_memory : bool
+            page-locked buffers, for asynchronous copies to the gpu
+            (None to pin when cuda is available)
+
+        Attributes
+        ----------
+        allocations : int
+            number of buffer allocations
+        batches : int
+            number of batches written in the ring
+        last : int
+            slot of the last batch
+    """
+
+    def __init__(self, slots=3, pin_memory=None):
+        if slots < 2:
+            raise ValueError('The ring needs at least 2 slots')
+        if pin_memory is None:
+            pin_memory = torch.cuda.is_available()
+        self.slots = slots
+        self.pin_memory = pin_memory
+        self.allocations = 0
+        self.batches = 0
+        self.last = None
+        self._buffers = [None] * slots
+        self._events = [None] * slots
+        self._next = 0
+
+    def __getstate__(self):
+        # a copy in another process (data parallel) makes its own buffers
+        state = self.__dict__.copy()
+        state['_buffers'] = [None] * self.slots
+        state['_events'] = [None] * self.slots
+        return state
+
+    def _slot(self, shapes, dtypes):
+        """Next slot, (re)allocated to hold tensors of these shapes"""
+        slot = self._next
+        self._next = (slot + 1) % self.slots
+        if self._events[slot] is not None:
+            # the asynchronous copy of the former batch has to be done
+            self._events[slot].synchronize()
+            self._events[slot] = None
+        buffers = self._buffers[slot]
+        if buffers is None or any(
+                b.shape[0] < s[0] or b.shape[1:] != s[1:] or b.dtype != d
+                for b, s, d in zip(buffers, shapes, dtypes)):
+            buffers = [torch.empty(s, dtype=d, pin_memory=self.pin_memory)
+                       for s, d in zip(shapes, dtypes)]
+            self._buffers[slot] = buffers
+            self.allocations += 1
+        self.batches += 1
+        self.last = slot
+        return [b[:s[0]] for b, s in zip(buffers, shapes)]
+
+    def __call__(self, samples):
+        """Collate a list of (image, label) samples"""
+        if get_worker_info() is not None:
+            raise ValueError('PinnedBatchRing is only used by loaders '
+                             'without workers (num_workers=0)')
+        columns = [[torch.as_tensor(x) for x in column]
+                   for column in zip(*samples)]
+        views = self._slot(
+            [(len(column),) + tuple(column[0].shape) for column in columns],
+            [column[0].dtype for column in columns])
+        for view, column in zip(views, columns):
+            torch.stack(column, out=view)
+        return tuple(views)
+
+    def record(self, slot):
+        """Mark the slot as read by an asynchronous gpu copy"""
+        event = torch.cuda.Event()
+        event.record()
+        self._events[slot] = event
+
+    def stats(self):
+        """Allocations and size of the ring"""
+        return {'allocations': self.allocations,
+                'batches': self.batches,
+                'bytes': sum(b.numel() * b.element_size()
+                             for buffers in self._buffers
+                             if buffers is not None for b in buffers)}
+
+
+class RingLoader(object):
+    """
+        A DataLoader wrapper serving its batches from a ``PinnedBatchRing``
+
+        Parameters
+        ----------
+        loader : DataLoader
+            the wrapped loader, built with ``collate_fn=ring``,
+            ``num_workers=0`` and ``pin_memory=False`` (the ring replaces
+            the pinning)
+        ring : PinnedBatchRing
+            the ring of buffers
+        device : str or torch.device
+            device the batches are copied to, asynchronously from pinned
+            buffers (None to yield the buffers)
+    """
+
+    def __init__(self, loader, ring, device=None):
+        if loader.num_workers > 0:
+            raise ValueError('RingLoader needs a loader without workers '
+                             '(num_workers=0)')
+        self.loader = loader
+        self.ring = ring
+        self.device = device
+
+    def wrap(self, loader):
+        """The same ring around another loader"""
+        return RingLoader(loader, self.ring, self.device)
+
+    def __iter__(self):
+        for batch in self.loader:
+            if self.device is not None:
+                batch = tuple(x.to(self.device, non_blocking=True)
+                              for x in batch)
+                if self.ring.pin_memory:
+                    self.ring.record(self.ring.last)
+            yield batch
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __getattr__(self, name):
+        if name == 'loader':
+            raise AttributeError(name)
+        return getattr(self.loader, name)
+
+
 class ImageFolderSegmentation(Dataset):
     """
         A generic data loader for image segmentation where the data
@@ -32,6 +535,12 @@ class ImageFolderSegmentation(Dataset):
             transformation applied on input images
         label_transform : Composed Transformation
             transformation applied on label images
+        cache_bytes : int
+            byte budget of a ``SharedSampleCache`` keeping the decoded
+            samples in shared memory across DataLoader workers
+            (0 disables the cache)
+        manifest : str
+            JSON file of the file index, see ``build_manifest``
 
         Attributes
         ----------
@@ -41,6 +550,8 @@ class ImageFolderSegmentation(Dataset):
             label names with full path
         conv: list of str
             conversion List
+        cache : SharedSampleCache or None
+            the decoded sample cache
 
         Examples
         --------
@@ -56,21 +567,31 @@ class ImageFolderSegmentation(Dataset):
 
     def __init__(self, images_path, label_path, conversion='RGB',
                  transform=None,
-                 label_transform=None):
+                 label_transform=None,
+                 cache_bytes=0,
+                 manifest=None):
 
-        self.image_filenames = sorted(glob.glob(images_path))
-        self.label_filenames = sorted(glob.glob(label_path))
+        samples = build_manifest(images_path, label_path,
+                                 manifest_file=manifest)['samples']
+        self.image_filenames = [sample[1] for sample in samples]
+        self.label_filenames = [sample[2] for sample in samples]
 
         self.conversion = conversion
 
-        if not all([self._get_filename(imf) == self._get_filename(lf)
-                    for imf, lf in zip(self.image_filenames,
-                                       self.label_filenames)]):
-                raise ValueError(
-                    'Image names in Images and label have to be identical')
         self.transform = transform
         self.label_transform = label_transform
 
+        self.cache = None
+        if cache_bytes > 0 and len(self.image_filenames) > 0:
+            # the size of the first image, from the manifest
+            width, height = samples[0][3:5]
+            bands = Image.getmodebands('RGB')
+            self.cache = SharedSampleCache(
+                max_bytes=cache_bytes,
+                length=len(self.image_filenames),
+                image_shape=(height, width, bands),
+                label_shape=(height, width))
+
     def _get_filename(self, path):
         return os.path.basename(os.path.splitext(path)[0])
 
@@ -81,12 +602,34 @@ class ImageFolderSegmentation(Dataset):
             else:
                 return Image.open(f).convert('P')
 
+    def _cached_loader(self, index):
+        sample = self.cache.get(index)
+        if sample is None:
+            image = np.asarray(self._pil_loader(
+                path=self.image_filenames[index], conversion='RGB'),
+                dtype=np.uint8)
+            label = np.asarray(self._pil_loader(
+                path=self.label_filenames[index]), dtype=np.uint8)
+            self.cache.put(index, image, label)
+        else:
+            image, label = sample
+        return Image.fromarray(image), Image.fromarray(label)
+
+    def cache_stats(self):
+        '''Hit and miss counters of the decoded sample cache'''
+        if self.cache is None:
+            return None
+        return self.cache.stats()
+
     def __getitem__(self, index):
         '''Get an image and a label'''
 
-        image = self._pil_loader(path=self.image_filenames[index],
-                                 conversion='RGB')
-        label = self._pil_loader(path=self.label_filenames[index])
+        if self.cache is not None:
+            image, label = self._cached_loader(index)
+        else:
+            image = self._pil_loader(path=self.image_filenames[index],
+                                     conversion='RGB')
+            label = self._pil_loader(path=self.label_filenames[index])
 
         if self.transform is not None:
             image = self.transform(image)
@@ -112,6 +655,251 @@ class ImageFolderSegmentation(Dataset):
         return fmt_str
 
 
+def _sources(images_path, label_path):
+    """Sorted [path, size, mtime] of the files of a dataset"""
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        files = _scan_pattern(images_path, pool) + \
+            _scan_pattern(label_path, pool)
+    return sorted([path, size, mtime] for path, size, mtime in files)
+
+
+def is_packed(images_path, label_path, output_dir):
+    """
+        Whether ``output_dir`` holds an up to date pack of a dataset
+
+        The pack is up to date if its ``index.json`` lists the same
+        source files, with the same sizes and mtimes, as the folders.
+
+        Parameters
+        ----------
+        images_path : str
+            path of the images with selector
+        label_path : str
+            path of the labals with selector
+        output_dir : str
+            folder of the shards and the index
+
+        Returns
+        -------
+        packed : bool
+    """
+    index_path = os.path.join(output_dir, 'index.json')
+    if not os.path.isfile(index_path):
+        return False
+    with open(index_path, 'r') as f:
+        index = json.load(f)
+    return index.get('sources') == _sources(images_path, label_path)
+
+
+def pack_segmentation(images_path, label_path, output_dir,
+                      conversion='RGB', shard_size=512):
+    """Pack an image/label dataset into fixed-stride uint8 shards
+
+        Every image and label is decoded once and written as raw uint8
+        into ``images_XXXXX.bin`` / ``labels_XXXXX.bin`` shards of
+        ``shard_size`` samples, alongside an ``index.json`` describing
+        the shapes and the ordering of the samples. The packed folder
+        is read back by ``PackedFolderSegmentation``. The index also
+        lists the source files (path, size and mtime) so that a stale
+        pack can be detected by ``is_packed``.
+
+        Parameters
+        ----------
+        images_path : str
+            path of the images with selector
+            image_path = '/image/*.png'
+        label_path : str
+            path of the labals with selector
+        output_dir : str
+            folder receiving the shards and the index
+        conversion : str
+            conversion for input images
+        shard_size : int
+            number of samples per shard
+
+        Returns
+        -------
+        index : dict
+            the content written in ``index.json``
+    """
+    sources = _sources(images_path, label_path)
+    data = ImageFolderSegmentation(images_path=images_path,
+                                   label_path=label_path,
+                                   conversion=conversion)
+    if len(data) == 0:
+        raise ValueError('No image found in ' + images_path)
+    if not len(data.image_filenames) == len(data.label_filenames):
+        raise ValueError(
+            'Number of images and labels have to be identical')
+
+    image = np.asarray(data._pil_loader(path=data.image_filenames[0],
+                                        conversion=conversion),
+                       dtype=np.uint8)
+    label = np.asarray(data._pil_loader(path=data.label_filenames[0]),
+                       dtype=np.uint8)
+    image_shape = image.shape
+    label_shape = label.shape
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    shards = []
+    for start in range(0, len(data), shard_size):
+        count = min(shard_size, len(data) - start)
+        names = ('images_%05d.bin' % len(shards),
+                 'labels_%05d.bin' % len(shards))
+        images = np.memmap(os.path.join(output_dir, names[0]),
+                           dtype=np.uint8, mode='w+',
+                           shape=(count,) + image_shape)
+        labels = np.memmap(os.path.join(output_dir, names[1]),
+                           dtype=np.uint8, mode='w+',
+                           shape=(count,) + label_shape)
+        for offset in range(count):
+            index = start + offset
+            image = np.asarray(data._pil_loader(
+                path=data.image_filenames[index], conversion=conversion),
+                dtype=np.uint8)
+            label = np.asarray(data._pil_loader(
+                path=data.label_filenames[index]), dtype=np.uint8)
+            if not (image.shape == image_shape and
+                    label.shape == label_shape):
+                raise ValueError('Packing requires images of identical '
+                                 'size, ' + data.image_filenames[index] +
+                                 ' differs from the first sample')
+            images[offset] = image
+            labels[offset] = label
+        images.flush()
+        labels.flush()
+        del images, labels
+        shards.append([names[0], names[1], count])
+
+    index = {'length': len(data),
+             'shard_size': shard_size,
+             'conversion': conversion,
+             'image_shape': list(image_shape),
+             'label_shape': list(label_shape),
+             'names': [data._get_filename(x)
+                       for x in data.image_filenames],
+             'shards': shards,
+             'sources': sources}
+    # written aside then renamed, a reader never sees half an index
+    index_path = os.path.join(output_dir, 'index.json')
+    tmp = index_path + '.tmp%d' % os.getpid()
+    with open(tmp, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp, index_path)
+    return index
+
+
+class PackedFolderSegmentation(Dataset):
+    """
+        A data loader reading the shards written by ``pack_segmentation``
+
+        Samples are read through ``numpy.memmap`` without any decoding,
+        the shards are opened lazily so that each DataLoader worker maps
+        its own view of the files.
+
+        Parameters
+        ----------
+        root : str
+            folder containing ``index.json`` and the shards
+        transform : Composed Transformation
+            transformation applied on input images
+        label_transform : Composed Transformation
+            transformation applied on label images
+        as_pil : bool
+            wrap the arrays into PIL images (no decoding involved) so
+            that the transformations written for
+            ``ImageFolderSegmentation`` can be reused as they are
+
+        Attributes
+        ----------
+        index : dict
+            content of ``index.json``
+
+        Examples
+        --------
+
+        >>> from dataloaderSegmentation import pack_segmentation
+        >>> from dataloaderSegmentation import PackedFolderSegmentation
+        >>> pack_segmentation('/image/*.png', '/label/*.png', '/packed/')
+        >>> data = PackedFolderSegmentation(root='/packed/')
+
+
+    """
+
+    def __init__(self, root, transform=None,
+                 label_transform=None,
+                 as_pil=True):
+
+        index_path = os.path.join(root, 'index.json')
+        if not os.path.isfile(index_path):
+            raise AttributeError('No packed dataset in ' + root)
+        with open(index_path, 'r') as f:
+            self.index = json.load(f)
+
+        self.root = root
+        self.transform = transform
+        self.label_transform = label_transform
+        self.as_pil = as_pil
+        self._shards = {}
+
+    def _shard(self, shard):
+        if shard not in self._shards:
+            images, labels, count = self.index['shards'][shard]
+            self._shards[shard] = (
+                np.memmap(os.path.join(self.root, images), dtype=np.uint8,
+                          mode='r',
+                          shape=tuple([count] + self.index['image_shape'])),
+                np.memmap(os.path.join(self.root, labels), dtype=np.uint8,
+                          mode='r',
+                          shape=tuple([count] + self.index['label_shape'])))
+        return self._shards[shard]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+    def __getitem__(self, index):
+        '''Get an image and a label'''
+        if index < 0:
+            index += len(self)
+        shard, offset = divmod(index, self.index['shard_size'])
+        images, labels = self._shard(shard)
+
+        image = np.array(images[offset])
+        label = np.array(labels[offset])
+
+        if self.as_pil:
+            image = Image.fromarray(image)
+            label = Image.fromarray(label)
+
+        if self.transform is not None:
+            image = self.transform(image)
+        if self.label_transform is not None:
+            label = self.label_transform(label)
+
+        return (image, label)
+
+    def __len__(self):
+        return self.index['length']
+
+    def __repr__(self):
+        fmt_str = 'Dataset ' + self.__class__.__name__ + '\n'
+        fmt_str += '    Number of datapoints: {}\n'.format(self.__len__())
+        fmt_str += '    Root Location: {}\n'.format(self.root)
+        tmp = '    Transforms (if any): '
+        fmt_str += '{0}{1}\n'.format(tmp,
+                                     self.transform.__repr__().replace(
+                                         '\n', '\n' + ' ' * len(tmp)))
+        tmp = '    Label Transforms (if any): '
+        fmt_str += '{0}{1}'.format(tmp,
+                                   self.label_transform.__repr__().replace(
+                                       '\n', '\n' + ' ' * len(tmp)))
+        return fmt_str
+
+
 class ImageFolderSegmentationX(Dataset):
     """
         A generic data loader for image segmentation where the data
@@ -134,6 +922,8 @@ class ImageFolderSegmentationX(Dataset):
             transformation applied on input images
         label_transform : Composed Transformation
             transformation applied on label images
+        manifest : str
+            JSON file of the file index, see ``build_manifest``
 
         Attributes
         ----------
@@ -159,18 +949,16 @@ class ImageFolderSegmentationX(Dataset):
     def __init__(self, images_path, label_path, conversion='RGB',
                  transform=None,
                  label_transform=None,
-                 use_cuda=False):
+                 use_cuda=False,
+                 manifest=None):
 
-        self.image_filenames = sorted(glob.glob(images_path))
-        self.label_filenames = sorted(glob.glob(label_path))
+        samples = build_manifest(images_path, label_path,
+                                 manifest_file=manifest)['samples']
+        self.image_filenames = [sample[1] for sample in samples]
+        self.label_filenames = [sample[2] for sample in samples]
 
         self.conversion = conversion
 
-        if not all([self._get_filename(imf) == self._get_filename(lf)
-                    for imf, lf in zip(self.image_filenames,
-                                       self.label_filenames)]):
-                raise ValueError(
-                    'Image names in Images and label have to be identical')
         self.transform = transform
         self.label_transform = label_transform
         self.cuda = use_cuda
@@ -238,6 +1026,8 @@ class ImageFolderSegmentationY(Dataset):
             transformation applied on input images
         label_transform : Composed Transformation
             transformation applied on label images
+        manifest : str
+            JSON file of the file index, see ``build_manifest``
 
         Attributes
         ----------
@@ -263,18 +1053,16 @@ class ImageFolderSegmentationY(Dataset):
     def __init__(self, images_path, label_path, conversion='RGB',
                  transform=None,
                  label_transform=None,
-                 use_cuda=False):
+                 use_cuda=False,
+                 manifest=None):
 
-        self.image_filenames = sorted(glob.glob(images_path))
-        self.label_filenames = sorted(glob.glob(label_path))
+        samples = build_manifest(images_path, label_path,
+                                 manifest_file=manifest)['samples']
+        self.image_filenames = [sample[1] for sample in samples]
+        self.label_filenames = [sample[2] for sample in samples]
 
         self.conversion = conversion
 
-        if not all([self._get_filename(imf) == self._get_filename(lf)
-                    for imf, lf in zip(self.image_filenames,
-                                       self.label_filenames)]):
-                raise ValueError(
-                    'Image names in Images and label have to be identical')
         self.transform = transform
         self.label_transform = label_transform
         self.cuda = use_cuda
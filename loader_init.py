@@ -1,4 +1,9 @@
+import os
 from database.dataloaderSegmentation import ImageFolderSegmentation
+from database.dataloaderSegmentation import PackedFolderSegmentation
+from database.dataloaderSegmentation import pack_segmentation, is_packed
+from database.dataloaderSegmentation import BatchTransformLoader
+from database.dataloaderSegmentation import PinnedBatchRing, RingLoader
 from torchvision.transforms import Compose, CenterCrop, Normalize
 from torchvision.transforms import ToTensor, ToPILImage
 import torch
@@ -6,6 +11,9 @@ import numpy as np
 import torch.nn.functional as F
 from torch.autograd import Variable
 
+_MEAN = [0.5121, 0.4880, 0.3435]
+_STD = [0.2866, 0.2727, 0.2305]
+
 
 class NormalizeInput:
     def __call__(self, _input):
@@ -22,6 +30,16 @@ class NormalizeInput:
         return img
 
 
+class BatchNormalizeInput:
+    """Batched ``NormalizeInput`` of (N, H, W, C) uint8 tensors."""
+    def __init__(self):
+        self.mean = torch.tensor([122.67892, 104.00699, 116.66877])
+
+    def __call__(self, batch):
+        mean = self.mean.to(batch.device)
+        return (batch.float() - mean) / 255.0
+
+
 class load_label:
     """Class to convert PIL images to specific format of torch.Tensor."""
     def __call__(self, _input):
@@ -29,38 +47,161 @@ class load_label:
         return torch.from_numpy(np.array(_input, dtype=np.uint8)).long()
 
 
+class batch_load_label:
+    """Batched ``load_label`` of (N, H, W) uint8 tensors."""
+    def __call__(self, batch):
+        return batch.long()
+
+
+class ToUint8:
+    """Class to convert PIL images or arrays to uint8 torch.Tensor.
+
+    The (H, W, C) or (H, W) layout is kept, the conversion to float is
+    left to a batched transform of the main process (``BatchNormalize``).
+    """
+    def __call__(self, _input):
+        return torch.from_numpy(np.array(_input, dtype=np.uint8))
+
+
+class BatchNormalize:
+    """Batched ``ToTensor`` and ``Normalize`` of (N, H, W, C) uint8 tensors.
+
+    The uint8 to float conversion, the NHWC to NCHW layout change and the
+    normalization ((x / 255 - mean) / std) are one multiply-add.
+    """
+    def __init__(self, mean, std):
+        mean = torch.tensor(mean, dtype=torch.float32)
+        std = torch.tensor(std, dtype=torch.float32)
+        self.scale = (1. / (255. * std)).view(1, -1, 1, 1)
+        self.shift = (-mean / std).view(1, -1, 1, 1)
+
+    def __call__(self, batch):
+        batch = batch.permute(0, 3, 1, 2)
+        return torch.addcmul(self.shift.to(batch.device), batch,
+                             self.scale.to(batch.device))
+
+
+def _dataset(image_path, label_path, transform, label_transform,
+             pack_dir=None, cache_bytes=0, manifest=None, as_pil=True):
+    """Folder dataset, or its packed version when ``pack_dir`` is given"""
+    if pack_dir is None:
+        return ImageFolderSegmentation(images_path=image_path,
+                                       label_path=label_path,
+                                       transform=transform,
+                                       label_transform=label_transform,
+                                       cache_bytes=cache_bytes,
+                                       manifest=manifest)
+
+    if not is_packed(image_path, label_path, pack_dir):
+        pack_segmentation(images_path=image_path,
+                          label_path=label_path,
+                          output_dir=pack_dir)
+    return PackedFolderSegmentation(root=pack_dir,
+                                    transform=transform,
+                                    label_transform=label_transform,
+                                    as_pil=as_pil)
+
+
+def _manifest(manifest_dir, split):
+    if manifest_dir is None:
+        return None
+    return os.path.join(manifest_dir, split + '.json')
+
+
+def _loader(var, batch_size, shuffle, num_workers, uint8=False, ring=0,
+            device=None):
+    """DataLoader of a dataset, with the batched transforms of uint8"""
+    if ring:
+        collate = PinnedBatchRing(slots=ring)
+        loader = torch.utils.data.DataLoader(var, batch_size=batch_size,
+                                             shuffle=shuffle,
+                                             num_workers=num_workers,
+                                             collate_fn=collate,
+                                             pin_memory=False)
+        loader = RingLoader(loader, collate, device)
+    else:
+        loader = torch.utils.data.DataLoader(var, batch_size=batch_size,
+                                             shuffle=shuffle,
+                                             num_workers=num_workers,
+                                             pin_memory=True)
+
+    if uint8:
+        # the labels stay uint8, Routine casts them for the loss
+        loader = BatchTransformLoader(loader, BatchNormalize(_MEAN, _STD),
+                                      None, None if ring else device)
+    return loader
+
+
 def loader_init(image_path, label_path, image_path2, label_path2,
-                batch_size, num_workers):
-
-    transform = Compose([
-        # CenterCrop(256),
-        ToTensor(),
-        # NormalizeInput(),
-        Normalize([0.5121, 0.4880, 0.3435], [0.2866, 0.2727, 0.2305]),
-    ])
-    label_transform = Compose([
-        # CenterCrop(256),
-        load_label(),
-    ])
-
-    var = ImageFolderSegmentation(images_path=image_path,
-                                  label_path=label_path,
-                                  transform=transform,
-                                  label_transform=label_transform)
-
-    trainloader = torch.utils.data.DataLoader(var, batch_size=batch_size,
-                                              shuffle=True,
-                                              num_workers=num_workers,
-                                              pin_memory=True)
-
-    var2 = ImageFolderSegmentation(images_path=image_path2,
-                                   label_path=label_path2,
-                                   transform=transform,
-                                   label_transform=label_transform)
-
-    valloader = torch.utils.data.DataLoader(var2, batch_size=batch_size,
-                                            shuffle=False,
-                                            num_workers=num_workers,
-                                            pin_memory=True)
+                batch_size, num_workers, pack_dir=None, cache_bytes=0,
+                manifest_dir=None, uint8=False, device=None, ring=0):
+    """Create the train and validation loaders
+
+    If ``pack_dir`` is given, both splits are packed into
+    ``pack_dir/train`` and ``pack_dir/val`` (see ``pack_segmentation``)
+    and read back through memory-mapped shards. A pack is reused until
+    its source files change (see ``is_packed``).
+
+    Otherwise ``cache_bytes`` > 0 gives each split a shared decoded
+    sample cache of that budget (see ``SharedSampleCache``), its
+    counters are returned by ``loader.dataset.cache_stats()``.
+
+    ``manifest_dir`` keeps the file index of the splits in
+    ``manifest_dir/train.json`` and ``manifest_dir/val.json`` (see
+    ``build_manifest``), the next runs only read the new files.
+
+    With ``uint8`` the workers return the (H, W, C) uint8 pixels and the
+    labels as uint8, 4 and 8 times smaller than their float and int64
+    versions, and the loaders (``BatchTransformLoader``) convert and
+    normalize whole batches in the main process, on ``device`` if given
+    (e.g. 'cuda', the copy is then made in uint8 as well). The labels are
+    left in uint8 (``Routine`` casts them for the loss), apply
+    ``batch_load_label`` to get the int64 labels of ``load_label``.
+
+    ``ring`` > 0 collates the batches into a ring of that many reused
+    (pinned) buffers instead of new tensors (see ``PinnedBatchRing``), a
+    batch is valid until ``ring - 1`` other batches are drawn. The ring
+    is only available without workers (``num_workers=0``), the labels
+    are then left in uint8 as with ``uint8``.
+    """
+    if ring and num_workers > 0:
+        raise ValueError('ring needs num_workers=0, the batches of the '
+                         'workers are built in their processes')
+    if uint8:
+        transform = ToUint8()
+    else:
+        transform = Compose([
+            # CenterCrop(256),
+            ToTensor(),
+            # NormalizeInput(),
+            Normalize(_MEAN, _STD),
+        ])
+    if uint8 or ring:
+        label_transform = ToUint8()
+    else:
+        label_transform = Compose([
+            # CenterCrop(256),
+            load_label(),
+        ])
+
+    var = _dataset(image_path, label_path, transform, label_transform,
+                   pack_dir=None if pack_dir is None else os.path.join(
+                       pack_dir, 'train'),
+                   cache_bytes=cache_bytes,
+                   manifest=_manifest(manifest_dir, 'train'),
+                   as_pil=not uint8)
+
+    trainloader = _loader(var, batch_size, True, num_workers, uint8, ring,
+                          device)
+
+    var2 = _dataset(image_path2, label_path2, transform, label_transform,
+                    pack_dir=None if pack_dir is None else os.path.join(
+                        pack_dir, 'val'),
+                    cache_bytes=cache_bytes,
+                    manifest=_manifest(manifest_dir, 'val'),
+                    as_pil=not uint8)
+
+    valloader = _loader(var2, batch_size, False, num_workers, uint8, ring,
+                        device)
 
     return trainloader, valloader
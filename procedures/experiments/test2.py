@@ -1,6 +1,7 @@
 import sys
 sys.path.append('../../database/')
 sys.path.append('../../segmentation/models/')
+sys.path.append('../../')
 import torch
 import torchvision
 import numpy as np
@@ -13,6 +14,7 @@ import torch.nn.functional as F
 import torch.optim as optim
 from torch.autograd import Variable
 from tqdm import tqdm
+from utils.writer import AsyncWriter
 
 
 class runningScore(object):
@@ -123,14 +125,18 @@ model.load_state_dict(torch.load('segnet_Camvid_best_model2.pkl')
                            ['model_state'])
 model.eval()
 
+writer = AsyncWriter(workers=2, max_pending=32)
+model.cuda()
+
 for i, (images, labels) in tqdm(enumerate(valloader)):
-        model.cuda()
-        images = Variable(images.cuda(), volatile=True)
-        labels = Variable(labels.cuda(), volatile=True)
+    with torch.no_grad():
+        images = images.cuda()
 
         outputs = model(images)
-        pred = outputs.data.max(1)[1].cpu().numpy()
-        gt = labels.data.cpu().numpy()
-        np.save("pred/pred" + str(i), pred)
+        pred = outputs.max(1)[1].cpu().numpy().astype(np.uint8)
+        gt = labels.numpy().astype(np.uint8)
+    writer.submit("pred/pred" + str(i), pred=pred)
+    writer.submit("gt/gt" + str(i), gt=gt)
 
-        np.save("gt/gt" + str(i), gt)
+writer.close()
+print(writer.stats())
@@ -0,0 +1,165 @@
+"""ONNX export and ONNX Runtime inference of the segmentation networks
+
+This module serves the networks of ``nn.py`` without the PyTorch
+training stack.
+
+The module structure is the following:
+
+- The ``scatter_unpooling`` context switches the ``MaxUnpool`` layers
+  to their scatter implementation, ``max_unpool2d`` has no ONNX export
+  while the pooling indices of ``MaxPool2d(return_indices=True)`` do
+- The ``export_onnx`` function writes a network as an ONNX graph with
+  dynamic batch size and image size
+- The ``OnnxPredictor`` class runs an exported graph with ONNX Runtime
+  on cpu, with control over its thread pools
+- The ``check_parity`` function compares the outputs of the predictor
+  with the ones of the eager network
+
+  Example:
+  export_onnx(model.fuse_for_inference(), 'segnet.onnx', (1, 3, 256, 256))
+  predictor = OnnxPredictor('segnet.onnx', intra_op_threads=4)
+  logits = predictor(images)
+
+onnx and onnxruntime are only needed by this module.
+"""
+import contextlib
+import numpy as np
+import torch
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+
+@contextlib.contextmanager
+def scatter_unpooling(model):
+    """Context running the unpooling layers of model as scatters"""
+    unpools = [m for m in model.modules() if hasattr(m, 'scatter')]
+    saved = [m.scatter for m in unpools]
+    for m in unpools:
+        m.scatter = True
+    try:
+        yield model
+    finally:
+        for m, scatter in zip(unpools, saved):
+            m.scatter = scatter
+
+
+def export_onnx(model, filename, input_shape=(1, 3, 256, 256),
+                opset_version=17, dynamic=True):
+    """Export a network to an ONNX file
+
+    Parameters
+    ----------
+    model : nn.Module
+        The network, set in eval mode (fuse it beforehand to export the
+        BatchNorm folded in the convolutions).
+
+    filename : str
+        The .onnx file written.
+
+    input_shape : tuple
+        The shape of the example input.
+
+    opset_version : int
+        The ONNX opset.
+
+    dynamic : bool
+        If True the batch size, height and width of the graph are
+        dynamic, otherwise they are the ones of input_shape.
+
+    Returns
+    -------
+    filename : str
+    """
+    model.eval()
+    device = torch.device('cpu')
+    for param in model.parameters():
+        device = param.device
+        break
+    example = torch.randn(*input_shape, device=device)
+
+    dynamic_axes = None
+    if dynamic:
+        dynamic_axes = {'input': {0: 'batch', 2: 'height', 3: 'width'},
+                        'output': {0: 'batch', 2: 'height', 3: 'width'}}
+
+    with scatter_unpooling(model), torch.no_grad():
+        torch.onnx.export(model, (example,), filename,
+                          input_names=['input'],
+                          output_names=['output'],
+                          opset_version=opset_version,
+                          dynamic_axes=dynamic_axes)
+    return filename
+
+
+class OnnxPredictor(object):
+    """ONNX Runtime cpu session of an exported network
+
+    Called with a (N, C, H, W) tensor or array, returns the logits as a
+    torch.Tensor so that it can replace the network at inference (e.g.
+    in ``utils.tiling.TiledInference``).
+
+    Attributes
+    ----------
+    filename : str
+        The .onnx file.
+
+    intra_op_threads : int
+        The threads of an operator (None for onnxruntime default).
+
+    inter_op_threads : int
+        The threads running independent operators in parallel (None for
+        sequential execution).
+    """
+    def __init__(self, filename, intra_op_threads=None,
+                 inter_op_threads=None):
+        if onnxruntime is None:
+            raise ImportError('OnnxPredictor needs onnxruntime')
+        self.filename = filename
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = \
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads is not None:
+            options.intra_op_num_threads = int(intra_op_threads)
+        if inter_op_threads is not None:
+            options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+            options.inter_op_num_threads = int(inter_op_threads)
+
+        self.session = onnxruntime.InferenceSession(
+            filename, sess_options=options,
+            providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def parameters(self):
+        """No torch parameters, the predictor runs on cpu"""
+        return iter(())
+
+    def __call__(self, inputs):
+        if isinstance(inputs, torch.Tensor):
+            inputs = inputs.detach().cpu().numpy()
+        inputs = np.ascontiguousarray(inputs, dtype=np.float32)
+        outputs = self.session.run(None, {self.input_name: inputs})[0]
+        return torch.from_numpy(outputs)
+
+
+def check_parity(model, predictor, inputs):
+    """Compare the predictor with the eager network on inputs
+
+    Returns
+    -------
+    parity : dict
+        'max_abs' : largest absolute difference of the logits
+        'agreement' : share of pixels with the same argmax
+    """
+    model.eval()
+    with torch.no_grad():
+        expected = model(inputs).float().cpu()
+    outputs = predictor(inputs).float()
+    return {'max_abs': float((expected - outputs).abs().max()),
+            'agreement': float((expected.argmax(1) ==
+                                outputs.argmax(1)).float().mean())}
@@ -5,13 +5,17 @@ This module contains the creation of different layers.
 The module structure is the following:
 
 - The ``Layer`` abstract base class is the main definition of
-  the necessary functions in order to properly define a layer
+  the necessary functions in order to properly define a layer, its
+  derived layers can be recomputed during backward instead of keeping
+  their activations (activation checkpointing, see ``checkpoint_layers``)
 
 ---------------------------------------------------------------------
                               GENERAL
 
 - ``conv2DBatchNormRelu`` definition of the generic ReLu activation
-  layer for 2D convolution architecture of Neural Network
+  layer for 2D convolution architecture of Neural Network, its BatchNorm
+  can be folded into the convolution for inference (see ``fuse_layers``)
+  and it can be quantized to int8 (see ``prepare_quantization``)
 
 ---------------------------------------------------------------------
                               SEGNET
@@ -29,12 +33,79 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+from torch.ao.quantization import QuantStub, DeQuantStub, fuse_modules
+from typing import List, Optional
+
+
+class _FrozenBatchNorm(object):
+    """Context keeping the BatchNorm running statistics unchanged"""
+    def __init__(self, module):
+        self.norms = [m for m in module.modules()
+                      if isinstance(m, nn.modules.batchnorm._BatchNorm)]
+
+    def __enter__(self):
+        self.saved = [(m.momentum, m.num_batches_tracked.clone()
+                       if m.num_batches_tracked is not None else None)
+                      for m in self.norms]
+        for m in self.norms:
+            m.momentum = 0.
+
+    def __exit__(self, *args):
+        for m, (momentum, tracked) in zip(self.norms, self.saved):
+            m.momentum = momentum
+            if tracked is not None:
+                m.num_batches_tracked.copy_(tracked)
+
+
+def checkpointed(module, function, *inputs):
+    """Run ``function(*inputs)`` without keeping its inner activations
+
+    The activations of ``function`` are recomputed during backward, only
+    the inputs and the outputs are kept. The running statistics of the
+    BatchNorm layers of ``module`` are updated by the first pass only.
+    """
+    recompute = [False]
+
+    def run(*args):
+        if recompute[0]:
+            with _FrozenBatchNorm(module):
+                return function(*args)
+        recompute[0] = True
+        return function(*args)
+
+    return checkpoint(run, *inputs, use_reentrant=False)
+
+
+def checkpoint_layers(module, enabled=True):
+    """Toggle activation checkpointing of every ``Layer`` of a module"""
+    for _module in module.modules():
+        if isinstance(_module, Layer):
+            _module.use_checkpoint = enabled
 
 
 class Layer(nn.Module):
-    """Abstract Base Class to ensure the optimal quantity of functions."""
+    """Abstract Base Class to ensure the optimal quantity of functions.
+
+    Derived layers implement ``_forward``, ``forward`` runs it through
+    ``checkpointed`` when ``use_checkpoint`` is set during training. Their
+    depth is fixed at construction (missing convolutions are identities)
+    so that ``forward`` takes tensors only and scripts or traces cleanly,
+    a scripted layer always runs eagerly (no checkpointing).
+    """
     def __init__(self):
         super(Layer, self).__init__()
+        self.use_checkpoint = False
+
+    def _checkpointing(self):
+        return self.use_checkpoint and self.training and \
+            torch.is_grad_enabled()
+
+    @torch.jit.unused
+    def _checkpointed(self, *inputs):
+        return checkpointed(self, self._forward, *inputs)
+
+    def _forward(self):
         pass
 
     def forward(self):
@@ -44,6 +115,119 @@ class Layer(nn.Module):
 """GENERAL"""
 
 
+class MaxUnpool(nn.Module):
+    """Partial inverse of a 2D max pooling, see ``nn.MaxUnpool2d``
+
+    ``nn.MaxUnpool2d`` does not script, the output shape is given as a
+    list of ints instead of a ``torch.Size``. With ``scatter`` set the
+    unpooling is a scatter of the inputs in a zero tensor, which exports
+    to ONNX (``max_unpool2d`` does not).
+
+    Attributes
+    ----------
+    kernel_size : int
+        The size of the pooling window.
+
+    stride : int
+        The stride of the pooling (kernel_size by default).
+
+    padding : int
+        The padding of the pooling.
+
+    scatter : bool
+        The toggle of the scatter implementation.
+    """
+    def __init__(self, kernel_size, stride=None, padding=0):
+        super(MaxUnpool, self).__init__()
+        if stride is None:
+            stride = kernel_size
+        self.kernel_size = [kernel_size, kernel_size]
+        self.stride = [stride, stride]
+        self.padding = [padding, padding]
+        self.scatter = False
+
+    def forward(self, inputs, indices,
+                output_size: Optional[List[int]] = None):
+        """Scatter the inputs at the pooling indices"""
+        if self.scatter:
+            return self._scatter(inputs, indices, output_size)
+        if torch.jit.is_tracing():
+            # traced sizes are tensors, a trace is shape specialized anyway
+            if output_size is None:
+                output_size = [(int(inputs.size(d + 2)) - 1) * self.stride[d]
+                               - 2 * self.padding[d] + self.kernel_size[d]
+                               for d in range(2)]
+            output_size = [int(size) for size in output_size]
+        return F.max_unpool2d(inputs, indices, self.kernel_size,
+                              self.stride, self.padding, output_size)
+
+    def _scatter(self, inputs, indices, output_size: Optional[List[int]]):
+        """Unpooling as a scatter over the flattened planes"""
+        if output_size is None:
+            height = (inputs.size(2) - 1) * self.stride[0] - \
+                2 * self.padding[0] + self.kernel_size[0]
+            width = (inputs.size(3) - 1) * self.stride[1] - \
+                2 * self.padding[1] + self.kernel_size[1]
+        else:
+            height = output_size[-2]
+            width = output_size[-1]
+        outputs = inputs.new_zeros((inputs.size(0), inputs.size(1),
+                                    height * width))
+        outputs = outputs.scatter(2, indices.flatten(2), inputs.flatten(2))
+        return outputs.view(inputs.size(0), inputs.size(1), height, width)
+
+
+def fuse_conv_bn(conv, bn):
+    """Fold an inference BatchNorm into the preceding convolution
+
+    Parameters
+    ----------
+    conv : nn.Conv2d
+        The convolution, with or without bias.
+
+    bn : nn.BatchNorm2d
+        The BatchNorm following the convolution, its running statistics
+        are used.
+
+    Returns
+    -------
+    fused : nn.Conv2d
+        A convolution with bias computing bn(conv(x)) in eval mode.
+    """
+    fused = nn.Conv2d(conv.in_channels, conv.out_channels,
+                      kernel_size=conv.kernel_size, stride=conv.stride,
+                      padding=conv.padding, dilation=conv.dilation,
+                      groups=conv.groups, bias=True)
+
+    with torch.no_grad():
+        scale = bn.running_var.add(bn.eps).rsqrt()
+        if bn.weight is not None:
+            scale = scale * bn.weight
+        shift = -bn.running_mean * scale
+        if bn.bias is not None:
+            shift = shift + bn.bias
+        if conv.bias is not None:
+            shift = shift + conv.bias * scale
+
+        fused.weight.copy_(conv.weight * scale.reshape(-1, 1, 1, 1))
+        fused.bias.copy_(shift)
+
+    return fused.to(conv.weight.device)
+
+
+def fuse_layers(module):
+    """Fold the BatchNorm of every ``conv2DBatchNormRelu`` of a module
+
+    The module is set in eval mode, the fused layers are only valid for
+    inference (the BatchNorm running statistics become constants).
+    """
+    module.eval()
+    for _module in module.modules():
+        if isinstance(_module, conv2DBatchNormRelu):
+            _module.fuse()
+    return module
+
+
 class conv2DBatchNormRelu(nn.Module):
     """Derived Class to define an Encoder Layer of Segnet Architecture
 
@@ -86,6 +270,28 @@ class conv2DBatchNormRelu(nn.Module):
                                       nn.BatchNorm2d(int(n_filters)),
                                       nn.ReLU(inplace=True),)
 
+    def fuse(self):
+        """Replace conv + BatchNorm + ReLU by the fused conv + ReLU"""
+        if isinstance(self.cbr_unit[1], nn.BatchNorm2d):
+            conv, bn, relu = self.cbr_unit
+            self.cbr_unit = nn.Sequential(fuse_conv_bn(conv, bn), relu)
+
+    def prepare_quantization(self):
+        """Fused conv + ReLU between quantization stubs
+
+        The unit is quantized on its input and dequantized on its output,
+        the poolings (with indices) around it stay in float. Observers
+        are then added by ``torch.ao.quantization.prepare`` and the unit
+        converted to int8 by ``convert``.
+        """
+        if isinstance(self.cbr_unit[0], QuantStub):
+            return
+        self.eval()
+        self.fuse()
+        conv, relu = self.cbr_unit
+        fused = fuse_modules(nn.Sequential(conv, relu), [['0', '1']])
+        self.cbr_unit = nn.Sequential(QuantStub(), fused[0], DeQuantStub())
+
     def forward(self, inputs):
         """Processing the initialied sequence - See PyTorch Doc"""
         outputs = self.cbr_unit(inputs)
@@ -95,7 +301,7 @@ class conv2DBatchNormRelu(nn.Module):
 """SEGNET"""
 
 
-class SegnetLayer_Decoder(nn.Module):
+class SegnetLayer_Decoder(Layer):
     """Derived Class to define a Decoder Layer of Segnet Architecture
 
     Attributes
@@ -118,34 +324,32 @@ class SegnetLayer_Decoder(nn.Module):
     def __init__(self, in_size, out_size, layer_size):
         super(SegnetLayer_Decoder, self).__init__()
         if layer_size == 2:
-            self.unpool = nn.MaxUnpool2d(2, 2)
+            self.unpool = MaxUnpool(2, 2)
             self.conv1 = conv2DBatchNormRelu(in_size, in_size, 3, 1, 1)
             self.conv2 = conv2DBatchNormRelu(in_size, out_size, 3, 1, 1)
+            self.conv3 = nn.Identity()
         else:
-            self.unpool = nn.MaxUnpool2d(2, 2)
+            self.unpool = MaxUnpool(2, 2)
             self.conv1 = conv2DBatchNormRelu(in_size, in_size, 3, 1, 1)
             self.conv2 = conv2DBatchNormRelu(in_size, in_size, 3, 1, 1)
             self.conv3 = conv2DBatchNormRelu(in_size, out_size, 3, 1, 1)
 
-    def forward(self, inputs, indices, output_shape, layer_size):
+    def forward(self, inputs, indices, output_shape: List[int]):
         """Processing in Sequential - See PyTorch Doc"""
-        if layer_size == 2:
-            outputs = self.unpool(input=inputs, indices=indices,
-                                  output_size=output_shape)
-            outputs = self.conv1(outputs)
-            outputs = self.conv2(outputs)
-
-        else:
-            outputs = self.unpool(input=inputs, indices=indices,
-                                  output_size=output_shape)
-            outputs = self.conv1(outputs)
-            outputs = self.conv2(outputs)
-            outputs = self.conv3(outputs)
+        if not torch.jit.is_scripting() and self._checkpointing():
+            return self._checkpointed(inputs, indices, output_shape)
+        return self._forward(inputs, indices, output_shape)
 
+    def _forward(self, inputs, indices, output_shape: List[int]):
+        """Processing in Sequential - See PyTorch Doc"""
+        outputs = self.unpool(inputs, indices, output_size=output_shape)
+        outputs = self.conv1(outputs)
+        outputs = self.conv2(outputs)
+        outputs = self.conv3(outputs)
         return outputs
 
 
-class SegnetLayer_Encoder(nn.Module):
+class SegnetLayer_Encoder(Layer):
     """Derived Class to define an Encoder Layer of Segnet Architecture
 
     Attributes
@@ -171,34 +375,34 @@ class SegnetLayer_Encoder(nn.Module):
         if layer_size == 2:
             self.conv1 = conv2DBatchNormRelu(in_size, out_size, 3, 1, 1)
             self.conv2 = conv2DBatchNormRelu(out_size, out_size, 3, 1, 1)
+            self.conv3 = nn.Identity()
             self.maxpool_with_argmax = nn.MaxPool2d(2, 2, return_indices=True)
-
         else:
             self.conv1 = conv2DBatchNormRelu(in_size, out_size, 3, 1, 1)
             self.conv2 = conv2DBatchNormRelu(out_size, out_size, 3, 1, 1)
             self.conv3 = conv2DBatchNormRelu(out_size, out_size, 3, 1, 1)
             self.maxpool_with_argmax = nn.MaxPool2d(2, 2, return_indices=True)
 
-    def forward(self, inputs, layer_size):
+    def forward(self, inputs):
         """Processing in Sequential - See PyTorch Doc"""
-        if layer_size == 2:
-            outputs = self.conv1(inputs)
-            outputs = self.conv2(outputs)
-            unpooled_shape = outputs.size()
-            outputs, indices = self.maxpool_with_argmax(outputs)
-        else:
-            outputs = self.conv1(inputs)
-            outputs = self.conv2(outputs)
-            outputs = self.conv3(outputs)
-            unpooled_shape = outputs.size()
-            outputs, indices = self.maxpool_with_argmax(outputs)
+        if not torch.jit.is_scripting() and self._checkpointing():
+            return self._checkpointed(inputs)
+        return self._forward(inputs)
+
+    def _forward(self, inputs):
+        """Processing in Sequential - See PyTorch Doc"""
+        outputs = self.conv1(inputs)
+        outputs = self.conv2(outputs)
+        outputs = self.conv3(outputs)
+        unpooled_shape = outputs.size()
+        outputs, indices = self.maxpool_with_argmax(outputs)
         return outputs, indices, unpooled_shape
 
 
 """UPNET"""
 
 
-class UpNetLayer_Encoder(nn.Module):
+class UpNetLayer_Encoder(Layer):
     """Derived Class to define an Encoder Layer of UpNet Architecture
 
     Attributes
@@ -223,11 +427,11 @@ class UpNetLayer_Encoder(nn.Module):
         if layer_size == 2:
             self.conv1 = conv2DBatchNormRelu(in_size, out_size, 3, 1, 1)
             self.conv2 = conv2DBatchNormRelu(out_size, out_size, 3, 1, 1)
+            self.conv3 = nn.Identity()
             self.maxpool_with_argmax = nn.MaxPool2d(kernel_size=2,
                                                     padding=1,
                                                     stride=2,
                                                     return_indices=True)
-
         else:
             self.conv1 = conv2DBatchNormRelu(in_size, out_size, 3, 1, 1)
             self.conv2 = conv2DBatchNormRelu(out_size, out_size, 3, 1, 1)
@@ -237,23 +441,23 @@ class UpNetLayer_Encoder(nn.Module):
                                                     stride=2,
                                                     return_indices=True)
 
-    def forward(self, inputs, layer_size):
+    def forward(self, inputs):
         """Processing in Sequential - See PyTorch Doc"""
-        if layer_size == 2:
-            outputs = self.conv1(inputs)
-            outputs = self.conv2(outputs)
-            unpooled_shape = outputs.size()
-            outputs, indices = self.maxpool_with_argmax(outputs)
-        else:
-            outputs = self.conv1(inputs)
-            outputs = self.conv2(outputs)
-            outputs = self.conv3(outputs)
-            unpooled_shape = outputs.size()
-            outputs, indices = self.maxpool_with_argmax(outputs)
+        if not torch.jit.is_scripting() and self._checkpointing():
+            return self._checkpointed(inputs)
+        return self._forward(inputs)
+
+    def _forward(self, inputs):
+        """Processing in Sequential - See PyTorch Doc"""
+        outputs = self.conv1(inputs)
+        outputs = self.conv2(outputs)
+        outputs = self.conv3(outputs)
+        unpooled_shape = outputs.size()
+        outputs, indices = self.maxpool_with_argmax(outputs)
         return outputs, indices, unpooled_shape
 
 
-class UpNetLayer_ParticularEncoder(nn.Module):
+class UpNetLayer_ParticularEncoder(Layer):
     """Derived Class to define an Encoder Layer of UpNet Architecture
 
     Attributes
@@ -278,6 +482,7 @@ class UpNetLayer_ParticularEncoder(nn.Module):
         if layer_size == 2:
             self.conv1 = conv2DBatchNormRelu(in_size, out_size, 1, 1, 0)
             self.conv2 = conv2DBatchNormRelu(out_size, out_size, 1, 1, 0)
+            self.conv3 = nn.Identity()
             self.maxpool_with_argmax = nn.MaxPool2d(kernel_size=1,
                                                     padding=0,
                                                     stride=2,
@@ -291,25 +496,23 @@ class UpNetLayer_ParticularEncoder(nn.Module):
                                                     stride=2,
                                                     return_indices=True)
 
-    def forward(self, inputs, layer_size):
+    def forward(self, inputs):
         """Processing in Sequential - See PyTorch Doc"""
-        if layer_size == 2:
-            outputs = self.conv1(inputs)
-            outputs = self.conv2(outputs)
-            unpooled_shape = outputs.size()
-            outputs, indices = self.maxpool_with_argmax(outputs)
-
-        else:
-            outputs = self.conv1(inputs)
-            outputs = self.conv2(outputs)
-            outputs = self.conv3(outputs)
-            unpooled_shape = outputs.size()
-            outputs, indices = self.maxpool_with_argmax(outputs)
+        if not torch.jit.is_scripting() and self._checkpointing():
+            return self._checkpointed(inputs)
+        return self._forward(inputs)
 
+    def _forward(self, inputs):
+        """Processing in Sequential - See PyTorch Doc"""
+        outputs = self.conv1(inputs)
+        outputs = self.conv2(outputs)
+        outputs = self.conv3(outputs)
+        unpooled_shape = outputs.size()
+        outputs, indices = self.maxpool_with_argmax(outputs)
         return outputs, indices, unpooled_shape
 
 
-class UpNetLayer_ParticularEncoder_2(nn.Module):
+class UpNetLayer_ParticularEncoder_2(Layer):
     """Derived Class to define an Encoder Layer of UpNet Architecture
 
     Attributes
@@ -334,6 +537,7 @@ class UpNetLayer_ParticularEncoder_2(nn.Module):
         if layer_size == 2:
             self.conv1 = conv2DBatchNormRelu(in_size, out_size, 3, 1, 10)
             self.conv2 = conv2DBatchNormRelu(out_size, out_size, 3, 1, 1)
+            self.conv3 = nn.Identity()
             self.maxpool_with_argmax = nn.MaxPool2d(kernel_size=2,
                                                     padding=0,
                                                     stride=2,
@@ -347,19 +551,19 @@ class UpNetLayer_ParticularEncoder_2(nn.Module):
                                                     stride=2,
                                                     return_indices=True)
 
-    def forward(self, inputs, layer_size):
+    def forward(self, inputs):
         """Processing in Sequential - See PyTorch Doc"""
-        if layer_size == 2:
-            outputs = self.conv1(inputs)
-            outputs = self.conv2(outputs)
-            unpooled_shape = outputs.size()
-            outputs, indices = self.maxpool_with_argmax(outputs)
-        else:
-            outputs = self.conv1(inputs)
-            outputs = self.conv2(outputs)
-            outputs = self.conv3(outputs)
-            unpooled_shape = outputs.size()
-            outputs, indices = self.maxpool_with_argmax(outputs)
+        if not torch.jit.is_scripting() and self._checkpointing():
+            return self._checkpointed(inputs)
+        return self._forward(inputs)
+
+    def _forward(self, inputs):
+        """Processing in Sequential - See PyTorch Doc"""
+        outputs = self.conv1(inputs)
+        outputs = self.conv2(outputs)
+        outputs = self.conv3(outputs)
+        unpooled_shape = outputs.size()
+        outputs, indices = self.maxpool_with_argmax(outputs)
         return outputs, indices, unpooled_shape
 
 
@@ -394,7 +598,7 @@ class UpNetLayer_Dropout(nn.Module):
         return outputs
 
 
-class UpNetLayer_Decoder_Particular(nn.Module):
+class UpNetLayer_Decoder_Particular(Layer):
     """Derived Class to define a Decoder Layer of UpNet Architecture
 
     Attributes
@@ -416,32 +620,32 @@ class UpNetLayer_Decoder_Particular(nn.Module):
     def __init__(self, in_size, out_size, layer_size):
         super(UpNetLayer_Decoder_Particular, self).__init__()
         if layer_size == 2:
-            self.unpool = nn.MaxUnpool2d(2, padding=0, stride=2)
+            self.unpool = MaxUnpool(2, padding=0, stride=2)
             self.conv1 = conv2DBatchNormRelu(in_size, in_size, 3, 1, 1)
             self.conv2 = conv2DBatchNormRelu(in_size, out_size, 3, 1, 1)
+            self.conv3 = nn.Identity()
         else:
-            self.unpool = nn.MaxUnpool2d(2, padding=0, stride=2)
+            self.unpool = MaxUnpool(2, padding=0, stride=2)
             self.conv1 = conv2DBatchNormRelu(in_size, in_size, 3, 1, 1)
             self.conv2 = conv2DBatchNormRelu(in_size, in_size, 3, 1, 1)
             self.conv3 = conv2DBatchNormRelu(in_size, out_size, 3, 1, 1)
 
-    def forward(self, inputs, indices, layer_size):
+    def forward(self, inputs, indices):
         """Processing in Sequential - See PyTorch Doc"""
-        if layer_size == 2:
-            outputs = self.unpool(input=inputs, indices=indices)
-            outputs = self.conv1(outputs)
-            outputs = self.conv2(outputs)
-
-        else:
-            outputs = self.unpool(input=inputs, indices=indices)
-            outputs = self.conv1(outputs)
-            outputs = self.conv2(outputs)
-            outputs = self.conv3(outputs)
+        if not torch.jit.is_scripting() and self._checkpointing():
+            return self._checkpointed(inputs, indices)
+        return self._forward(inputs, indices)
 
+    def _forward(self, inputs, indices):
+        """Processing in Sequential - See PyTorch Doc"""
+        outputs = self.unpool(inputs, indices)
+        outputs = self.conv1(outputs)
+        outputs = self.conv2(outputs)
+        outputs = self.conv3(outputs)
         return outputs
 
 
-class UpNetLayer_Decoder(nn.Module):
+class UpNetLayer_Decoder(Layer):
     """Derived Class to define a Decoder Layer of UpNet Architecture
 
     Attributes
@@ -463,32 +667,32 @@ class UpNetLayer_Decoder(nn.Module):
     def __init__(self, in_size, out_size, layer_size):
         super(UpNetLayer_Decoder, self).__init__()
         if layer_size == 2:
-            self.unpool = nn.MaxUnpool2d(1, padding=0, stride=2)
+            self.unpool = MaxUnpool(1, padding=0, stride=2)
             self.conv1 = conv2DBatchNormRelu(in_size, in_size, 3, 1, 1)
             self.conv2 = conv2DBatchNormRelu(in_size, out_size, 3, 1, 1)
+            self.conv3 = nn.Identity()
         else:
-            self.unpool = nn.MaxUnpool2d(1, padding=0, stride=2)
+            self.unpool = MaxUnpool(1, padding=0, stride=2)
             self.conv1 = conv2DBatchNormRelu(in_size, in_size, 3, 1, 1)
             self.conv2 = conv2DBatchNormRelu(in_size, in_size, 3, 1, 1)
             self.conv3 = conv2DBatchNormRelu(in_size, out_size, 3, 1, 1)
 
-    def forward(self, inputs, indices, layer_size):
+    def forward(self, inputs, indices):
         """Processing in Sequential - See PyTorch Doc"""
-        if layer_size == 2:
-            outputs = self.unpool(input=inputs, indices=indices)
-            outputs = self.conv1(outputs)
-            outputs = self.conv2(outputs)
-
-        else:
-            outputs = self.unpool(input=inputs, indices=indices)
-            outputs = self.conv1(outputs)
-            outputs = self.conv2(outputs)
-            outputs = self.conv3(outputs)
+        if not torch.jit.is_scripting() and self._checkpointing():
+            return self._checkpointed(inputs, indices)
+        return self._forward(inputs, indices)
 
+    def _forward(self, inputs, indices):
+        """Processing in Sequential - See PyTorch Doc"""
+        outputs = self.unpool(inputs, indices)
+        outputs = self.conv1(outputs)
+        outputs = self.conv2(outputs)
+        outputs = self.conv3(outputs)
         return outputs
 
 
-class UpNetLayer_Decoder_Particular_2(nn.Module):
+class UpNetLayer_Decoder_Particular_2(Layer):
     """Derived Class to define a Decoder Layer of UpNet Architecture
 
     Attributes
@@ -510,35 +714,35 @@ class UpNetLayer_Decoder_Particular_2(nn.Module):
     def __init__(self, in_size, out_size, layer_size):
         super(UpNetLayer_Decoder_Particular_2, self).__init__()
         if layer_size == 2:
-            self.unpool = nn.MaxUnpool2d(2, padding=0, stride=2)
+            self.unpool = MaxUnpool(2, padding=0, stride=2)
             self.conv1 = conv2DBatchNormRelu(in_size, in_size, 10, 1, 0)
             self.conv2 = conv2DBatchNormRelu(in_size, out_size, 10, 1, 0)
+            self.conv3 = nn.Identity()
         else:
-            self.unpool = nn.MaxUnpool2d(2, padding=0, stride=2)
+            self.unpool = MaxUnpool(2, padding=0, stride=2)
             self.conv1 = conv2DBatchNormRelu(in_size, in_size, 4, 1, 1)
             self.conv2 = conv2DBatchNormRelu(in_size, in_size, 4, 1, 1)
             self.conv3 = conv2DBatchNormRelu(in_size, out_size, 4, 1, 1)
 
-    def forward(self, inputs, indices, layer_size):
+    def forward(self, inputs, indices):
         """Processing in Sequential - See PyTorch Doc"""
-        if layer_size == 2:
-            outputs = self.unpool(input=inputs, indices=indices)
-            outputs = self.conv1(outputs)
-            outputs = self.conv2(outputs)
-
-        else:
-            outputs = self.unpool(input=inputs, indices=indices)
-            outputs = self.conv1(outputs)
-            outputs = self.conv2(outputs)
-            outputs = self.conv3(outputs)
+        if not torch.jit.is_scripting() and self._checkpointing():
+            return self._checkpointed(inputs, indices)
+        return self._forward(inputs, indices)
 
+    def _forward(self, inputs, indices):
+        """Processing in Sequential - See PyTorch Doc"""
+        outputs = self.unpool(inputs, indices)
+        outputs = self.conv1(outputs)
+        outputs = self.conv2(outputs)
+        outputs = self.conv3(outputs)
         return outputs
 
 
 """UNET"""
 
 
-class UNet_Encoder(nn.Module):
+class UNet_Encoder(Layer):
     """Derived Class to define a Encoder Layer of UNet Architecture
 
     Attributes
@@ -566,6 +770,12 @@ class UNet_Encoder(nn.Module):
 
     def forward(self, inputs):
         """Processing in Sequential - See PyTorch Doc"""
+        if not torch.jit.is_scripting() and self._checkpointing():
+            return self._checkpointed(inputs)
+        return self._forward(inputs)
+
+    def _forward(self, inputs):
+        """Processing in Sequential - See PyTorch Doc"""
 
         outputs = self.conv1(inputs)
         outputs = self.conv2(outputs)
@@ -574,7 +784,7 @@ class UNet_Encoder(nn.Module):
         return outputs
 
 
-class UNet_Encoder_Particular(nn.Module):
+class UNet_Encoder_Particular(Layer):
     """Derived Class to define a Encoder Layer of UNet Architecture
 
     Attributes
@@ -600,6 +810,12 @@ class UNet_Encoder_Particular(nn.Module):
 
     def forward(self, inputs):
         """Processing in Sequential - See PyTorch Doc"""
+        if not torch.jit.is_scripting() and self._checkpointing():
+            return self._checkpointed(inputs)
+        return self._forward(inputs)
+
+    def _forward(self, inputs):
+        """Processing in Sequential - See PyTorch Doc"""
 
         outputs = self.conv1(inputs)
         outputs = self.conv2(outputs)
@@ -607,7 +823,7 @@ class UNet_Encoder_Particular(nn.Module):
         return outputs
 
 
-class UNet_Decoder(nn.Module):
+class UNet_Decoder(Layer):
     """Derived Class to define a Decoder Layer of Unet Architecture
 
     Attributes
@@ -633,6 +849,12 @@ class UNet_Decoder(nn.Module):
         self.conv2 = conv2DBatchNormRelu(out_size, out_size, 3, 1, 1)
 
     def forward(self, x1, x2):
+        """Processing in Sequential - See PyTorch Doc"""
+        if not torch.jit.is_scripting() and self._checkpointing():
+            return self._checkpointed(x1, x2)
+        return self._forward(x1, x2)
+
+    def _forward(self, x1, x2):
         x1 = self.unpool(x1)
         diffX = x1.size()[2] - x2.size()[2]
         diffY = x1.size()[3] - x2.size()[3]
@@ -16,6 +16,11 @@ The module structure is the following:
 Vijay Badrinarayanan, Alex Kendall, Roberto Cipolla, Senior Member, IEEE
 
 - ``SegNet`` definition of the SegNet Architecture
+
+---------------------------------------------------------------------
+
+- ``compile_model`` compiled execution path of the networks
+  (torch.compile, TorchScript scripting or tracing)
 """
 from layer import *
 import torch
@@ -36,6 +41,39 @@ class NeuralNetwork(nn.Module):
         pass
 
 
+def compile_model(model, mode='compile', example_inputs=None):
+    """Compiled execution path of a network
+
+    The returned module shares its parameters with ``model``, training
+    it trains ``model``. Activation checkpointing only runs eagerly.
+
+    Parameters
+    ----------
+    model : nn.Module
+        The network.
+
+    mode : str
+        'compile' for torch.compile, 'script' for torch.jit.script and
+        'trace' for torch.jit.trace (shape specialized).
+
+    example_inputs : tuple
+        The inputs of the trace.
+
+    Returns
+    -------
+    compiled : nn.Module
+    """
+    if mode == 'compile':
+        return torch.compile(model)
+    if mode == 'script':
+        return torch.jit.script(model)
+    if mode == 'trace':
+        if example_inputs is None:
+            raise ValueError('trace needs example_inputs')
+        return torch.jit.trace(model, example_inputs)
+    raise ValueError('mode has to be compile, script or trace')
+
+
 """SEGNET"""
 
 
@@ -50,13 +88,16 @@ class SegNet(nn.Module):
     n_classes : int
         The output size of the network.
 
+    checkpoint : bool
+        The activation checkpointing toggle, see ``set_checkpoint``.
+
     References
     ----------
     SegNet: A Deep Convolutional Encoder-Decoder Architecture
     for Image Segmentation
     Vijay Badrinarayanan, Alex Kendall, Roberto Cipolla, Senior Member, IEEE,
     """
-    def __init__(self, in_channels=3, n_classes=21):
+    def __init__(self, in_channels=3, n_classes=21, checkpoint=False):
         """Sequential Instanciation of the different Layers"""
         super(SegNet, self).__init__()
 
@@ -72,30 +113,43 @@ class SegNet(nn.Module):
         self.layer_9 = SegnetLayer_Decoder(128, 64, 2)
         self.layer_10 = SegnetLayer_Decoder(64, n_classes, 2)
 
+        self.set_checkpoint(checkpoint)
+
+    def set_checkpoint(self, enabled=True):
+        """Toggle the activation checkpointing of the layers
+
+        The layers are recomputed during backward, only their outputs
+        (pool indices and shapes included) are kept after forward.
+        """
+        checkpoint_layers(self, enabled)
+
+    def fuse_for_inference(self):
+        """Fold the BatchNorm of the layers into their convolutions
+
+        The network is set in eval mode and can no longer be trained,
+        fuse a copy (``copy.deepcopy``) to keep the trainable one.
+        """
+        return fuse_layers(self)
+
     def forward(self, inputs):
         """Sequential Computation, see nn.Module.forward methods PyTorch"""
 
-        down1, indices_1, unpool_shape1 = self.layer_1(inputs=inputs,
-                                                       layer_size=2)
-        down2, indices_2, unpool_shape2 = self.layer_2(inputs=down1,
-                                                       layer_size=2)
-        down3, indices_3, unpool_shape3 = self.layer_3(inputs=down2,
-                                                       layer_size=3)
-        down4, indices_4, unpool_shape4 = self.layer_4(inputs=down3,
-                                                       layer_size=3)
-        down5, indices_5, unpool_shape5 = self.layer_5(inputs=down4,
-                                                       layer_size=3)
+        down1, indices_1, unpool_shape1 = self.layer_1(inputs=inputs)
+        down2, indices_2, unpool_shape2 = self.layer_2(inputs=down1)
+        down3, indices_3, unpool_shape3 = self.layer_3(inputs=down2)
+        down4, indices_4, unpool_shape4 = self.layer_4(inputs=down3)
+        down5, indices_5, unpool_shape5 = self.layer_5(inputs=down4)
 
         up5 = self.layer_6(inputs=down5, indices=indices_5,
-                           output_shape=unpool_shape5, layer_size=3)
+                           output_shape=unpool_shape5)
         up4 = self.layer_7(inputs=up5, indices=indices_4,
-                           output_shape=unpool_shape4, layer_size=3)
+                           output_shape=unpool_shape4)
         up3 = self.layer_8(inputs=up4, indices=indices_3,
-                           output_shape=unpool_shape3, layer_size=3)
+                           output_shape=unpool_shape3)
         up2 = self.layer_9(inputs=up3, indices=indices_2,
-                           output_shape=unpool_shape2, layer_size=2)
+                           output_shape=unpool_shape2)
         output = self.layer_10(inputs=up2, indices=indices_1,
-                               output_shape=unpool_shape1, layer_size=2)
+                               output_shape=unpool_shape1)
 
         return output
 
@@ -153,13 +207,16 @@ class SegNet_1(nn.Module):
     n_classes : int
         The output size of the network.
 
+    checkpoint : bool
+        The activation checkpointing toggle, see ``set_checkpoint``.
+
     References
     ----------
     SegNet: A Deep Convolutional Encoder-Decoder Architecture
     for Image Segmentation
     Vijay Badrinarayanan, Alex Kendall, Roberto Cipolla, Senior Member, IEEE,
     """
-    def __init__(self, in_channels=3, n_classes=21):
+    def __init__(self, in_channels=3, n_classes=21, checkpoint=False):
         """Sequential Instanciation of the different Layers"""
         super(SegNet_1, self).__init__()
 
@@ -177,33 +234,45 @@ class SegNet_1(nn.Module):
         self.layer_11 = SegnetLayer_Decoder(128, 64, 2)
         self.layer_12 = SegnetLayer_Decoder(64, n_classes, 2)
 
+        self.set_checkpoint(checkpoint)
+
+    def set_checkpoint(self, enabled=True):
+        """Toggle the activation checkpointing of the layers
+
+        The layers are recomputed during backward, only their outputs
+        (pool indices and shapes included) are kept after forward.
+        """
+        checkpoint_layers(self, enabled)
+
+    def fuse_for_inference(self):
+        """Fold the BatchNorm of the layers into their convolutions
+
+        The network is set in eval mode and can no longer be trained,
+        fuse a copy (``copy.deepcopy``) to keep the trainable one.
+        """
+        return fuse_layers(self)
+
     def forward(self, inputs):
         """Sequential Computation, see nn.Module.forward methods PyTorch"""
 
-        down1, indices_1, unpool_shape1 = self.layer_1(inputs=inputs,
-                                                       layer_size=2)
-        down2, indices_2, unpool_shape2 = self.layer_2(inputs=down1,
-                                                       layer_size=2)
-        down3, indices_3, unpool_shape3 = self.layer_3(inputs=down2,
-                                                       layer_size=3)
-        down4, indices_4, unpool_shape4 = self.layer_4(inputs=down3,
-                                                       layer_size=3)
-        down5, indices_5, unpool_shape5 = self.layer_5(inputs=down4,
-                                                       layer_size=3)
-        down6, indices_6, unpool_shape6 = self.layer_6(inputs=down5,
-                                                       layer_size=3)
+        down1, indices_1, unpool_shape1 = self.layer_1(inputs=inputs)
+        down2, indices_2, unpool_shape2 = self.layer_2(inputs=down1)
+        down3, indices_3, unpool_shape3 = self.layer_3(inputs=down2)
+        down4, indices_4, unpool_shape4 = self.layer_4(inputs=down3)
+        down5, indices_5, unpool_shape5 = self.layer_5(inputs=down4)
+        down6, indices_6, unpool_shape6 = self.layer_6(inputs=down5)
         up5 = self.layer_7(inputs=down6, indices=indices_6,
-                           output_shape=unpool_shape6, layer_size=3)
+                           output_shape=unpool_shape6)
         up4 = self.layer_8(inputs=up5, indices=indices_5,
-                           output_shape=unpool_shape5, layer_size=3)
+                           output_shape=unpool_shape5)
         up3 = self.layer_9(inputs=up4, indices=indices_4,
-                           output_shape=unpool_shape4, layer_size=3)
+                           output_shape=unpool_shape4)
         up2 = self.layer_10(inputs=up3, indices=indices_3,
-                            output_shape=unpool_shape3, layer_size=3)
+                            output_shape=unpool_shape3)
         up1 = self.layer_11(inputs=up2, indices=indices_2,
-                            output_shape=unpool_shape2, layer_size=2)
+                            output_shape=unpool_shape2)
         output = self.layer_12(inputs=up1, indices=indices_1,
-                               output_shape=unpool_shape1, layer_size=2)
+                               output_shape=unpool_shape1)
 
         return output
 
@@ -222,12 +291,15 @@ class UpNet(nn.Module):
     n_classes : int
         The output size of the network.
 
+    checkpoint : bool
+        The activation checkpointing toggle, see ``set_checkpoint``.
+
     References
     ----------
     Efficient Deep Models for Monocular Road Segmentation
     Gabriel L. Oliveira, Wolfram Burgard and Thomas Brox
     """
-    def __init__(self, in_channels=3, n_classes=21):
+    def __init__(self, in_channels=3, n_classes=21, checkpoint=False):
         """Sequential Instanciation of the different Layers"""
         super(UpNet, self).__init__()
 
@@ -245,31 +317,44 @@ class UpNet(nn.Module):
         self.layer_10 = UpNetLayer_Decoder(128, 64, 2)
         self.layer_11 = UpNetLayer_Decoder_Particular_2(64, n_classes, 2)
 
+        self.set_checkpoint(checkpoint)
+
+    def set_checkpoint(self, enabled=True):
+        """Toggle the activation checkpointing of the layers
+
+        The layers are recomputed during backward, only their outputs
+        (pool indices and shapes included) are kept after forward.
+        """
+        checkpoint_layers(self, enabled)
+
+    def fuse_for_inference(self):
+        """Fold the BatchNorm of the layers into their convolutions
+
+        The network is set in eval mode and can no longer be trained,
+        fuse a copy (``copy.deepcopy``) to keep the trainable one.
+        """
+        return fuse_layers(self)
+
     def forward(self, inputs):
         """Sequential Computation, see nn.Module.forward methods PyTorch"""
 
-        down1, indices_1, unpool_shape1 = self.layer_1(inputs=inputs,
-                                                       layer_size=2)
-        down2, indices_2, unpool_shape2 = self.layer_2(inputs=down1,
-                                                       layer_size=2)
-        down3, indices_3, unpool_shape3 = self.layer_3(inputs=down2,
-                                                       layer_size=3)
-        down4, indices_4, unpool_shape4 = self.layer_4(inputs=down3,
-                                                       layer_size=3)
-        down5, indices_5, unpool_shape5 = self.layer_6(inputs=down4,
-                                                       layer_size=3)
+        down1, indices_1, unpool_shape1 = self.layer_1(inputs=inputs)
+        down2, indices_2, unpool_shape2 = self.layer_2(inputs=down1)
+        down3, indices_3, unpool_shape3 = self.layer_3(inputs=down2)
+        down4, indices_4, unpool_shape4 = self.layer_4(inputs=down3)
+        down5, indices_5, unpool_shape5 = self.layer_6(inputs=down4)
 
         inter = self.layer_inter(down5)
 
-        up1 = self.layer_7(inputs=inter, indices=indices_5, layer_size=3)
+        up1 = self.layer_7(inputs=inter, indices=indices_5)
 
-        up2 = self.layer_8(inputs=up1, indices=indices_4, layer_size=3)
+        up2 = self.layer_8(inputs=up1, indices=indices_4)
 
-        up3 = self.layer_9(inputs=up2, indices=indices_3, layer_size=3)
+        up3 = self.layer_9(inputs=up2, indices=indices_3)
 
-        up4 = self.layer_10(inputs=up3, indices=indices_2, layer_size=2)
+        up4 = self.layer_10(inputs=up3, indices=indices_2)
 
-        up5 = self.layer_11(inputs=up4, indices=indices_1, layer_size=2)
+        up5 = self.layer_11(inputs=up4, indices=indices_1)
         return up5
 
 
@@ -287,11 +372,14 @@ class U_Net(nn.Module):
     n_classes : int
         The output size of the network.
 
+    checkpoint : bool
+        The activation checkpointing toggle, see ``set_checkpoint``.
+
     References
     ----------
     U-Net: Convolutional Networks for Biomedical Image Segmentation
     """
-    def __init__(self, in_channels=3, n_classes=21):
+    def __init__(self, in_channels=3, n_classes=21, checkpoint=False):
         """Sequential Instanciation of the different Layers"""
         super(U_Net, self).__init__()
 
@@ -309,6 +397,24 @@ class U_Net(nn.Module):
 
         self.layer_11 = UNet_Decoder_Particular(64, n_classes)
 
+        self.set_checkpoint(checkpoint)
+
+    def set_checkpoint(self, enabled=True):
+        """Toggle the activation checkpointing of the layers
+
+        The layers are recomputed during backward, only their outputs
+        (pool indices and shapes included) are kept after forward.
+        """
+        checkpoint_layers(self, enabled)
+
+    def fuse_for_inference(self):
+        """Fold the BatchNorm of the layers into their convolutions
+
+        The network is set in eval mode and can no longer be trained,
+        fuse a copy (``copy.deepcopy``) to keep the trainable one.
+        """
+        return fuse_layers(self)
+
     def forward(self, inputs):
         """Sequential Computation, see nn.Module.forward methods PyTorch"""
 
@@ -341,7 +447,10 @@ class MultiSegNet(nn.Module):
     Attributes
     ----------
     in_channels : int
-        The input size of the network.
+        The input size of the first modality.
+
+    in_channels1 : int
+        The input size of the second modality.
 
     n_classes : int
         The output size of the network.
@@ -354,7 +463,7 @@ class MultiSegNet(nn.Module):
     """
     def __init__(self, in_channels=3, in_channels1=3, n_classes=21):
         """Sequential Instanciation of the different Layers"""
-        super(SegNet, self).__init__()
+        super(MultiSegNet, self).__init__()
 
         self.layer_1 = SegnetLayer_Encoder(in_channels, 64, 2)
         self.layer_2 = SegnetLayer_Encoder(64, 128, 2)
@@ -382,54 +491,52 @@ class MultiSegNet(nn.Module):
 
         self.layer_1110 = UNet_Decoder_Particular(n_classes * 2, n_classes)
 
+    def fuse_for_inference(self):
+        """Fold the BatchNorm of the layers into their convolutions
+
+        The network is set in eval mode and can no longer be trained,
+        fuse a copy (``copy.deepcopy``) to keep the trainable one.
+        """
+        return fuse_layers(self)
+
     def forward(self, inputs, inputs1):
         """Sequential Computation, see nn.Module.forward methods PyTorch"""
 
-        down1, indices_1, unpool_shape1 = self.layer_1(inputs=inputs,
-                                                       layer_size=2)
-        down2, indices_2, unpool_shape2 = self.layer_2(inputs=down1,
-                                                       layer_size=2)
-        down3, indices_3, unpool_shape3 = self.layer_3(inputs=down2,
-                                                       layer_size=3)
-        down4, indices_4, unpool_shape4 = self.layer_4(inputs=down3,
-                                                       layer_size=3)
-        down5, indices_5, unpool_shape5 = self.layer_5(inputs=down4,
-                                                       layer_size=3)
+        down1, indices_1, unpool_shape1 = self.layer_1(inputs=inputs)
+        down2, indices_2, unpool_shape2 = self.layer_2(inputs=down1)
+        down3, indices_3, unpool_shape3 = self.layer_3(inputs=down2)
+        down4, indices_4, unpool_shape4 = self.layer_4(inputs=down3)
+        down5, indices_5, unpool_shape5 = self.layer_5(inputs=down4)
 
         up5 = self.layer_6(inputs=down5, indices=indices_5,
-                           output_shape=unpool_shape5, layer_size=3)
+                           output_shape=unpool_shape5)
         up4 = self.layer_7(inputs=up5, indices=indices_4,
-                           output_shape=unpool_shape4, layer_size=3)
+                           output_shape=unpool_shape4)
         up3 = self.layer_8(inputs=up4, indices=indices_3,
-                           output_shape=unpool_shape3, layer_size=3)
+                           output_shape=unpool_shape3)
         up2 = self.layer_9(inputs=up3, indices=indices_2,
-                           output_shape=unpool_shape2, layer_size=2)
+                           output_shape=unpool_shape2)
         output = self.layer_10(inputs=up2, indices=indices_1,
-                               output_shape=unpool_shape1, layer_size=2)
+                               output_shape=unpool_shape1)
 
         # Second Modality
 
-        down11, indices_11, unpool_shape11 = self.layer_11(inputs=inputs,
-                                                           layer_size=2)
-        down12, indices_12, unpool_shape12 = self.layer_12(inputs=down1,
-                                                           layer_size=2)
-        down13, indices_13, unpool_shape13 = self.layer_13(inputs=down2,
-                                                           layer_size=3)
-        down14, indices_14, unpool_shape14 = self.layer_14(inputs=down3,
-                                                           layer_size=3)
-        down15, indices_15, unpool_shape15 = self.layer_15(inputs=down4,
-                                                           layer_size=3)
+        down11, indices_11, unpool_shape11 = self.layer_11(inputs=inputs1)
+        down12, indices_12, unpool_shape12 = self.layer_12(inputs=down11)
+        down13, indices_13, unpool_shape13 = self.layer_13(inputs=down12)
+        down14, indices_14, unpool_shape14 = self.layer_14(inputs=down13)
+        down15, indices_15, unpool_shape15 = self.layer_15(inputs=down14)
 
         up15 = self.layer_16(inputs=down15, indices=indices_15,
-                             output_shape=unpool_shape15, layer_size=3)
+                             output_shape=unpool_shape15)
         up14 = self.layer_17(inputs=up15, indices=indices_14,
-                             output_shape=unpool_shape4, layer_size=3)
+                             output_shape=unpool_shape14)
         up13 = self.layer_18(inputs=up14, indices=indices_13,
-                             output_shape=unpool_shape13, layer_size=3)
+                             output_shape=unpool_shape13)
         up12 = self.layer_19(inputs=up13, indices=indices_12,
-                             output_shape=unpool_shape12, layer_size=2)
+                             output_shape=unpool_shape12)
         output1 = self.layer_110(inputs=up12, indices=indices_11,
-                                 output_shape=unpool_shape11, layer_size=2)
+                                 output_shape=unpool_shape11)
 
         # End Pipe
 
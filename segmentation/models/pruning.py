@@ -0,0 +1,276 @@
+"""Structured channel pruning of the SegNet networks
+
+This module removes whole filters of the convolutions of ``SegNet`` and
+``SegNet_1`` and rebuilds smaller layers, the pruned network is a plain
+nn.Module which can be fine-tuned (``Routine.prune`` then ``fit``).
+
+The module structure is the following:
+
+- The ``segnet_groups`` function lists the ``conv2DBatchNormRelu`` units
+  of the network in execution order and the groups of units whose
+  output channels have to be pruned together. The last unit of an
+  encoder and the last unit of the decoder feeding the unpooling of its
+  indices form one group: the unpooled channel ``c`` is placed with the
+  indices of the encoder channel ``c``, both keep the same channels.
+- The ``prune_segnet`` function ranks the channels of every group by the
+  magnitude of their BatchNorm gamma and slices the convolutions and
+  BatchNorm of the units, and the input channels of the following ones
+- The ``model_cost`` function measures the parameters, the FLOPs and the
+  latency of a network, ``cost_report`` compares two measures
+
+  Example:
+  before = model_cost(model, (1, 3, 256, 256))
+  prune_segnet(model, amount=0.5, layers=['layer_4', 'layer_5',
+                                          'layer_6'])
+  print(cost_report(before, model_cost(model, (1, 3, 256, 256))))
+"""
+from timeit import default_timer as timer
+import numpy as np
+import torch
+import torch.nn as nn
+
+# the layers are recognised by name, nn.py imports ``layer`` as a top
+# level module and its classes differ from segmentation.models.layer
+_ENCODER = 'SegnetLayer_Encoder'
+_DECODER = 'SegnetLayer_Decoder'
+
+
+def _units(layer):
+    """conv2DBatchNormRelu units of a Segnet layer, in execution order"""
+    return [conv for conv in (layer.conv1, layer.conv2, layer.conv3)
+            if hasattr(conv, 'cbr_unit')]
+
+
+def segnet_groups(model):
+    """Units of a SegNet and the groups pruned together
+
+    Parameters
+    ----------
+    model : nn.Module
+        A network made of Segnet encoders followed by as many decoders,
+        the decoder ``j`` unpooling with the indices of the encoder
+        ``n - 1 - j`` (``SegNet``, ``SegNet_1``).
+
+    Returns
+    -------
+    units : List[(str, conv2DBatchNormRelu)]
+        The name of the layer and the unit, in execution order, each unit
+        feeds the next one (the poolings keep the channels).
+
+    groups : List[List[int]]
+        The indices in units of the outputs sharing their channels. The
+        output of the last unit (the classes) is in no group.
+    """
+    encoders, decoders = [], []
+    for name, layer in model.named_children():
+        if type(layer).__name__ == _ENCODER:
+            encoders.append((name, layer))
+        elif type(layer).__name__ == _DECODER:
+            decoders.append((name, layer))
+    if not encoders or len(encoders) != len(decoders):
+        raise ValueError('pruning needs a SegNet with as many encoders as '
+                         'decoders')
+
+    units, ends = [], []
+    for name, layer in encoders + decoders:
+        units += [(name, unit) for unit in _units(layer)]
+        ends.append(len(units) - 1)
+
+    n = len(encoders)
+    coupled = {}
+    for i in range(n - 1):
+        # the output of this decoder is unpooled with the indices of i
+        coupled[ends[n + n - 2 - i]] = ends[i]
+
+    groups, grouped = [], {}
+    for index in range(len(units) - 1):
+        if index in coupled:
+            grouped[coupled[index]].append(index)
+        else:
+            grouped[index] = [index]
+            groups.append(grouped[index])
+    return units, groups
+
+
+def _conv_bn(unit):
+    conv, bn = unit.cbr_unit[0], unit.cbr_unit[1]
+    if not isinstance(bn, nn.BatchNorm2d):
+        raise ValueError('pruning needs the BatchNorm, prune before '
+                         'fuse_for_inference')
+    return conv, bn
+
+
+def _importance(units):
+    """Channel scores of a group, |gamma| normalized per unit"""
+    score = 0
+    for unit in units:
+        gamma = _conv_bn(unit)[1].weight.detach().abs().cpu()
+        score = score + gamma / gamma.max().clamp(min=1e-12)
+    return score
+
+
+def _slice_conv(conv, keep_out=None, keep_in=None):
+    weight = conv.weight.detach()
+    bias = None if conv.bias is None else conv.bias.detach()
+    if keep_out is not None:
+        weight = weight[keep_out]
+        bias = None if bias is None else bias[keep_out]
+    if keep_in is not None:
+        weight = weight[:, keep_in]
+    sliced = nn.Conv2d(weight.size(1), weight.size(0), conv.kernel_size,
+                       stride=conv.stride, padding=conv.padding,
+                       dilation=conv.dilation, bias=bias is not None)
+    sliced = sliced.to(device=weight.device, dtype=weight.dtype)
+    sliced.weight.data.copy_(weight)
+    if bias is not None:
+        sliced.bias.data.copy_(bias)
+    sliced.train(conv.training)
+    return sliced
+
+
+def _slice_bn(bn, keep):
+    sliced = nn.BatchNorm2d(len(keep), eps=bn.eps, momentum=bn.momentum)
+    sliced = sliced.to(device=bn.weight.device, dtype=bn.weight.dtype)
+    sliced.weight.data.copy_(bn.weight.detach()[keep])
+    sliced.bias.data.copy_(bn.bias.detach()[keep])
+    sliced.running_mean.copy_(bn.running_mean[keep])
+    sliced.running_var.copy_(bn.running_var[keep])
+    sliced.num_batches_tracked.copy_(bn.num_batches_tracked)
+    sliced.train(bn.training)
+    return sliced
+
+
+def prune_segnet(model, amount=0.5, layers=None, min_channels=8):
+    """Remove the least important channels of a SegNet, in place
+
+    Parameters
+    ----------
+    model : nn.Module
+        The network, see ``segnet_groups``, not fused.
+
+    amount : float
+        The share of the channels of every pruned group removed.
+
+    layers : List[str]
+        The names of the layers pruned (e.g. ['layer_4', 'layer_5',
+        'layer_6']), None for all. A group is pruned as soon as one of
+        its units is in these layers.
+
+    min_channels : int
+        The smallest number of channels kept in a group.
+
+    Returns
+    -------
+    model : nn.Module
+        The pruned network (the optimizers of its former parameters have
+        to be rebuilt).
+    """
+    if not 0 <= amount < 1:
+        raise ValueError('amount has to be in [0, 1)')
+    units, groups = segnet_groups(model)
+
+    keeps = {}
+    for group in groups:
+        if layers is not None and not any(units[i][0] in layers
+                                          for i in group):
+            continue
+        score = _importance([units[i][1] for i in group])
+        n_keep = max(min(min_channels, len(score)),
+                     int(round(len(score) * (1 - amount))))
+        if n_keep == len(score):
+            continue
+        keep = torch.argsort(score, descending=True)[:n_keep]
+        keep = torch.sort(keep)[0]
+        for i in group:
+            keeps[i] = keep
+
+    for i, (name, unit) in enumerate(units):
+        keep_out, keep_in = keeps.get(i), keeps.get(i - 1)
+        if keep_out is None and keep_in is None:
+            continue
+        conv, bn = _conv_bn(unit)
+        device = conv.weight.device
+        keep_out = None if keep_out is None else keep_out.to(device)
+        keep_in = None if keep_in is None else keep_in.to(device)
+        conv = _slice_conv(conv, keep_out, keep_in)
+        if keep_out is not None:
+            bn = _slice_bn(bn, keep_out)
+        unit.cbr_unit[0] = conv
+        unit.cbr_unit[1] = bn
+    return model
+
+
+def channel_widths(model):
+    """Output channels of the units of every layer of a SegNet"""
+    widths = {}
+    for name, unit in segnet_groups(model)[0]:
+        widths.setdefault(name, []).append(unit.cbr_unit[0].out_channels)
+    return widths
+
+
+def count_flops(model, inputs):
+    """Multiply-adds x 2 of the convolutions of a forward on inputs"""
+    flops = []
+
+    def hook(module, args, output):
+        kernel = module.weight[0].numel()
+        flops.append(2 * output.numel() * kernel)
+
+    handles = [module.register_forward_hook(hook)
+               for module in model.modules()
+               if isinstance(module, nn.Conv2d)]
+    try:
+        with torch.no_grad():
+            model(inputs)
+    finally:
+        for handle in handles:
+            handle.remove()
+    return int(sum(flops))
+
+
+def model_cost(model, input_shape=(1, 3, 256, 256), steps=5):
+    """Parameters, FLOPs and latency of a network
+
+    Returns
+    -------
+    cost : dict
+        'params' : number of parameters
+        'flops' : FLOPs of the convolutions of a forward
+        'latency' : median seconds of a forward (eval mode)
+    """
+    device = torch.device('cpu')
+    for param in model.parameters():
+        device = param.device
+        break
+    training = model.training
+    model.eval()
+    inputs = torch.randn(*input_shape, device=device)
+    try:
+        flops = count_flops(model, inputs)
+        times = []
+        with torch.no_grad():
+            for _ in range(steps):
+                if device.type == 'cuda':
+                    torch.cuda.synchronize()
+                start = timer()
+                model(inputs)
+                if device.type == 'cuda':
+                    torch.cuda.synchronize()
+                times.append(timer() - start)
+    finally:
+        model.train(training)
+    return {'params': sum(p.numel() for p in model.parameters()),
+            'flops': flops,
+            'latency': float(np.median(times))}
+
+
+def cost_report(before, after):
+    """Text comparing two ``model_cost`` measures"""
+    lines = ['%-13s %12s %12s %8s' % ('', 'before', 'after', 'ratio')]
+    for key, label, scale in (('params', 'params (M)', 1e6),
+                              ('flops', 'GFLOPs', 1e9),
+                              ('latency', 'latency (ms)', 1e-3)):
+        lines.append('%-13s %12.3f %12.3f %8.3f' % (
+            label, before[key] / scale, after[key] / scale,
+            after[key] / max(before[key], 1e-12)))
+    return '\n'.join(lines)
@@ -1,16 +1,30 @@
 import torch
 from torch import nn
+import torch.distributed as dist
 import sys
+import copy
+import socket
+import shutil
+import tempfile
+import contextlib
+import numpy as np
 import torch.optim as optim
+from timeit import default_timer as timer
 
 sys.path.append('../')
 from database import dataloaderSegmentation
 from utils import metrics
+from utils.tiling import TiledInference
+from utils.writer import AsyncWriter
+from utils.profiler import LayerProfiler
+from utils.instrumentation import Instrumentation
+from segmentation.models import export, pruning
 import warnings
 from tqdm import tqdm
 import torch.nn.functional as F
 from torch.autograd import Variable
 import glob
+import os
 
 
 class Routine(object):
@@ -36,6 +50,50 @@ class Routine(object):
 
             self._stop_crit = False
 
+            self._precision = 'fp32'
+
+            self._accum_steps = 1
+
+            self._micro_batch = None
+
+            self._fuse = True
+
+            self._fused = None
+
+            self._tile_size = None
+
+            self._tile_overlap = 64
+
+            self._tile_batch = 4
+
+            self._writer_workers = 2
+
+            self._writer_queue = 32
+
+            self._world_size = 1
+
+            self._rank = 0
+
+            self._compile = None
+
+            self._compiled = None
+
+            self._backend = 'torch'
+
+            self._ort = None
+
+            self._onnx_file = None
+
+            self._ort_threads = None
+
+            self._ort_inter_threads = None
+
+            self._parity_tol = 1e-3
+
+            self._profile = None
+
+            self._instrument = None
+
             self._dict_estimation()
 
             self._opt = optim.Adam(self._model.parameters(), lr=self._lr)
@@ -43,11 +101,15 @@ class Routine(object):
             if self._cuda:
                 self._set_Cuda()
 
+            if self._compile is not None:
+                self._compiled = self._compile_model(self._model)
+
             if self._logname is not None:
                 self.metrics = metrics.evaluation(n_classes=self._n_classes,
                                                   lr=self._lr,
                                                   modelstr="Model",
                                                   textfile=self._logname)
+                self._confusion = metrics.torchConfusion(self._n_classes)
             else:
                 warnings.warn("Without log there will be no metrics estimation",
                               RuntimeWarning,
@@ -55,6 +117,8 @@ class Routine(object):
 
     def fit(self):
         '''Train the model'''
+        if self._world_size > 1 and not dist.is_initialized():
+            return self._fit_distributed()
 
         breaker = False
         Loss_store = []
@@ -63,37 +127,83 @@ class Routine(object):
         firstLoss = 0.0
         firstPass = True
         check_metrics = False
-        terminate_metrics = True
 
-        for epoch in range(self._n_ep):
+        self._fused = None
+        self._ort = None
+
+        n_epochs = self._n_ep
+        profiler = None
+        if self._profile is not None:
+            # a single epoch with the layers of the model profiled
+            n_epochs = 1
+            profiler = LayerProfiler(self._module())
+
+        for epoch in range(n_epochs):
             self._model.train()
             aver_Loss = 0
             n_it = 0
             save_epoch = 0
-            for i, data in tqdm(enumerate(self._trainloader, 0)):
+            try:
+                n_batches = len(self._trainloader)
+            except TypeError:
+                n_batches = None
+            sampler = getattr(self._trainloader, 'sampler', None)
+            if hasattr(sampler, 'set_epoch'):
+                sampler.set_epoch(epoch)
+            if profiler is not None:
+                profiler.start()
+            if self._instrument is not None:
+                self._instrument.start_epoch(epoch)
+            for i, data in tqdm(enumerate(self._trainloader, 0),
+                                disable=self._rank != 0):
+                if self._instrument is not None:
+                    self._instrument.data_ready()
                 inputs, labels = data
                 if self._cuda:
-                    inputs = Variable(inputs.cuda())
-                    labels = Variable(labels.cuda())
+                    with self._phase('h2d'):
+                        inputs = inputs.cuda(non_blocking=True)
+                        labels = labels.cuda(non_blocking=True)
+
+                if i == 0 and epoch == 0 and not self._precision == 'fp32':
+                    self._precision_probe(inputs, labels)
+
+                # one optimizer step per logical batch of accumulation_steps
+                # loader batches, the last window of the epoch may be shorter
+                if i % self._accum_steps == 0:
+                    self._opt.zero_grad()
+                    window = self._accum_steps
+                    if n_batches is not None:
+                        window = min(window, n_batches - i)
+
+                loss = self._train_step(inputs, labels, window)
+
+                if (i + 1) % self._accum_steps == 0 or i + 1 == n_batches:
+                    with self._phase('step'):
+                        self._opt.step()
+                    pending = False
                 else:
-                    inputs = Variable(inputs)
-                    labels = Variable(labels)
-
-                self._opt.zero_grad()
-
-                output = self._model(inputs)
-
-                loss = self._loss(output, labels)
-                loss.backward()
-                self._opt.step()
+                    pending = True
 
                 save_epoch = epoch + 1
-                aver_Loss += loss.data
-                n_it = i
-            aver_Loss = aver_Loss / n_it
-            print("Averaged Loss Ep[[%d/%d]] : %f" % (save_epoch,
-                                                      self._n_ep,
-                                                      aver_Loss))
+                aver_Loss += loss
+                n_it = i + 1
+                if self._instrument is not None:
+                    self._instrument.end_step(inputs.size(0))
+            if n_batches is None and pending:
+                with self._phase('step'):
+                    self._opt.step()
+            if profiler is not None:
+                profiler.stop()
+            aver_Loss = aver_Loss / max(n_it, 1)
+            if self._world_size > 1:
+                # same loss, hence same stopping decision, on every process
+                aver_Loss = torch.as_tensor(aver_Loss, dtype=torch.float32)
+                dist.all_reduce(aver_Loss)
+                aver_Loss = aver_Loss / self._world_size
+            if self._rank == 0:
+                print("Averaged Loss Ep[[%d/%d]] : %f" % (save_epoch,
+                                                          n_epochs,
+                                                          aver_Loss))
 
             if firstPass:
                 firstLoss = aver_Loss
@@ -108,7 +218,7 @@ class Routine(object):
                     criterion_break = (self._perc_crit * firstLoss)
                     if (criterion_break < aver_Loss).cpu().numpy():
                         if not counterPercent == 0:
-                            diff = some_list[-1] - some_list[-2]
+                            diff = Loss_store[-1] - Loss_store[-2]
                             if (diff <= (criterion_break * self._perc_crit)).cpu().numpy():
                                 counterPercent += 1
                             else:
@@ -123,79 +233,486 @@ class Routine(object):
                 elif self._conv_crit:
                     check_metrics = True
 
-            self._model.eval()
-
-            for i_val, (images_val,
-                        labels_val) in tqdm(enumerate(self._valloader)):
-                if self._cuda:
-                    images_val = Variable(images_val.cuda(), volatile=True)
-                    labels_val = Variable(labels_val.cuda(), volatile=True)
-                    outputs = self._model(images_val)
-                    pred = outputs.data.max(1)[1].cpu().numpy()
-                    groundtruth = labels_val.data.cpu().numpy()
-                else:
-                    images_val = Variable(images_val, volatile=True)
-                    labels_val = Variable(labels_val, volatile=True)
-                    outputs = self._model(images_val)
-                    pred = outputs.data.max(1)[1].numpy()
-                    groundtruth = labels_val.data.numpy()
-
-                if self._logname is not None:
-                    self.metrics(groundtruth.ravel(), pred.ravel())
-                    metricArray.append(self.metrics.IoU)
-                    if check_metrics:
-                        if not check_metrics[-1] >= check_metrics[-2]:
-                            breaker = True
-                            terminate_metrics = False
-                            break
-
-            if self._logname is not None and terminate_metrics:
-                self.metrics.estimate(epoch, self._n_ep, self._model, self._opt)
+            model = self._module()
+            model.eval()
+
+            with torch.no_grad(), self._phase('validation'):
+                for i_val, (images_val,
+                            labels_val) in tqdm(enumerate(self._valloader),
+                                                disable=self._rank != 0):
+                    if self._cuda:
+                        images_val = images_val.cuda(non_blocking=True)
+                        labels_val = labels_val.cuda(non_blocking=True)
+                    with self._autocast():
+                        outputs = self._run(images_val, model)
+
+                    if self._logname is not None:
+                        # stays on the model device until the epoch ends
+                        self._confusion.update(labels_val,
+                                               outputs.max(1)[1])
+
+            if self._logname is not None and self._world_size > 1:
+                self._confusion.all_reduce()
+            if self._logname is not None and self._rank == 0:
+                self.metrics.accumulate(self._confusion.numpy(),
+                                        self._confusion.n_updates)
+                self.metrics.estimate(epoch, n_epochs, model, self._opt)
                 self.metrics.print_major_metric()
+                metricArray.append(self.metrics.IoU)
                 self.metrics.reset()
+                if check_metrics and len(metricArray) > 1:
+                    if not metricArray[-1] >= metricArray[-2]:
+                        breaker = True
+            if self._logname is not None:
+                self._confusion.reset()
+            if self._instrument is not None:
+                stats = self._instrument.end_epoch({'loss': float(aver_Loss)})
+                if self._rank == 0:
+                    print(self._instrument.summary(stats))
+            if self._world_size > 1:
+                # the metrics criterion is only known by the first process
+                flag = torch.tensor([int(breaker)])
+                dist.broadcast(flag, 0)
+                breaker = bool(flag.item())
             if breaker:
-                print('Stopping Criterion Reached')
-                if self._logname is not None:
+                if self._rank == 0:
+                    print('Stopping Criterion Reached')
+                if self._logname is not None and self._rank == 0:
                     self.metrics.close()
                 break
             else:
-                if self._logname is not None:
+                if self._logname is not None and self._rank == 0:
                     self.metrics.close()
 
-        if not breaker:
+        if not breaker and self._rank == 0:
             print('Stopping Criterion have not been Reached')
 
-    def test(self, loadertest):
-        '''Test the model with one or multiple inputs'''
-        self._model.eval()
+        if profiler is not None and self._rank == 0:
+            self._report_profile(profiler)
+
+    def test(self, loadertest, output=None, sink=None, writer=None):
+        '''Test the model, the predictions are streamed sample by sample
+
+        Parameters
+        ----------
+        loadertest : DataLoader
+            The test loader, its dataset gives the number of samples.
+
+        output : str
+            Optional .npy file receiving the (N, H, W) uint8 predictions
+            through a memory map.
+
+        sink : callable
+            Optional sink(index, pred) called with every (H, W) uint8
+            prediction.
+
+        writer : str or utils.writer.AsyncWriter
+            Optional directory (or writer) where every prediction is
+            written as pred<index>.npz by background threads, see the
+            writer_workers and writer_queue keys.
+
+        Returns
+        -------
+        out : np.ndarray
+            The (N, H, W) uint8 predictions, memory mapped to output if
+            given, None if only a sink or a writer is given.
+        '''
+        own_writer = isinstance(writer, str)
+        if own_writer:
+            writer = AsyncWriter(writer, workers=self._writer_workers,
+                                 max_pending=self._writer_queue)
+
+        out = None
+        for index, pred in enumerate(self.iter_test(loadertest)):
+            if writer is not None:
+                writer.write(index, pred)
+            if sink is not None:
+                sink(index, pred)
+            if out is None and (output is not None or
+                                (sink is None and writer is None)):
+                shape = (len(loadertest.dataset),) + pred.shape
+                if output is not None:
+                    out = np.lib.format.open_memmap(output, mode='w+',
+                                                    dtype=np.uint8,
+                                                    shape=shape)
+                else:
+                    out = np.zeros(shape, dtype=np.uint8)
+            if out is not None:
+                out[index] = pred
+
+        if isinstance(out, np.memmap):
+            out.flush()
+        if writer is not None:
+            if own_writer:
+                writer.close()
+            stats = writer.stats()
+            text = ('Writer : %d written, %d pending (max backlog %d), '
+                    '%.1f files/s, %.2f MB/s, producer blocked %.2fs' % (
+                        stats['written'], stats['pending'],
+                        stats['max_backlog'], stats['files_per_s'],
+                        stats['mb_per_s'], stats['blocked']))
+            print(text)
+            if self._logname is not None:
+                self.metrics.log(text)
+        return out
+
+    def iter_test(self, loadertest):
+        '''Yield the (H, W) uint8 argmax map of every test sample
 
-        out = np.ndarray(shape=(len(loadertest), 2))
+        Only the current batch is held in memory.
+        '''
+        model = None
 
-        for i, (images, labels) in tqdm(enumerate(loadertest)):
+        for images, labels in tqdm(loadertest):
+            # no_grad is not held across the yields, it is thread global
+            with torch.no_grad():
                 if self._cuda:
-                    self._model.cuda()
-                    images = Variable(images.cuda(), volatile=True)
+                    images = images.cuda(non_blocking=True)
+                if model is None:
+                    model = self._predictor(images)
+                if self._tile_size is not None:
+                    tiler = self._tiler(model)
+                    preds = [tiler(image) for image in images]
                 else:
-                    images = Variable(images, volatile=True)
-
-                outputs = self._model(images)
-                pred = outputs.data.max(1)[1].cpu().numpy()
-                if i == 0:
-                    out = np.ndarray(shape=(len(loadertest),
-                                            pred.shape[0],
-                                            pred.shape[1]))
-                out[i] = pred
-
-        return out
+                    outputs = model(images)
+                    if outputs.size(1) > 256:
+                        raise ValueError('uint8 predictions need at most '
+                                         '256 classes')
+                    preds = outputs.argmax(1).to(torch.uint8).cpu().numpy()
+            for pred in preds:
+                yield pred
 
     def predict(self, input_, modelIn=None):
         '''Predict the model with one or multiple inputs'''
-        if model is not None:
+        if modelIn is not None:
             self._model.load_state_dict(modelIn)
+            self._fused = None
+            self._ort = None
+
+        model = self._predictor(input_)
+        if self._tile_size is not None:
+            tiler = self._tiler(model)
+            return torch.stack([tiler.logits(image) for image in input_])
+        with torch.no_grad():
+            output = model(input_)
+        return output
 
+    def prune(self, amount=0.5, layers=None, input_shape=None,
+              min_channels=8):
+        '''Remove the least important channels of a SegNet model
+
+        The channels are ranked by BatchNorm gamma and the layers rebuilt
+        smaller (see segmentation/models/pruning.py), the optimizer is
+        rebuilt on the new parameters so that fit fine-tunes the pruned
+        model. Parameters, FLOPs and latency before and after are printed
+        and logged.
+
+        Parameters
+        ----------
+        amount : float
+            The share of the channels removed from every pruned group.
+
+        layers : List[str]
+            The names of the pruned layers (e.g. ['layer_4', 'layer_5',
+            'layer_6']), None for all.
+
+        input_shape : tuple
+            The input shape of the measures, the shape of the first
+            validation batch if None.
+
+        Returns
+        -------
+        cost : dict
+            The parameters, FLOPs and latency of the pruned model.
+        '''
+        model = self._module()
+        if input_shape is None:
+            input_shape = tuple(next(iter(self._valloader))[0].shape)
+
+        before = pruning.model_cost(model, input_shape)
+        pruning.prune_segnet(model, amount=amount, layers=layers,
+                             min_channels=min_channels)
+        after = pruning.model_cost(model, input_shape)
+
+        self._opt = optim.Adam(model.parameters(), lr=self._lr)
+        self._fused = None
+        self._ort = None
+        if self._compile is not None:
+            self._compiled = self._compile_model(model)
+
+        text = 'Pruning %s of the channels\n%s' % (
+            amount, pruning.cost_report(before, after))
+        print(text)
+        if self._logname is not None:
+            self.metrics.log(text)
+        return after
+
+    def _report_profile(self, profiler):
+        '''Print and log the layer profile of a training epoch
+
+        The profile is also saved as JSON when the profile key is a
+        filename.
+        '''
+        text = ('Layer profile of one training epoch (forward)\n%s' %
+                profiler.table())
+        print(text)
+        if self._logname is not None:
+            self.metrics.log(text)
+        if isinstance(self._profile, str):
+            profiler.to_json(self._profile)
+
+    def _predictor(self, sample):
+        '''Callable computing the logits at inference
+
+        With the onnxruntime backend the inference model is exported to
+        ONNX on the first call and run by ONNX Runtime, its outputs are
+        checked against the eager model on sample.
+        '''
+        model = self._inference_model()
+        if self._backend == 'torch':
+            return model
+        if self._ort is None:
+            if self._compile is not None:
+                # export the eager model, not its compiled version
+                model = copy.deepcopy(self._model).eval()
+                if self._fuse and hasattr(model, 'fuse_for_inference'):
+                    model.fuse_for_inference()
+            sample = sample[:1]
+            if self._tile_size is not None:
+                sample = sample[:, :, :self._tile_size, :self._tile_size]
+            filename = self._onnx_file
+            folder = None
+            if filename is None:
+                folder = tempfile.mkdtemp()
+                filename = os.path.join(folder, 'model.onnx')
+            try:
+                export.export_onnx(model, filename,
+                                   input_shape=tuple(sample.shape))
+                predictor = export.OnnxPredictor(
+                    filename, intra_op_threads=self._ort_threads,
+                    inter_op_threads=self._ort_inter_threads)
+            finally:
+                if folder is not None:
+                    # the session holds the model, the file is not needed
+                    shutil.rmtree(folder, ignore_errors=True)
+            parity = export.check_parity(model, predictor, sample)
+            text = ('ONNX Runtime parity : max abs diff %.2e, argmax '
+                    'agreement %.4f' % (parity['max_abs'],
+                                        parity['agreement']))
+            print(text)
+            if self._logname is not None:
+                self.metrics.log(text)
+            if parity['max_abs'] > self._parity_tol:
+                raise ValueError('ONNX Runtime outputs differ from the '
+                                 'model (%.2e)' % parity['max_abs'])
+            self._ort = predictor
+        return self._ort
+
+    def _tiler(self, model):
+        '''Sliding window inference of model, see utils.tiling'''
+        return TiledInference(model, tile_size=self._tile_size,
+                              overlap=self._tile_overlap,
+                              batch_size=self._tile_batch)
+
+    def _inference_model(self):
+        '''Model used by test and predict, in eval mode
+
+        With fuse_inference the BatchNorm layers are folded into the
+        convolutions of a copy of the model. The copy is built once and
+        dropped whenever the weights change (fit, predict with a state).
+        '''
         self._model.eval()
-        output = self._model(input_)
-        return output
+        if not self._fuse or not hasattr(self._model, 'fuse_for_inference'):
+            if self._compiled is not None:
+                self._compiled.eval()
+                return self._compiled
+            return self._model
+        if self._fused is None:
+            self._fused = copy.deepcopy(self._model).fuse_for_inference()
+            if self._compile is not None:
+                self._fused = self._compile_model(self._fused)
+        return self._fused
+
+    def _compile_model(self, model):
+        '''Compiled version of model, sharing its parameters
+
+        'compile' uses torch.compile, 'script' torch.jit.script (see
+        compile_model in segmentation/models/nn.py).
+        '''
+        if self._compile == 'compile':
+            return torch.compile(model)
+        return torch.jit.script(model)
+
+    def _run(self, inputs, model=None):
+        '''Forward pass, through the compiled model if any'''
+        if model is None:
+            model = self._model
+        if self._compiled is None:
+            return model(inputs)
+        # a scripted copy has its own train / eval flag
+        if self._compiled.training != model.training:
+            self._compiled.train(model.training)
+        return self._compiled(inputs)
+
+    def _module(self):
+        '''The trained model, unwrapped from DistributedDataParallel'''
+        if isinstance(self._model, nn.parallel.DistributedDataParallel):
+            return self._model.module
+        return self._model
+
+    def _fit_distributed(self):
+        '''Train with world_size local processes (gloo backend, DDP)
+
+        Each process trains a replica of the model on its shard of the
+        train set (DistributedSampler), the gradients are averaged by
+        DistributedDataParallel, the batch size of the loader is the batch
+        size per process. The validation set is split between the
+        processes, the confusion matrix and the loss are summed over them
+        and only the first process logs and saves the metrics. The trained
+        weights and optimizer state are loaded back afterwards.
+        '''
+        if self._cuda:
+            raise AttributeError('distributed mode runs on cpu (gloo)')
+
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            init_method = 'tcp://127.0.0.1:%d' % s.getsockname()[1]
+        if self._logname is not None:
+            # header first, the processes append to the same logfile
+            self.metrics.f.flush()
+        fd, result = tempfile.mkstemp(suffix='.pkl')
+        os.close(fd)
+        try:
+            torch.multiprocessing.spawn(_distributed_worker,
+                                        args=(self, init_method, result),
+                                        nprocs=self._world_size)
+            state = torch.load(result)
+        finally:
+            os.remove(result)
+
+        self._model.load_state_dict(state['model_state'])
+        self._opt.load_state_dict(state['optimizer_state'])
+        self._fused = None
+        self._ort = None
+
+    def _distribute(self):
+        '''Wrap the model and shard the loaders in a worker process'''
+        rank, world = self._rank, self._world_size
+        self._model = nn.parallel.DistributedDataParallel(self._model)
+        if self._instrument is not None and rank != 0:
+            # the hooks run in every process, the first one logs
+            self._instrument.logfile = None
+
+        train = self._trainloader
+        sampler = torch.utils.data.DistributedSampler(
+            train.dataset, num_replicas=world, rank=rank,
+            shuffle=isinstance(train.sampler,
+                               torch.utils.data.RandomSampler))
+        self._trainloader = _shard_loader(train, sampler, world)
+
+        # plain split, every validation sample is counted exactly once
+        val = self._valloader
+        self._valloader = _shard_loader(val, range(rank, len(val.dataset),
+                                                   world), world)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # the inference copy is rebuilt on demand
+        state['_fused'] = None
+        state['_compiled'] = None
+        state['_ort'] = None
+        return state
+
+    def _train_step(self, inputs, labels, window=1):
+        '''Forward and backward of a loader batch, split in micro batches
+
+        Each micro batch loss is weighted by its share of the loader batch
+        and divided by the number of loader batches accumulated, so that
+        the accumulated gradient is the one of the whole logical batch
+        with a mean reduced loss. BatchNorm statistics are still computed
+        per micro batch.
+
+        Returns the (detached) loss of the loader batch.
+        '''
+        n_samples = inputs.size(0)
+        micro = self._micro_batch or n_samples
+        total = 0.
+        for start in range(0, n_samples, micro):
+            chunk = inputs[start:start + micro]
+            with self._autocast():
+                with self._phase('forward'):
+                    output = self._run(chunk)
+                with self._phase('loss'):
+                    # the labels may be kept in uint8 up to here
+                    loss = self._loss(output,
+                                      labels[start:start + micro].long())
+            weight = chunk.size(0) / float(n_samples)
+            with self._phase('backward'):
+                (loss * (weight / window)).backward()
+            total += loss.detach() * weight
+        return total
+
+    def _phase(self, name):
+        '''Timer of a phase of the training step, see instrumentation'''
+        if self._instrument is None:
+            return contextlib.nullcontext()
+        return self._instrument.phase(name)
+
+    def _autocast(self, precision=None):
+        '''Autocast context of the forward pass and the loss'''
+        if precision is None:
+            precision = self._precision
+        return torch.autocast(device_type='cuda' if self._cuda else 'cpu',
+                              dtype=torch.bfloat16,
+                              enabled=precision == 'bf16')
+
+    def _precision_probe(self, inputs, labels, repeats=3):
+        '''Compare throughput and memory of fp32 and self._precision
+
+        Runs forward, loss and backward a few times on the same batch in
+        both precisions. Memory is measured as the bytes of the tensors
+        saved for backward (activations and casted weights). The model
+        state is restored afterwards.
+        '''
+        state = copy.deepcopy(self._model.state_dict())
+        saved = [0]
+
+        def pack(tensor):
+            saved[0] += tensor.numel() * tensor.element_size()
+            return tensor
+
+        report = {}
+        for precision in ('fp32', self._precision):
+            times = []
+            for _ in range(repeats + 1):
+                saved[0] = 0
+                start = timer()
+                with torch.autograd.graph.saved_tensors_hooks(
+                        pack, lambda tensor: tensor):
+                    with self._autocast(precision):
+                        loss = self._loss(self._model(inputs),
+                                          labels.long())
+                loss.backward()
+                if self._cuda:
+                    torch.cuda.synchronize()
+                times.append(timer() - start)
+                self._opt.zero_grad()
+            report[precision] = (inputs.size(0) / np.median(times[1:]),
+                                 saved[0] / 2 ** 20)
+        self._model.load_state_dict(state)
+
+        text = ('Precision %s vs fp32 : %.2f vs %.2f samples/s (x%.2f), '
+                '%.1f vs %.1f MB saved for backward (%+.1f%%)' % (
+                    self._precision,
+                    report[self._precision][0], report['fp32'][0],
+                    report[self._precision][0] / report['fp32'][0],
+                    report[self._precision][1], report['fp32'][1],
+                    100. * (report[self._precision][1] /
+                            report['fp32'][1] - 1.)))
+        print(text)
+        if self._logname is not None:
+            self.metrics.log(text)
+        return report
 
     def _dict_estimation(self):
         '''Initialization according to input dictionaty'''
@@ -243,7 +760,8 @@ class Routine(object):
                 self._valloader = self._load_(self.dict['valinput'],
                                               self.dict['valtarget'],
                                               self.dict['inputTransform'],
-                                              self.dict['targetTransform']
+                                              self.dict['targetTransform'],
+                                              split='val'
                                               )
             else:
                 sys.stderr.write('''Input dictionnary have to specify
@@ -272,6 +790,87 @@ class Routine(object):
             if 'n_classes' in self.dict:
                 self._n_classes = self.dict['n_classes']
 
+        if 'precision' in self.dict:
+            if self.dict['precision'] not in ('fp32', 'bf16'):
+                raise AttributeError('precision has to be fp32 or bf16')
+            self._precision = self.dict['precision']
+
+        if 'accumulation_steps' in self.dict:
+            if int(self.dict['accumulation_steps']) < 1:
+                raise AttributeError('accumulation_steps has to be >= 1')
+            self._accum_steps = int(self.dict['accumulation_steps'])
+
+        if 'micro_batch' in self.dict:
+            if self.dict['micro_batch'] is not None and \
+                    int(self.dict['micro_batch']) < 1:
+                raise AttributeError('micro_batch has to be >= 1')
+            self._micro_batch = self.dict['micro_batch']
+
+        if 'fuse_inference' in self.dict:
+            self._fuse = self.dict['fuse_inference']
+
+        if 'tile_size' in self.dict:
+            self._tile_size = self.dict['tile_size']
+
+        if 'tile_overlap' in self.dict:
+            self._tile_overlap = self.dict['tile_overlap']
+
+        if 'tile_batch' in self.dict:
+            self._tile_batch = self.dict['tile_batch']
+
+        if 'writer_workers' in self.dict:
+            self._writer_workers = self.dict['writer_workers']
+
+        if 'writer_queue' in self.dict:
+            self._writer_queue = self.dict['writer_queue']
+
+        if 'distributed' in self.dict:
+            if int(self.dict['distributed']) < 1:
+                raise AttributeError('distributed has to be >= 1')
+            self._world_size = int(self.dict['distributed'])
+
+        if 'compile' in self.dict:
+            if self.dict['compile'] not in (None, 'compile', 'script'):
+                raise AttributeError('compile has to be compile or script')
+            if self.dict['compile'] is not None and self._world_size > 1:
+                raise AttributeError('compile is not supported with '
+                                     'distributed')
+            self._compile = self.dict['compile']
+
+        if 'backend' in self.dict:
+            if self.dict['backend'] not in ('torch', 'onnxruntime'):
+                raise AttributeError('backend has to be torch or '
+                                     'onnxruntime')
+            if self.dict['backend'] == 'onnxruntime' and self._cuda:
+                raise AttributeError('onnxruntime backend runs on cpu')
+            self._backend = self.dict['backend']
+
+        if 'onnx_file' in self.dict:
+            self._onnx_file = self.dict['onnx_file']
+
+        if 'ort_threads' in self.dict:
+            self._ort_threads = self.dict['ort_threads']
+
+        if 'ort_inter_threads' in self.dict:
+            self._ort_inter_threads = self.dict['ort_inter_threads']
+
+        if 'parity_tolerance' in self.dict:
+            self._parity_tol = self.dict['parity_tolerance']
+
+        if 'profile' in self.dict:
+            if self.dict['profile'] is not None and \
+                    self._compile is not None:
+                raise AttributeError('profile needs the eager model, not '
+                                     'compile')
+            self._profile = self.dict['profile']
+
+        if self.dict.get('instrumentation') or self.dict.get('hooks'):
+            # a JSONL filename, or True to only print the epoch summaries
+            logfile = self.dict.get('instrumentation')
+            self._instrument = Instrumentation(
+                logfile=logfile if isinstance(logfile, str) else None,
+                hooks=self.dict.get('hooks'), cuda=self._cuda)
+
         if 'stop_criterion' in self.dict:
             self._stop_crit = self.dict['stop_criterion']
 
@@ -297,12 +896,38 @@ class Routine(object):
         self._loss = self._loss.cuda()
         self._model = self._model.cuda()
 
-    def _load_(self, inputpath, targetpath, transformin, transformtar):
+    def _load_(self, inputpath, targetpath, transformin, transformtar,
+               split='train'):
         '''Load the data from two folder path of the dataset'''
-        var = ImageFolderSegmentation(images_path=inputpath,
-                                      label_path=targetpath,
-                                      transform=transformin,
-                                      label_transform=transformtar)
+        if 'pack_dir' in self.dict:
+            pack_dir = os.path.join(self.dict['pack_dir'], split)
+            if not dataloaderSegmentation.is_packed(inputpath, targetpath,
+                                                    pack_dir):
+                dataloaderSegmentation.pack_segmentation(
+                    images_path=inputpath,
+                    label_path=targetpath,
+                    output_dir=pack_dir)
+            var = dataloaderSegmentation.PackedFolderSegmentation(
+                root=pack_dir,
+                transform=transformin,
+                label_transform=transformtar)
+        else:
+            if 'cache_bytes' in self.dict:
+                cache_bytes = self.dict['cache_bytes']
+            else:
+                cache_bytes = 0
+            if 'manifest_dir' in self.dict:
+                manifest = os.path.join(self.dict['manifest_dir'],
+                                        split + '.json')
+            else:
+                manifest = None
+            var = dataloaderSegmentation.ImageFolderSegmentation(
+                images_path=inputpath,
+                label_path=targetpath,
+                transform=transformin,
+                label_transform=transformtar,
+                cache_bytes=cache_bytes,
+                manifest=manifest)
 
         if 'shuffle' in self.dict:
             shuffle = self.dict['shuffle']
@@ -319,10 +944,45 @@ class Routine(object):
         else:
             self.workers = 10
 
-        if inputpath == 'valinput':
+        if split == 'val':
             shuffle = False
 
         loader = torch.utils.data.DataLoader(var, batch_size=self.batch_size,
                                              shuffle=shuffle,
                                              num_workers=self.workers,
                                              pin_memory=True)
+        return loader
+
+
+def _shard_loader(loader, sampler, world_size):
+    '''Copy of a DataLoader drawing its samples from sampler'''
+    if isinstance(loader, (dataloaderSegmentation.BatchTransformLoader,
+                           dataloaderSegmentation.RingLoader)):
+        return loader.wrap(_shard_loader(loader.loader, sampler, world_size))
+    workers = loader.num_workers
+    if workers > 0:
+        workers = max(1, workers // world_size)
+    return torch.utils.data.DataLoader(loader.dataset,
+                                       batch_size=loader.batch_size,
+                                       sampler=sampler,
+                                       num_workers=workers,
+                                       collate_fn=loader.collate_fn,
+                                       drop_last=loader.drop_last)
+
+
+def _distributed_worker(rank, routine, init_method, result):
+    '''Process of Routine._fit_distributed'''
+    world_size = routine._world_size
+    dist.init_process_group('gloo', init_method=init_method, rank=rank,
+                            world_size=world_size)
+    try:
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+        routine._rank = rank
+        routine._distribute()
+        routine.fit()
+        if rank == 0:
+            torch.save({'model_state': routine._module().state_dict(),
+                        'optimizer_state': routine._opt.state_dict()},
+                       result)
+    finally:
+        dist.destroy_process_group()
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the modules import each other from the root of the repository, the
+# networks from their folder
+for path in (ROOT, os.path.join(ROOT, 'segmentation', 'models')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+def write_pair(root, name, size=(32, 24), seed=0):
+    """Write a random RGB image and its label under root/images, labels"""
+    rng = np.random.RandomState(seed)
+    width, height = size
+    for folder in ('images', 'labels'):
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+    Image.fromarray(rng.randint(0, 256, (height, width, 3)).astype(
+        np.uint8)).save(os.path.join(root, 'images', name + '.png'))
+    Image.fromarray(rng.randint(0, 4, (height, width)).astype(
+        np.uint8)).save(os.path.join(root, 'labels', name + '.png'))
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    """Folder of 6 image/label pairs, with its glob selectors"""
+    root = str(tmp_path / 'data')
+    for i in range(6):
+        write_pair(root, 'sample_%02d' % i, seed=i)
+    return (root, os.path.join(root, 'images', '*.png'),
+            os.path.join(root, 'labels', '*.png'))
@@ -0,0 +1,68 @@
+import glob
+import json
+import os
+
+import torch
+
+from database.database import LazyImageTensor, _read_image
+
+
+def _eager(files):
+    return torch.stack([_read_image(f) for f in files]).float().div_(255.)
+
+
+def test_lazy_indexing_matches_eager(dataset, tmp_path):
+    root, images, _ = dataset
+    files = sorted(glob.glob(images))
+    lazy = LazyImageTensor(files, str(tmp_path / 'cache' / 'images.cache'))
+    eager = _eager(files)
+    assert lazy.shape == eager.shape
+    assert torch.equal(lazy[2], eager[2])
+    assert torch.equal(lazy[[5, 0, 3]], eager[[5, 0, 3]])
+    assert torch.equal(lazy[1:4, 0], eager[1:4, 0])
+    assert torch.equal(lazy.to_tensor(), eager)
+
+
+def test_lazy_cache_persists_across_workers_and_reopen(dataset, tmp_path):
+    root, images, _ = dataset
+    files = sorted(glob.glob(images)) * 2
+    cache = str(tmp_path / 'images.cache')
+    lazy = LazyImageTensor(files, cache)
+    loader = torch.utils.data.DataLoader(lazy, batch_size=2, num_workers=4)
+    batches = torch.cat(list(loader))
+    assert torch.equal(batches, _eager(files))
+    # the workers decoded every image, the main view sees it
+    assert lazy._done.all()
+
+    reopened = LazyImageTensor(files, cache)
+    assert reopened._done.sum() == len(files)
+    # read back from the cache, the images are not decoded again
+    os.rename(files[0], files[0] + '.moved')
+    try:
+        assert torch.equal(reopened[0], batches[0])
+    finally:
+        os.rename(files[0] + '.moved', files[0])
+
+
+def test_lazy_cache_reset_when_files_change(dataset, tmp_path):
+    root, images, _ = dataset
+    files = sorted(glob.glob(images))
+    cache = str(tmp_path / 'images.cache')
+    LazyImageTensor(files, cache)[:]
+    assert LazyImageTensor(files[:-1], cache)._done.sum() == 0
+
+
+def test_lazy_cache_recovers_from_a_torn_header(dataset, tmp_path):
+    root, images, _ = dataset
+    files = sorted(glob.glob(images))
+    cache = str(tmp_path / 'images.cache')
+    LazyImageTensor(files, cache)[:2]
+    with open(cache + '.json') as f:
+        text = f.read()
+    with open(cache + '.json', 'w') as f:
+        f.write(text[:len(text) // 2])
+    lazy = LazyImageTensor(files, cache)
+    assert not lazy._done.any()
+    assert torch.equal(lazy[:], _eager(files))
+    with open(cache + '.json') as f:
+        assert json.load(f)['image_shape'] == list(lazy.image_shape)
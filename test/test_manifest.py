@@ -0,0 +1,68 @@
+import os
+import time
+
+from database import dataloaderSegmentation
+from database.dataloaderSegmentation import build_manifest
+from database.dataloaderSegmentation import ImageFolderSegmentation
+from conftest import write_pair
+
+
+def _count_headers(monkeypatch):
+    calls = []
+    image_size = dataloaderSegmentation._image_size
+
+    def counting(path):
+        calls.append(path)
+        return image_size(path)
+    monkeypatch.setattr(dataloaderSegmentation, '_image_size', counting)
+    return calls
+
+
+def test_manifest_pairs(dataset):
+    root, images, labels = dataset
+    manifest = build_manifest(images, labels)
+    assert [s[0] for s in manifest['samples']] == \
+        ['sample_%02d' % i for i in range(6)]
+    assert all(s[3:] == [32, 24] for s in manifest['samples'])
+
+
+def test_manifest_sees_added_file(dataset, monkeypatch):
+    root, images, labels = dataset
+    calls = _count_headers(monkeypatch)
+    first = build_manifest(images, labels)
+    assert len(calls) == 12
+
+    # unchanged folders: the same manifest, no header read
+    assert build_manifest(images, labels) is first
+    assert len(calls) == 12
+
+    write_pair(root, 'sample_06', seed=6)
+    data = ImageFolderSegmentation(images, labels)
+    assert len(data) == 7
+    assert data.image_filenames[-1].endswith('sample_06.png')
+    # only the new pair is read
+    assert len(calls) == 14
+
+
+def test_manifest_sees_modified_file(dataset, monkeypatch):
+    root, images, labels = dataset
+    build_manifest(images, labels)
+    calls = _count_headers(monkeypatch)
+    time.sleep(0.01)
+    write_pair(root, 'sample_00', size=(16, 8), seed=0)
+    manifest = build_manifest(images, labels)
+    assert manifest['samples'][0][3:] == [16, 8]
+    assert len(calls) == 2
+
+
+def test_manifest_file_reused(dataset, tmp_path, monkeypatch):
+    root, images, labels = dataset
+    manifest_file = str(tmp_path / 'manifest.json')
+    build_manifest(images, labels, manifest_file=manifest_file)
+    assert os.path.isfile(manifest_file)
+    # a new process: nothing in memory, the headers come from the file
+    dataloaderSegmentation._MANIFESTS.clear()
+    calls = _count_headers(monkeypatch)
+    manifest = build_manifest(images, labels, manifest_file=manifest_file)
+    assert len(manifest['samples']) == 6
+    assert calls == []
@@ -0,0 +1,76 @@
+import numpy as np
+import torch
+
+from utils.metrics import runningConfusion, torchConfusion
+
+
+def reference(gt, pred, n_classes):
+    """Confusion matrix counted pixel by pixel"""
+    matrix = np.zeros((n_classes, n_classes), dtype=np.int64)
+    for g, p in zip(np.ravel(gt), np.ravel(pred)):
+        if 0 <= g < n_classes and 0 <= p < n_classes:
+            matrix[g, p] += 1
+    return matrix
+
+
+def batches(n_classes, seed=0):
+    """Batches with ignored labels and out of range predictions"""
+    rng = np.random.RandomState(seed)
+    for _ in range(3):
+        gt = rng.randint(-1, n_classes + 2, (2, 5, 7))
+        pred = rng.randint(-2, n_classes + 2, (2, 5, 7))
+        yield gt, pred
+
+
+def test_running_confusion_matches_reference():
+    confusion = runningConfusion(4)
+    expected = np.zeros((4, 4), dtype=np.int64)
+    for gt, pred in batches(4):
+        confusion.update(gt, pred)
+        expected += reference(gt, pred, 4)
+    assert np.array_equal(confusion.matrix, expected)
+    assert confusion.n_updates == 3
+
+
+def test_running_confusion_out_of_range_prediction():
+    confusion = runningConfusion(3)
+    confusion.update(np.array([0, 1, 2, 0]), np.array([3, 1, -1, 0]))
+    expected = np.zeros((3, 3), dtype=np.int64)
+    expected[1, 1] = expected[0, 0] = 1
+    assert np.array_equal(confusion.matrix, expected)
+
+
+def test_running_confusion_scores():
+    confusion = runningConfusion(2)
+    confusion.update(np.array([0, 0, 1, 1]), np.array([0, 1, 1, 1]))
+    scores = confusion.scores()
+    assert np.isclose(scores['overallAcc'], 0.75)
+    assert np.isclose(scores['IoU'], (0.5 + 2. / 3) / 2)
+
+
+def test_torch_confusion_matches_reference():
+    confusion = torchConfusion(4)
+    expected = np.zeros((4, 4), dtype=np.int64)
+    for gt, pred in batches(4, seed=1):
+        confusion.update(torch.from_numpy(gt), torch.from_numpy(pred))
+        expected += reference(gt, pred, 4)
+    assert np.array_equal(confusion.numpy(), expected)
+    assert confusion.n_updates == 3
+
+
+def test_torch_confusion_out_of_range_prediction():
+    confusion = torchConfusion(3)
+    # pred 3 of gt 0 used to be counted as (1, 0)
+    confusion.update(torch.tensor([0, 1, 2, 0], dtype=torch.uint8),
+                     torch.tensor([3, 1, -1, 0]))
+    expected = np.zeros((3, 3), dtype=np.int64)
+    expected[1, 1] = expected[0, 0] = 1
+    assert np.array_equal(confusion.numpy(), expected)
+
+
+def test_torch_confusion_equals_running_confusion():
+    running, device = runningConfusion(5), torchConfusion(5)
+    for gt, pred in batches(5, seed=2):
+        running.update(gt, pred)
+        device.update(torch.from_numpy(gt), torch.from_numpy(pred))
+    assert np.array_equal(running.matrix, device.numpy())
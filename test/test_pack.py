@@ -0,0 +1,41 @@
+import os
+import time
+
+import numpy as np
+
+from database.dataloaderSegmentation import pack_segmentation, is_packed
+from database.dataloaderSegmentation import PackedFolderSegmentation
+from database.dataloaderSegmentation import ImageFolderSegmentation
+from conftest import write_pair
+
+
+def test_pack_matches_folder(dataset, tmp_path):
+    root, images, labels = dataset
+    out = str(tmp_path / 'pack')
+    pack_segmentation(images, labels, out, shard_size=4)
+    packed = PackedFolderSegmentation(out, as_pil=False)
+    folder = ImageFolderSegmentation(images, labels)
+    assert len(packed) == len(folder) == 6
+    for i in range(6):
+        image, label = folder[i]
+        packed_image, packed_label = packed[i]
+        assert np.array_equal(np.asarray(image), packed_image)
+        assert np.array_equal(np.asarray(label), packed_label)
+
+
+def test_pack_stale_after_change(dataset, tmp_path):
+    root, images, labels = dataset
+    out = str(tmp_path / 'pack')
+    assert not is_packed(images, labels, out)
+    pack_segmentation(images, labels, out)
+    assert is_packed(images, labels, out)
+
+    write_pair(root, 'sample_06', seed=6)
+    assert not is_packed(images, labels, out)
+    pack_segmentation(images, labels, out)
+    assert is_packed(images, labels, out)
+    assert len(PackedFolderSegmentation(out)) == 7
+
+    time.sleep(0.01)
+    write_pair(root, 'sample_00', seed=10)
+    assert not is_packed(images, labels, out)
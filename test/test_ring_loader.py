@@ -0,0 +1,52 @@
+import pytest
+import torch
+
+from database.dataloaderSegmentation import PinnedBatchRing, RingLoader
+from database.dataloaderSegmentation import ImageFolderSegmentation
+from loader_init import loader_init, ToUint8
+
+
+def _loaders(dataset, **kwargs):
+    root, images, labels = dataset
+    return loader_init(images, labels, images, labels, 4, 0, **kwargs)
+
+
+@pytest.mark.parametrize('uint8', [False, True])
+def test_ring_batches_equal_plain_batches(dataset, uint8):
+    _, plain = _loaders(dataset)
+    _, ringed = _loaders(dataset, uint8=uint8, ring=3)
+    for epoch in range(2):
+        batches = [(x.clone(), y.clone()) for x, y in ringed]
+        assert len(batches) == len(plain) == 2
+        for (x, y), (ref_x, ref_y) in zip(batches, plain):
+            assert torch.allclose(x, ref_x, atol=1e-5)
+            # the labels stay uint8 until the loss
+            assert y.dtype == torch.uint8
+            assert torch.equal(y.long(), ref_y)
+
+
+def test_ring_reuses_its_buffers(dataset):
+    root, images, labels = dataset
+    data = ImageFolderSegmentation(images, labels, transform=ToUint8(),
+                                   label_transform=ToUint8())
+    ring = PinnedBatchRing(slots=2)
+    loader = RingLoader(torch.utils.data.DataLoader(
+        data, batch_size=3, collate_fn=ring), ring)
+    pointers = set()
+    for epoch in range(5):
+        for x, y in loader:
+            pointers.add(x.data_ptr())
+    assert ring.stats()['allocations'] == 2
+    assert ring.stats()['batches'] == 10
+    assert len(pointers) == 2
+
+
+def test_ring_needs_a_loader_without_workers(dataset):
+    root, images, labels = dataset
+    with pytest.raises(ValueError):
+        loader_init(images, labels, images, labels, 4, 2, ring=3)
+    ring = PinnedBatchRing()
+    with pytest.raises(ValueError):
+        RingLoader(torch.utils.data.DataLoader(
+            ImageFolderSegmentation(images, labels), num_workers=2,
+            collate_fn=ring), ring)
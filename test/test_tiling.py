@@ -0,0 +1,57 @@
+import numpy as np
+import torch
+import torch.nn as nn
+
+from utils.tiling import TiledInference, tile_starts
+import nn as NeuralNet
+
+
+def pointwise_model(seed=0):
+    """Network whose logits of a pixel only depend on that pixel"""
+    torch.manual_seed(seed)
+    return nn.Sequential(nn.Conv2d(3, 8, 1), nn.ReLU(),
+                         nn.Conv2d(8, 5, 1)).eval()
+
+
+def test_tile_starts_cover_the_image():
+    starts = tile_starts(100, 32, 8)
+    assert starts[0] == 0 and starts[-1] == 100 - 32
+    assert all(b - a <= 32 - 8 for a, b in zip(starts, starts[1:]))
+    assert tile_starts(20, 32, 8) == [0]
+
+
+def test_single_tile_matches_whole_image():
+    torch.manual_seed(0)
+    model = NeuralNet.SegNet(in_channels=3, n_classes=4).eval()
+    image = torch.randn(3, 64, 64)
+    with torch.no_grad():
+        expected = model(image[None])[0]
+    tiler = TiledInference(model, tile_size=64, overlap=16)
+    assert torch.allclose(tiler.logits(image), expected, atol=1e-5)
+    assert np.array_equal(tiler(image),
+                          expected.argmax(0).to(torch.uint8).numpy())
+
+
+def test_tile_larger_than_image():
+    model = pointwise_model()
+    image = torch.randn(3, 40, 50)
+    with torch.no_grad():
+        expected = model(image[None])[0]
+    tiler = TiledInference(model, tile_size=64, overlap=16)
+    assert torch.allclose(tiler.logits(image), expected, atol=1e-5)
+
+
+def test_overlapping_tiles_blend_to_whole_image():
+    # with pointwise logits every blend of the tiles is the exact logits
+    model = pointwise_model(1)
+    image = torch.randn(3, 150, 97)
+    with torch.no_grad():
+        expected = model(image[None])[0]
+    for window in ('hann', 'uniform'):
+        tiler = TiledInference(model, tile_size=32, overlap=12,
+                               batch_size=3, window=window)
+        assert torch.allclose(tiler.logits(image), expected, atol=1e-5)
+        out = np.zeros((150, 97), dtype=np.uint8)
+        tiler(image.numpy(), out=out)
+        assert np.array_equal(out,
+                              expected.argmax(0).to(torch.uint8).numpy())
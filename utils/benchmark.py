@@ -0,0 +1,334 @@
+"""Benchmarks of the segmentation networks
+
+This module measures the step time and the memory of the networks of
+``segmentation/models/nn.py`` on synthetic data.
+
+The module structure is the following:
+
+- The ``peak_rss`` function returns the peak resident set size of the
+  current process
+- The ``isolated`` function runs a benchmark in a fresh process, so that
+  its peak memory is not hidden by the one of a previous run
+- The ``checkpoint_benchmark`` function compares a training step with
+  and without activation checkpointing
+- The ``fuse_benchmark`` function compares the inference latency with
+  and without the BatchNorm folded into the convolutions
+  (``fuse_for_inference``)
+- The ``compile_benchmark`` function compares the eager and compiled
+  (``compile_model``) training step and inference latency
+- The ``scaling_benchmark`` function measures the weak and strong
+  scaling of cpu data parallel training (gloo, DistributedDataParallel)
+  on the local host
+
+  Example:
+  python utils/benchmark.py checkpoint SegNet 4 256
+  python utils/benchmark.py fuse SegNet 4 256
+  python utils/benchmark.py compile SegNet 4 256
+  python utils/benchmark.py scaling SegNet 8 128
+"""
+import os
+import sys
+import copy
+import socket
+import resource
+import multiprocessing as mp
+from timeit import default_timer as timer
+import numpy as np
+import torch
+import torch.distributed as dist
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'segmentation', 'models'))
+import nn as NeuralNet
+
+
+def peak_rss():
+    """Peak resident set size of the current process in MB"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss / 2. ** 20
+    return rss / 2. ** 10
+
+
+def _run(queue, function, args):
+    queue.put(function(*args))
+
+
+def isolated(function, *args):
+    """Run ``function(*args)`` in a fresh process and return its result"""
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run, args=(queue, function, args))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def _synthetic(input_shape, n_classes):
+    torch.manual_seed(0)
+    inputs = torch.randn(*input_shape)
+    labels = torch.randint(0, n_classes,
+                           (input_shape[0],) + tuple(input_shape[2:]))
+    return inputs, labels
+
+
+def _train_steps(model_name, input_shape, n_classes, steps, checkpoint):
+    inputs, labels = _synthetic(input_shape, n_classes)
+    model = getattr(NeuralNet, model_name)(in_channels=input_shape[1],
+                                           n_classes=n_classes,
+                                           checkpoint=checkpoint)
+    opt = torch.optim.Adam(model.parameters())
+    criterion = torch.nn.CrossEntropyLoss()
+    model.train()
+
+    base = peak_rss()
+    times = []
+    for _ in range(steps + 1):
+        start = timer()
+        opt.zero_grad()
+        loss = criterion(model(inputs), labels)
+        loss.backward()
+        opt.step()
+        times.append(timer() - start)
+    return {'step_time': float(np.median(times[1:])),
+            'peak_rss': peak_rss(),
+            'base_rss': base}
+
+
+def checkpoint_benchmark(model_name='SegNet', input_shape=(4, 3, 256, 256),
+                         n_classes=11, steps=3):
+    """Compare training steps with and without activation checkpointing
+
+    Each mode runs in its own process, the peak RSS reported is the one of
+    the whole process and ``base_rss`` the peak before the first step.
+
+    Returns
+    -------
+    results : dict(str, dict)
+    """
+    results = {}
+    for mode, flag in (('off', False), ('on', True)):
+        results[mode] = isolated(_train_steps, model_name, tuple(input_shape),
+                                 n_classes, steps, flag)
+
+    print('%s %s - activation checkpointing' % (model_name,
+                                                 list(input_shape)))
+    print('%-6s %12s %14s %14s' % ('mode', 'step (s)', 'peak RSS (MB)',
+                                   'step RSS (MB)'))
+    for mode in ('off', 'on'):
+        res = results[mode]
+        print('%-6s %12.3f %14.1f %14.1f' % (mode, res['step_time'],
+                                             res['peak_rss'],
+                                             res['peak_rss'] -
+                                             res['base_rss']))
+    return results
+
+
+def _median_time(function, steps):
+    """Median time of function() over steps calls, after a warm up call"""
+    start = timer()
+    function()
+    warmup = timer() - start
+    times = []
+    for _ in range(steps):
+        start = timer()
+        function()
+        times.append(timer() - start)
+    return float(np.median(times)), warmup
+
+
+def fuse_benchmark(model_name='SegNet', input_shape=(4, 3, 256, 256),
+                   n_classes=11, steps=5):
+    """Compare the inference latency with and without BatchNorm folding
+
+    Returns
+    -------
+    results : dict(str, float)
+        The median latency of each mode and the max abs difference of the
+        logits ('max_abs').
+    """
+    inputs, _ = _synthetic(input_shape, n_classes)
+    torch.manual_seed(0)
+    model = getattr(NeuralNet, model_name)(in_channels=input_shape[1],
+                                           n_classes=n_classes).eval()
+    fused = copy.deepcopy(model)
+    fused.fuse_for_inference()
+
+    results = {}
+    with torch.no_grad():
+        for mode, run in (('bn', model), ('fused', fused)):
+            results[mode], _ = _median_time(lambda: run(inputs), steps)
+        results['max_abs'] = float((model(inputs) -
+                                    fused(inputs)).abs().max())
+
+    print('%s %s - BatchNorm folding' % (model_name, list(input_shape)))
+    print('%-8s %14s' % ('mode', 'inference (s)'))
+    for mode in ('bn', 'fused'):
+        print('%-8s %14.3f' % (mode, results[mode]))
+    print('speedup %.2fx, max abs diff %.2e' % (
+        results['bn'] / results['fused'], results['max_abs']))
+    return results
+
+
+def compile_benchmark(model_name='SegNet', input_shape=(4, 3, 256, 256),
+                      n_classes=11, steps=3, modes=('eager', 'script',
+                                                    'compile')):
+    """Compare eager and compiled training step and inference latency
+
+    The first call of each mode (compilation included) is reported apart.
+
+    Returns
+    -------
+    results : dict(str, dict)
+    """
+    inputs, labels = _synthetic(input_shape, n_classes)
+    criterion = torch.nn.CrossEntropyLoss()
+    results = {}
+    for mode in modes:
+        torch.manual_seed(0)
+        model = getattr(NeuralNet, model_name)(in_channels=input_shape[1],
+                                               n_classes=n_classes)
+        if mode == 'eager':
+            run = model
+        else:
+            run = NeuralNet.compile_model(model, mode)
+        opt = torch.optim.Adam(model.parameters())
+
+        def train_step():
+            opt.zero_grad()
+            criterion(run(inputs), labels).backward()
+            opt.step()
+
+        def inference():
+            with torch.no_grad():
+                run(inputs)
+
+        model.train()
+        run.train()
+        train, train_first = _median_time(train_step, steps)
+        model.eval()
+        run.eval()
+        infer, infer_first = _median_time(inference, steps)
+        results[mode] = {'train_step': train, 'train_first': train_first,
+                         'inference': infer, 'inference_first': infer_first}
+
+    print('%s %s - eager vs compiled' % (model_name, list(input_shape)))
+    print('%-8s %12s %12s %14s %14s' % ('mode', 'train (s)', 'first (s)',
+                                        'inference (s)', 'first (s)'))
+    for mode in modes:
+        res = results[mode]
+        print('%-8s %12.3f %12.3f %14.3f %14.3f' % (
+            mode, res['train_step'], res['train_first'], res['inference'],
+            res['inference_first']))
+    return results
+
+
+def _ddp_steps(rank, world_size, init_method, model_name, input_shape,
+               n_classes, steps, queue):
+    dist.init_process_group('gloo', init_method=init_method, rank=rank,
+                            world_size=world_size)
+    try:
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+        inputs, labels = _synthetic(input_shape, n_classes)
+        model = getattr(NeuralNet, model_name)(in_channels=input_shape[1],
+                                               n_classes=n_classes)
+        model = torch.nn.parallel.DistributedDataParallel(model)
+        opt = torch.optim.Adam(model.parameters())
+        criterion = torch.nn.CrossEntropyLoss()
+
+        times = []
+        for _ in range(steps + 1):
+            dist.barrier()
+            start = timer()
+            opt.zero_grad()
+            criterion(model(inputs), labels).backward()
+            opt.step()
+            times.append(timer() - start)
+        if rank == 0:
+            queue.put(float(np.median(times[1:])))
+    finally:
+        dist.destroy_process_group()
+
+
+def _ddp_step_time(world_size, model_name, input_shape, n_classes, steps):
+    """Median step time of world_size processes, input_shape per process"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        init_method = 'tcp://127.0.0.1:%d' % s.getsockname()[1]
+    queue = mp.get_context('spawn').SimpleQueue()
+    torch.multiprocessing.spawn(_ddp_steps,
+                                args=(world_size, init_method, model_name,
+                                      tuple(input_shape), n_classes, steps,
+                                      queue),
+                                nprocs=world_size)
+    return queue.get()
+
+
+def scaling_benchmark(model_name='SegNet', world_sizes=(1, 2, 4),
+                      batch_size=8, image_size=128, n_classes=11, steps=3):
+    """Weak and strong scaling of cpu data parallel training
+
+    Weak scaling keeps ``batch_size`` samples per process, strong scaling
+    splits a global batch of ``batch_size`` samples between the processes.
+    Each process uses cpu_count / world_size threads.
+
+    Returns
+    -------
+    results : dict(str, dict(int, float))
+        The median step time of each mode and world size.
+    """
+    results = {'weak': {}, 'strong': {}}
+    for world_size in world_sizes:
+        for mode in ('weak', 'strong'):
+            if mode == 'weak':
+                local = batch_size
+            else:
+                local = batch_size // world_size
+                if local < 1:
+                    continue
+            results[mode][world_size] = _ddp_step_time(
+                world_size, model_name,
+                (local, 3, image_size, image_size), n_classes, steps)
+
+    print('%s %dx%d, %d cpus - data parallel scaling' % (
+        model_name, image_size, image_size, os.cpu_count() or 1))
+    print('%-7s %6s %8s %12s %14s %11s' % ('mode', 'procs', 'batch',
+                                           'step (s)', 'samples/s',
+                                           'efficiency'))
+    for mode in ('weak', 'strong'):
+        base = results[mode].get(1)
+        for world_size, step in sorted(results[mode].items()):
+            if mode == 'weak':
+                batch = batch_size * world_size
+                efficiency = base / step if base else np.nan
+            else:
+                batch = batch_size // world_size * world_size
+                efficiency = base / step / world_size if base else np.nan
+            print('%-7s %6d %8d %12.3f %14.2f %10.0f%%' % (
+                mode, world_size, batch, step, batch / step,
+                100. * efficiency))
+    return results
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:] + [None] * 4
+    if args[0] in (None, 'checkpoint'):
+        checkpoint_benchmark(
+            model_name=args[1] or 'SegNet',
+            input_shape=(int(args[2] or 4), 3, int(args[3] or 256),
+                         int(args[3] or 256)))
+    elif args[0] == 'fuse':
+        fuse_benchmark(
+            model_name=args[1] or 'SegNet',
+            input_shape=(int(args[2] or 4), 3, int(args[3] or 256),
+                         int(args[3] or 256)))
+    elif args[0] == 'compile':
+        compile_benchmark(
+            model_name=args[1] or 'SegNet',
+            input_shape=(int(args[2] or 4), 3, int(args[3] or 256),
+                         int(args[3] or 256)))
+    elif args[0] == 'scaling':
+        scaling_benchmark(model_name=args[1] or 'SegNet',
+                          batch_size=int(args[2] or 8),
+                          image_size=int(args[3] or 128))
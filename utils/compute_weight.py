@@ -1,36 +1,235 @@
+"""Class weights computation
+
+This module computes class weights from a folder of label images.
+
+The module structure is the following:
+
+- The ``ClassHistogramIndex`` class keeps a persistent per-file class
+  histogram of the labels, keyed by path, mtime and size, so that only
+  new or modified labels are scanned again
+- The ``ClassCounts`` function scans the labels with ``np.bincount``
+  through a process pool and returns the per-class pixel and per-image
+  counts, through a ``ClassHistogramIndex`` if a cache file is given
+- The ``Simple*`` functions weight the classes by their frequency
+  over the whole dataset
+- The ``*WeightComputation*`` functions weight the classes by their
+  frequency over the images where they appear
+
+Every weighting variant is derived from ``ClassCounts``, passing the
+same ``cache_file`` to several of them scans the dataset only once, and
+labels added later to the folder are the only ones scanned afterwards.
+"""
 import numpy as np
 import imageio
 import glob
+import os
+from multiprocessing import Pool
 
 
-def SimpleWeightComputation(labels_path, n_classes):
-    """Compute weight in a basic way, Parity in Dataset"""
-    lbl_pths = glob.glob(labels_path)r
-    # lbl_container = []
-    pix_per_class = [0] * n_classes
+def _label_histogram(args):
+    """Pixel count per class and number of pixels of one label image"""
+    lbl_pth, n_classes = args
+    lbl = np.asarray(imageio.imread(lbl_pth), dtype=np.uint8)
+    hist = np.bincount(lbl.ravel(), minlength=n_classes)[:n_classes]
+    return hist.astype(np.int64), lbl.size
+
+
+def _scan(lbl_pths, n_classes, processes=None):
+    """Histogram of each label, in the order of ``lbl_pths``"""
+    args = [(lbl_pth, n_classes) for lbl_pth in lbl_pths]
+    if processes == 1 or len(args) <= 1:
+        return list(map(_label_histogram, args))
+    pool = Pool(processes)
+    try:
+        return pool.map(_label_histogram, args, chunksize=16)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class ClassHistogramIndex(object):
+    """Persistent per-file class histogram of a dataset of labels
+
+    Each label is recorded with its path, mtime, size in bytes, class
+    histogram and number of pixels. ``update`` stats the selected files
+    and scans only the ones that are new or whose mtime or size changed,
+    the counts of the dataset are then summed from the stored rows.
+
+    Attributes
+    ----------
+    filename : str
+        The .npz file storing the index.
+
+    n_classes : int
+        The number of classes of the histograms.
+
+    paths : List[str]
+        The indexed labels.
+
+    hists : np.ndarray
+        The (n_labels, n_classes) class histograms.
+    """
+    def __init__(self, filename, n_classes):
+        self.filename = filename
+        self.n_classes = n_classes
+        self.paths = []
+        self.mtimes = np.zeros(0, dtype=np.int64)
+        self.sizes = np.zeros(0, dtype=np.int64)
+        self.hists = np.zeros((0, n_classes), dtype=np.int64)
+        self.pixels = np.zeros(0, dtype=np.int64)
+
+        if os.path.isfile(filename):
+            stored = np.load(filename)
+            if int(stored['n_classes']) == n_classes:
+                self.paths = stored['paths'].tolist()
+                self.mtimes = stored['mtimes']
+                self.sizes = stored['sizes']
+                self.hists = stored['hists']
+                self.pixels = stored['pixels']
+
+    def update(self, labels_path, processes=None):
+        """Synchronize the index with the labels selected
+
+        Parameters
+        ---------
+        labels_path : str
+            path of the labels with selector
+
+        processes : int
+            The number of processes scanning the labels.
+
+        Returns
+        -------
+        n_scanned : int
+            The number of labels (re)scanned.
+        """
+        lbl_pths = sorted(glob.glob(labels_path))
+        stats = [os.stat(lbl_pth) for lbl_pth in lbl_pths]
+        mtimes = np.asarray([x.st_mtime_ns for x in stats], dtype=np.int64)
+        sizes = np.asarray([x.st_size for x in stats], dtype=np.int64)
+
+        rows = dict(zip(self.paths, range(len(self.paths))))
+        hists = np.zeros((len(lbl_pths), self.n_classes), dtype=np.int64)
+        pixels = np.zeros(len(lbl_pths), dtype=np.int64)
+        stale = []
+        for ind, lbl_pth in enumerate(lbl_pths):
+            row = rows.get(lbl_pth)
+            if row is not None and self.mtimes[row] == mtimes[ind] and \
+                    self.sizes[row] == sizes[ind]:
+                hists[ind] = self.hists[row]
+                pixels[ind] = self.pixels[row]
+            else:
+                stale.append(ind)
+
+        for ind, (hist, size) in zip(stale, _scan([lbl_pths[x]
+                                                   for x in stale],
+                                                  self.n_classes,
+                                                  processes)):
+            hists[ind] = hist
+            pixels[ind] = size
+
+        changed = len(stale) > 0 or not lbl_pths == self.paths
+        self.paths = lbl_pths
+        self.mtimes = mtimes
+        self.sizes = sizes
+        self.hists = hists
+        self.pixels = pixels
+        if changed:
+            self.save()
+        return len(stale)
+
+    def save(self):
+        """Write the index to its file"""
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, paths=np.asarray(self.paths, dtype=str),
+                     n_classes=self.n_classes,
+                     mtimes=self.mtimes,
+                     sizes=self.sizes,
+                     hists=self.hists,
+                     pixels=self.pixels)
+        os.replace(tmp, self.filename)
+
+    def counts(self):
+        """Aggregate the stored histograms, see ``ClassCounts``"""
+        present = self.hists > 0
+        return {'pixels': self.hists.sum(axis=0),
+                'images': present.sum(axis=0).astype(np.int64),
+                'image_pixels': (present * self.pixels[:, None]).sum(axis=0),
+                'size': np.int64(self.pixels.sum())}
+
+
+def ClassCounts(labels_path, n_classes, processes=None, cache_file=None):
+    """Count the pixels of each class over a dataset of labels
+
+    Parameters
+    ---------
+    labels_path : str
+        path of the labels with selector
+        labels_path = '/label/*.png'
+
+    n_classes : int
+        The number of classes, label values above are not counted.
+
+    processes : int
+        The number of processes scanning the labels (None for all cpus,
+        1 to scan in the current process).
+
+    cache_file : str
+        The .npz ``ClassHistogramIndex`` file, only the labels added or
+        modified since its last update are scanned.
+
+    Returns
+    -------
+    counts : dict(str, np.ndarray)
+        'pixels' : pixels of each class over the dataset
+        'images' : number of images where each class appears
+        'image_pixels' : pixels of the images where each class appears
+        'size' : pixels of the whole dataset
+    """
+    if cache_file is not None:
+        index = ClassHistogramIndex(cache_file, n_classes)
+        index.update(labels_path, processes)
+        return index.counts()
+
+    pix_per_class = np.zeros(n_classes, dtype=np.int64)
+    n_im_cls = np.zeros(n_classes, dtype=np.int64)
+    pix_im_cls = np.zeros(n_classes, dtype=np.int64)
     size = 0
-    for lbl_pth in lbl_pths:
-        lbl = imageio.imread(lbl_pth)
-        lbl = np.array(lbl, dtype=np.int8)
-        # lbl_container.append(lbl)
-        for indx in range(lbl.shape[0]):
-            for indy in range(lbl.shape[1]):
-                pix_per_class[lbl[indx][indy]] += 1
 
-        size = lbl.size
+    for hist, pixels in _scan(sorted(glob.glob(labels_path)), n_classes,
+                              processes):
+        pix_per_class += hist
+        n_im_cls += hist > 0
+        pix_im_cls += (hist > 0) * pixels
+        size += pixels
+
+    return {'pixels': pix_per_class,
+            'images': n_im_cls,
+            'image_pixels': pix_im_cls,
+            'size': np.int64(size)}
 
-    pixel_per_dataset = size * len(lbl_pths)
 
-    freq = np.asarray([(x / pixel_per_dataset)
-                       if pixel_per_dataset != 0 else 0
-                       for x in pix_per_class])
+def SimpleWeightComputation(labels_path, n_classes, processes=None,
+                            cache_file=None):
+    """Compute weight in a basic way, Parity in Dataset"""
+    counts = ClassCounts(labels_path, n_classes, processes, cache_file)
+
+    pixel_per_dataset = counts['size']
+
+    if pixel_per_dataset != 0:
+        freq = counts['pixels'] / pixel_per_dataset
+    else:
+        freq = np.zeros(n_classes)
     # print('Initialweights: ' + str(freq))
     return freq
 
 
-def InvertSimpleWeightComputation(labels_path, n_classes):
+def InvertSimpleWeightComputation(labels_path, n_classes, processes=None,
+                                  cache_file=None):
     """Invert the parity accross the dataset for all classes"""
-    freq = SimpleWeightComputation(labels_path, n_classes)
+    freq = SimpleWeightComputation(labels_path, n_classes, processes,
+                                   cache_file)
 
     invertweight = [1 - x for x in freq]
 
@@ -38,9 +237,11 @@ def InvertSimpleWeightComputation(labels_path, n_classes):
     return invertweight
 
 
-def SimpleMedianWeightComputation(labels_path, n_classes):
+def SimpleMedianWeightComputation(labels_path, n_classes, processes=None,
+                                  cache_file=None):
     """Compute the median of frequency of appearance on frequency"""
-    freq = SimpleWeightComputation(labels_path, n_classes)
+    freq = SimpleWeightComputation(labels_path, n_classes, processes,
+                                   cache_file)
     weight = np.median(freq) / freq
     # print(weight)
     return weight
@@ -49,9 +250,12 @@ def SimpleMedianWeightComputation(labels_path, n_classes):
     # print(weight_inter.sum())
 
 
-def NormalizedSimpleMedianWeightComputation(labels_path, n_classes):
+def NormalizedSimpleMedianWeightComputation(labels_path, n_classes,
+                                            processes=None,
+                                            cache_file=None):
     """Normalized version ( all sum to 1 ) of median computation"""
-    freq = SimpleWeightComputation(labels_path, n_classes)
+    freq = SimpleWeightComputation(labels_path, n_classes, processes,
+                                   cache_file)
     weight = np.median(freq) / freq
 
     weight = weight / weight.sum()
@@ -60,41 +264,26 @@ def NormalizedSimpleMedianWeightComputation(labels_path, n_classes):
     return weight
 
 
-def WeightComputation(labels_path, n_classes):
+def WeightComputation(labels_path, n_classes, processes=None,
+                      cache_file=None):
     """Compute the weight according to the appearance in dataset"""
-    lbl_pths = glob.glob(labels_path)
-    # lbl_container = []
-    pix_per_class = [0] * 12
-    size = 0
-    n_im_cls = [0] * 12
-    cls_checker = [x for x in range(n_classes)]
-    for lbl_pth in lbl_pths:
-        lbl = imageio.imread(lbl_pth)
-        lbl = np.array(lbl, dtype=np.int8)
-
-        is_present = [True if x in lbl else False for x in cls_checker]
-        for ind in range(n_classes):
-            if is_present[ind]:
-                n_im_cls[ind] = n_im_cls[ind] + 1
-        # lbl_container.append(lbl)
-        for indx in range(lbl.shape[0]):
-            for indy in range(lbl.shape[1]):
-                pix_per_class[lbl[indx][indy]] += 1
-
-        size = lbl.size
-
-    pixels_per_im_cls = [x * size for x in n_im_cls]
-
-    freq = np.asarray([(pix_per_class[x] / pixels_per_im_cls[x])
-                       if pixels_per_im_cls[x] != 0 else 0
-                       for x in range(len(pix_per_class))])
+    counts = ClassCounts(labels_path, n_classes, processes, cache_file)
+
+    pix_per_class = counts['pixels']
+    pixels_per_im_cls = counts['image_pixels']
+
+    freq = np.zeros(n_classes)
+    present = pixels_per_im_cls != 0
+    freq[present] = pix_per_class[present] / pixels_per_im_cls[present]
     # print('Initialweights: ' + str(freq))
     return freq
 
 
-def InvertWeightComputation(labels_path, n_classes):
+def InvertWeightComputation(labels_path, n_classes, processes=None,
+                            cache_file=None):
     """Invert the weight proportion for each classes ( 1 - X )"""
-    weight = WeightComputation(labels_path, n_classes)
+    weight = WeightComputation(labels_path, n_classes, processes,
+                               cache_file)
 
     invertweight = [1 - x for x in weight]
 
@@ -102,16 +291,18 @@ def InvertWeightComputation(labels_path, n_classes):
     return invertweight
 
 
-def WeightComputationMedian(labels_path, n_classes):
+def WeightComputationMedian(labels_path, n_classes, processes=None,
+                            cache_file=None):
     """Median of appearance on appearance proportional appearance in image"""
-    freq = WeightComputation(labels_path, n_classes)
+    freq = WeightComputation(labels_path, n_classes, processes, cache_file)
     weight = np.median(freq) / freq
     return weight
 
 
-def NormalizedWeightComputationMedian(labels_path, n_classes):
+def NormalizedWeightComputationMedian(labels_path, n_classes,
+                                      processes=None, cache_file=None):
     """Normalized version of the WeightComputationMedian ( sum = 1 )"""
-    freq = WeightComputation(labels_path, n_classes)
+    freq = WeightComputation(labels_path, n_classes, processes, cache_file)
     weight = np.median(freq) / freq
     weight = weight / weight.sum()
     return weight
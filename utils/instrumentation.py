@@ -0,0 +1,189 @@
+"""Timing of the phases of the training steps
+
+This module shows where the time of ``Routine.fit`` goes, step by step,
+e.g. whether the training waits for its data (input bound) or for the
+model (compute bound).
+
+The module structure is the following:
+
+- The ``PHASES`` tuple names the timed phases: data wait, host to device
+  transfer, forward, loss, backward, optimizer step and validation
+- The ``StepHook`` class is the base of the hooks called after every
+  phase, step and epoch, its methods do nothing by default
+- The ``Instrumentation`` class times the phases, calls the hooks and
+  summarizes every epoch (p50 / p95 per phase, samples/s, peak RSS) as a
+  line of a JSONL file. It backs the ``instrumentation`` and ``hooks``
+  keys of ``Routine``.
+
+  Example:
+  instrumentation = Instrumentation('steps.jsonl', hooks=[MyHook()])
+  instrumentation.start_epoch(epoch)
+  for images, labels in loader:
+      instrumentation.data_ready()
+      with instrumentation.phase('forward'):
+          outputs = model(images)
+      ...
+      instrumentation.end_step(images.size(0))
+  stats = instrumentation.end_epoch()
+"""
+import json
+import contextlib
+from timeit import default_timer as timer
+import numpy as np
+import torch
+from utils.benchmark import peak_rss
+
+PHASES = ('data', 'h2d', 'forward', 'loss', 'backward', 'step',
+          'validation')
+
+
+class StepHook(object):
+    """Base class of the instrumentation hooks
+
+    Any object with some of these methods can be used as a hook.
+    """
+    def on_phase(self, phase, seconds):
+        """Called at the end of every phase"""
+        pass
+
+    def on_step(self, step, times):
+        """Called at the end of every step with its dict of phase times"""
+        pass
+
+    def on_epoch(self, epoch, stats):
+        """Called at the end of every epoch with its summary"""
+        pass
+
+
+class Instrumentation(object):
+    """Phase timers of the training steps
+
+    A phase run several times in a step (micro batches) is summed.
+
+    Attributes
+    ----------
+    logfile : str
+        The JSONL file receiving one line per epoch (None for no file).
+
+    hooks : List[StepHook]
+        The hooks called after every phase, step and epoch.
+
+    cuda : bool
+        If True the device is synchronized at the end of every phase, so
+        that asynchronous kernels are timed in their phase.
+    """
+    def __init__(self, logfile=None, hooks=None, cuda=False):
+        self.logfile = logfile
+        self.hooks = list(hooks) if hooks is not None else []
+        self.cuda = cuda
+        self.step = 0
+        self._epoch = 0
+        self._times = {}
+        self._step_times = {}
+        self._samples = 0
+        self._start = None
+        self._last = None
+
+    def _call(self, method, *args):
+        for hook in self.hooks:
+            function = getattr(hook, method, None)
+            if function is not None:
+                function(*args)
+
+    def _record(self, name, seconds):
+        self._step_times[name] = self._step_times.get(name, 0.) + seconds
+        self._call('on_phase', name, seconds)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Context timing a phase of the current step"""
+        start = timer()
+        try:
+            yield
+        finally:
+            if self.cuda:
+                torch.cuda.synchronize()
+            self._record(name, timer() - start)
+
+    def start_epoch(self, epoch):
+        """Reset the epoch measures, the data wait starts now"""
+        self._epoch = epoch
+        self._times = {}
+        self._step_times = {}
+        self._samples = 0
+        self._start = timer()
+        self._last = self._start
+
+    def data_ready(self):
+        """End of the data wait, called when the loader yields a batch"""
+        self._record('data', timer() - self._last)
+
+    def end_step(self, n_samples):
+        """End of a training step of n_samples samples"""
+        for name, seconds in self._step_times.items():
+            self._times.setdefault(name, []).append(seconds)
+        self._call('on_step', self.step, self._step_times)
+        self._step_times = {}
+        self._samples += n_samples
+        self.step += 1
+        self._last = timer()
+
+    def end_epoch(self, extra=None):
+        """Summary of the epoch, appended to the logfile
+
+        The phases timed after the last step (validation) are counted as
+        one more measure of the epoch.
+
+        Parameters
+        ----------
+        extra : dict
+            Optional values added to the summary (e.g. the loss).
+
+        Returns
+        -------
+        stats : dict
+            'epoch', 'steps', 'samples', 'seconds' (since start_epoch),
+            'samples_per_s' (of the training steps), 'peak_rss_mb',
+            'data_share' (share of the step time waiting for data) and
+            'phases' : {phase : {'p50', 'p95', 'total'}} in seconds.
+        """
+        for name, seconds in self._step_times.items():
+            self._times.setdefault(name, []).append(seconds)
+        self._step_times = {}
+
+        phases = {}
+        for name in PHASES:
+            if name in self._times:
+                values = np.asarray(self._times[name])
+                phases[name] = {'p50': float(np.percentile(values, 50)),
+                                'p95': float(np.percentile(values, 95)),
+                                'total': float(values.sum())}
+        train = sum(phases[name]['total'] for name in phases
+                    if name != 'validation')
+        stats = {'epoch': self._epoch,
+                 'steps': len(self._times.get('data', [])),
+                 'samples': self._samples,
+                 'seconds': timer() - self._start,
+                 'samples_per_s': self._samples / max(train, 1e-9),
+                 'peak_rss_mb': peak_rss(),
+                 'data_share': phases.get('data', {}).get('total', 0.) /
+                 max(train, 1e-9),
+                 'phases': phases}
+        if extra is not None:
+            stats.update(extra)
+
+        if self.logfile is not None:
+            with open(self.logfile, 'a') as f:
+                f.write(json.dumps(stats) + '\n')
+        self._call('on_epoch', self._epoch, stats)
+        return stats
+
+    def summary(self, stats):
+        """One line summary of an epoch: p50 per phase and throughput"""
+        phases = ' '.join('%s %.1fms' % (name, 1e3 * value['p50'])
+                          for name, value in stats['phases'].items()
+                          if name != 'validation')
+        return ('Step p50 : %s | %.1f samples/s, data %.0f%%, peak RSS '
+                '%.0f MB' % (phases, stats['samples_per_s'],
+                             100. * stats['data_share'],
+                             stats['peak_rss_mb']))
@@ -1,31 +1,188 @@
 import numpy as np
 import torch
-from sklearn.metrics import confusion_matrix, precision_score
-from sklearn.metrics import recall_score, f1_score
-from sklearn.metrics import jaccard_similarity_score
+import torch.distributed as dist
 from torchvision import transforms
 from PIL import Image
 import glob
 import os
 
 
+class runningConfusion(object):
+    """Running confusion matrix from which every metric is computed
+
+    Each update costs one ``np.bincount`` over the pixels of the batch,
+    the metrics are then derived from the n_classes x n_classes matrix.
+    Rows of the matrix are the groundtruth, columns the prediction.
+
+    Attributes
+    ----------
+    n_classes : int
+        The number of classes, pixels of groundtruth or prediction
+        outside [0, n_classes) are ignored.
+
+    matrix : np.ndarray
+        The accumulated confusion matrix.
+
+    n_updates : int
+        The number of batches accumulated.
+    """
+    def __init__(self, n_classes):
+        self.n_classes = n_classes
+        self.reset()
+
+    def _fast_hist(self, gt, pred):
+        """Confusion matrix of two flattened label arrays"""
+        gt = np.asarray(gt).ravel().astype(np.int64)
+        pred = np.asarray(pred).ravel().astype(np.int64)
+        mask = (gt >= 0) & (gt < self.n_classes) & \
+            (pred >= 0) & (pred < self.n_classes)
+        return np.bincount(self.n_classes * gt[mask] + pred[mask],
+                           minlength=self.n_classes ** 2).reshape(
+                               self.n_classes, self.n_classes)
+
+    def update(self, gt, pred):
+        """Accumulate a batch of groundtruth and prediction"""
+        self.matrix += self._fast_hist(gt, pred)
+        self.n_updates += 1
+
+    def add(self, matrix, n_updates=1):
+        """Accumulate a confusion matrix computed elsewhere"""
+        self.matrix += np.asarray(matrix, dtype=np.int64)
+        self.n_updates += n_updates
+
+    def reset(self):
+        """Reset the accumulated matrix"""
+        self.matrix = np.zeros((self.n_classes, self.n_classes),
+                               dtype=np.int64)
+        self.n_updates = 0
+
+    def scores(self):
+        """Compute the metrics from the accumulated matrix
+
+        Counts (False/True Positive/Negative, Jaccard) are averaged per
+        batch as they were when computed batch by batch, ratios are
+        computed on the whole accumulated matrix.
+
+        Returns
+        -------
+        scores : dict(str, np.float32)
+        """
+        C = self.matrix.astype(np.float64)
+        n_updates = max(self.n_updates, 1)
+        TrueP = np.diag(C)
+        FalseP = C.sum(axis=0) - TrueP
+        FalseN = C.sum(axis=1) - TrueP
+        TrueN = C.sum() - (FalseP + FalseN + TrueP)
+        support = C.sum(axis=1)
+        predicted = C.sum(axis=0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            prec = np.where(predicted > 0, TrueP / predicted, 0.)
+            rec = np.where(support > 0, TrueP / support, 0.)
+            f1 = np.where(prec + rec > 0, 2 * prec * rec / (prec + rec), 0.)
+            acc_cls = TrueP / support
+            iu = TrueP / (support + predicted - TrueP)
+            overall = TrueP.sum() / C.sum()
+
+        if support.sum() > 0:
+            weights = support / support.sum()
+        else:
+            weights = np.zeros(self.n_classes)
+
+        return {'FalseP': np.float32(FalseP.mean() / n_updates),
+                'FalseN': np.float32(FalseN.mean() / n_updates),
+                'TrueP': np.float32(TrueP.mean() / n_updates),
+                'TrueN': np.float32(TrueN.mean() / n_updates),
+                'prec': np.float32((weights * prec).sum()),
+                'rec': np.float32((weights * rec).sum()),
+                'f1score': np.float32((weights * f1).sum()),
+                'jaccard': np.float32(TrueP.sum() / n_updates),
+                'overallAcc': np.float32(overall),
+                'MeanAcc': np.float32(self._nanmean(acc_cls)),
+                'IoU': np.float32(self._nanmean(iu))}
+
+    def _nanmean(self, values):
+        """np.nanmean without warning on an empty matrix"""
+        if np.isnan(values).all():
+            return np.nan
+        return np.nanmean(values)
+
+
+class torchConfusion(object):
+    """Running confusion matrix accumulated on the device of the inputs
+
+    The matrix is built with ``torch.bincount`` over
+    ``n_classes * gt + pred`` where the tensors live, so that no batch
+    leaves the device. Pixels of groundtruth or prediction outside
+    [0, n_classes) fall in an extra bin instead of being masked out,
+    which avoids the synchronization of a boolean indexing. Only the final matrix is transferred by
+    ``numpy()``, its counts are identical to ``runningConfusion``.
+
+    Attributes
+    ----------
+    n_classes : int
+        The number of classes.
+
+    matrix : torch.Tensor
+        The accumulated confusion matrix (None before the first update).
+
+    n_updates : int
+        The number of batches accumulated.
+    """
+    def __init__(self, n_classes):
+        self.n_classes = n_classes
+        self.reset()
+
+    def update(self, gt, pred):
+        """Accumulate a batch of groundtruth and prediction tensors"""
+        n = self.n_classes
+        gt = gt.reshape(-1).long()
+        pred = pred.reshape(-1).long().to(gt.device)
+        valid = (gt >= 0) & (gt < n) & (pred >= 0) & (pred < n)
+        index = torch.where(valid, n * gt + pred,
+                            torch.full_like(gt, n * n))
+        hist = torch.bincount(index, minlength=n * n + 1)[:n * n]
+        if self.matrix is None:
+            self.matrix = hist.view(n, n).clone()
+        else:
+            self.matrix += hist.view(n, n)
+        self.n_updates += 1
+
+    def reset(self):
+        """Reset the accumulated matrix"""
+        self.matrix = None
+        self.n_updates = 0
+
+    def all_reduce(self):
+        """Sum the matrix and the number of updates over the processes
+
+        Every process of the default ``torch.distributed`` group has to
+        call it, the matrix has to live on a device of the backend.
+        """
+        if self.matrix is None:
+            self.matrix = torch.zeros((self.n_classes, self.n_classes),
+                                      dtype=torch.int64)
+        n_updates = torch.tensor([self.n_updates], dtype=torch.int64,
+                                 device=self.matrix.device)
+        dist.all_reduce(self.matrix)
+        dist.all_reduce(n_updates)
+        self.n_updates = int(n_updates.item())
+
+    def numpy(self):
+        """Transfer the accumulated matrix to the host"""
+        if self.matrix is None:
+            return np.zeros((self.n_classes, self.n_classes),
+                            dtype=np.int64)
+        return self.matrix.cpu().numpy()
+
+
 class evaluation(object):
     """Object that allow computation and comparison of metrics"""
     def __init__(self, n_classes, lr, modelstr, textfile):
         """Initialization of confusion matrix and metrics"""
         self.n_classes = n_classes
-        self.C = np.zeros((self.n_classes, self.n_classes))
-        self.FalseP = []
-        self.FalseN = []
-        self.TrueP = []
-        self.TrueN = []
-        self.prec = []
-        self.rec = []
-        self.f1score = []
-        self.jaccard = []
-        self.overallAcc = []
-        self.MeanAcc = []
-        self.IoU = []
+        self.confusion = runningConfusion(n_classes)
+        self._set_scores(self.confusion.scores())
 
         self.textfile = textfile
         self.saving_param = -100
@@ -45,52 +202,36 @@ class evaluation(object):
         self.f.write("Leaning Rate " + str(lr) + "\n")
         self.f.write("##################################################\n")
 
-    def __call__(self, gt, pred):
-        """Compute all the metrics accordind to the two images given"""
-        labels = np.asarray([x for x in range(self.n_classes)])
-        self.C = confusion_matrix(gt, pred, labels=labels)
-
-        FalseP = self.C.sum(axis=0) - np.diag(self.C)
-        FalseN = self.C.sum(axis=1) - np.diag(self.C)
-        TrueP = np.diag(self.C)
-        self.FalseP.append(FalseP)
-        self.FalseN.append(FalseN)
-        self.TrueP.append(TrueP)
-        self.TrueN.append(self.C.sum() - (FalseP + FalseN + TrueP))
-
-        self.prec.append(precision_score(gt, pred, labels=labels,
-                                         average='weighted'))
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('f', None)
+        return state
 
-        self.rec.append(recall_score(gt, pred, labels=labels,
-                                     average='weighted'))
-
-        self.f1score.append(f1_score(gt, pred, labels=labels,
-                                     average='weighted'))
-
-        self.jaccard.append(jaccard_similarity_score(gt, pred, normalize=False))
+    def __setstate__(self, state):
+        """The logfile is reopened in append mode"""
+        self.__dict__.update(state)
+        self.f = open(self.textfile, "a")
 
-        self.overallAcc.append(np.diag(self.C).sum() / self.C.sum())
+    @property
+    def C(self):
+        """The confusion matrix accumulated since the last reset"""
+        return self.confusion.matrix
 
-        self.MeanAcc.append(np.nanmean(np.diag(self.C) / self.C.sum(axis=1)))
+    def _set_scores(self, scores):
+        for key, value in scores.items():
+            setattr(self, key, value)
 
-        self.IoU.append(np.nanmean(np.diag(self.C) / (
-            self.C.sum(axis=0) + self.C.sum(axis=1) - np.diag(self.C))))
+    def __call__(self, gt, pred):
+        """Accumulate the confusion matrix of the two images given"""
+        self.confusion.update(gt, pred)
 
-        self.C = np.zeros((self.n_classes, self.n_classes))
+    def accumulate(self, matrix, n_updates=1):
+        """Accumulate a confusion matrix, e.g. from ``torchConfusion``"""
+        self.confusion.add(matrix, n_updates)
 
     def estimate(self, epoch, max_epoch, model, optim):
         """Estimation of the desired param and print in file all metrics"""
-        self.FalseP = np.float32(np.mean(self.FalseP))
-        self.FalseN = np.float32(np.mean(self.FalseN))
-        self.TrueP = np.float32(np.mean(self.TrueP))
-        self.TrueN = np.float32(np.mean(self.TrueN))
-        self.prec = np.float32(np.mean(self.prec))
-        self.rec = np.float32(np.mean(self.rec))
-        self.f1score = np.float32(np.mean(self.f1score))
-        self.jaccard = np.float32(np.mean(self.jaccard))
-        self.overallAcc = np.float32(np.mean(self.overallAcc))
-        self.MeanAcc = np.float32(np.mean(self.MeanAcc))
-        self.IoU = np.float32(np.mean(self.IoU))
+        self._set_scores(self.confusion.scores())
         self.f = open(self.textfile, "a")
         self.f.write("Epoch [" + str(epoch + 1) + " / " + str(
             max_epoch) + "]\n")
@@ -117,18 +258,12 @@ class evaluation(object):
 
     def reset(self):
         """Reset the object parameters"""
-        self.C = np.zeros((self.n_classes, self.n_classes))
-        self.FalseP = []
-        self.FalseN = []
-        self.TrueP = []
-        self.TrueN = []
-        self.prec = []
-        self.rec = []
-        self.f1score = []
-        self.jaccard = []
-        self.overallAcc = []
-        self.MeanAcc = []
-        self.IoU = []
+        self.confusion.reset()
+
+    def log(self, text):
+        """Append a line of text to the logfile"""
+        with open(self.textfile, "a") as f:
+            f.write(text + "\n")
 
     def close(self):
         """Close the openned file properly"""
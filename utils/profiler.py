@@ -0,0 +1,233 @@
+"""Per layer profile of the segmentation networks
+
+This module measures where the time and the memory of a network of
+``segmentation/models/nn.py`` go, layer by layer (``layer_1`` ...).
+
+The module structure is the following:
+
+- The ``LayerProfiler`` class hooks the children of a network and
+  accumulates, for every forward run while it is active, their wall
+  time, the FLOPs of their convolutions, their parameters, the bytes of
+  their float outputs (activations) and of their integer outputs (the
+  max pooling indices). The profile is printed as a table or saved as
+  JSON. It backs the ``profile`` key of ``Routine``.
+- The ``profile_model`` function profiles a network on random inputs of
+  a given shape
+
+  Example:
+  profiler = profile_model(model, (4, 3, 256, 256), steps=5)
+  print(profiler.table())
+  profiler.to_json('profile.json')
+
+  or, around any code running the network:
+  with LayerProfiler(model) as profiler:
+      for images, labels in loader:
+          model(images)
+"""
+import json
+from timeit import default_timer as timer
+import torch
+import torch.nn as nn
+
+
+def _tensors(output):
+    """Tensors of a (possibly nested) module output"""
+    if isinstance(output, torch.Tensor):
+        return [output]
+    if isinstance(output, (tuple, list)):
+        return [t for item in output for t in _tensors(item)]
+    return []
+
+
+class LayerProfiler(object):
+    """Forward hooks profiling the children of a network
+
+    Only the forwards are profiled, the layers recomputed during backward
+    (activation checkpointing) are not counted twice. The compiled copies
+    of a network (TorchScript, torch.compile) do not run its hooks.
+
+    Attributes
+    ----------
+    model : nn.Module
+        The profiled network.
+
+    input_shape : List[int]
+        The shape of the last input of the network.
+
+    records : dict(str, dict)
+        The accumulated measures of every child, see ``summary``.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.input_shape = None
+        self._handles = []
+        self._current = None
+        self._start = None
+        self.records = {}
+        for name, child in model.named_children():
+            self.records[name] = {
+                'calls': 0, 'time': 0., 'flops': 0,
+                'params': sum(p.numel() for p in child.parameters()),
+                'activation_bytes': 0, 'index_bytes': 0}
+
+    def _sync(self):
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            torch.cuda.synchronize()
+
+    def _enter(self, name):
+        def hook(module, args):
+            self._sync()
+            self._current = name
+            self._start = timer()
+        return hook
+
+    def _exit(self, name):
+        def hook(module, args, output):
+            self._sync()
+            record = self.records[name]
+            record['calls'] += 1
+            record['time'] += timer() - self._start
+            for tensor in _tensors(output):
+                size = tensor.numel() * tensor.element_size()
+                if tensor.is_floating_point():
+                    record['activation_bytes'] += size
+                else:
+                    record['index_bytes'] += size
+            self._current = None
+        return hook
+
+    def _count(self, module, args, output):
+        if self._current is None:
+            return
+        if isinstance(module, nn.ConvTranspose2d):
+            flops = args[0].numel() * module.weight[0].numel()
+        else:
+            flops = output.numel() * module.weight[0].numel()
+        self.records[self._current]['flops'] += 2 * flops
+
+    def _input(self, module, args):
+        if args and isinstance(args[0], torch.Tensor):
+            self.input_shape = list(args[0].shape)
+
+    def start(self):
+        """Register the hooks"""
+        if self._handles:
+            return self
+        self._handles.append(self.model.register_forward_pre_hook(
+            self._input))
+        for name, child in self.model.named_children():
+            self._handles.append(child.register_forward_pre_hook(
+                self._enter(name)))
+            self._handles.append(child.register_forward_hook(
+                self._exit(name)))
+        for module in self.model.modules():
+            if isinstance(module, (nn.Conv2d, nn.ConvTranspose2d,
+                                   nn.Linear)):
+                self._handles.append(module.register_forward_hook(
+                    self._count))
+        return self
+
+    def stop(self):
+        """Remove the hooks, the measures are kept"""
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+        self._current = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def summary(self):
+        """Measures of every child, per forward
+
+        Returns
+        -------
+        summary : List[dict]
+            'layer', 'calls', 'time_ms' (mean per forward), 'time_share'
+            (of the profiled time), 'gflops', 'params', 'activation_mb'
+            and 'index_mb' (per forward), in the order of the children.
+        """
+        total = sum(r['time'] for r in self.records.values()) or 1.
+        rows = []
+        for name, record in self.records.items():
+            calls = max(record['calls'], 1)
+            rows.append({'layer': name,
+                         'calls': record['calls'],
+                         'time_ms': 1e3 * record['time'] / calls,
+                         'time_share': record['time'] / total,
+                         'gflops': record['flops'] / calls / 1e9,
+                         'params': record['params'],
+                         'activation_mb': record['activation_bytes'] /
+                         calls / 2. ** 20,
+                         'index_mb': record['index_bytes'] / calls /
+                         2. ** 20})
+        return rows
+
+    def table(self):
+        """The summary as a text table, with a total row"""
+        rows = self.summary()
+        head = '%-10s %6s %10s %7s %9s %11s %10s %9s' % (
+            'layer', 'calls', 'time (ms)', 'time %', 'GFLOPs', 'params',
+            'act (MB)', 'idx (MB)')
+        lines = ['input %s' % self.input_shape, head, '-' * len(head)]
+        for row in rows:
+            lines.append('%-10s %6d %10.2f %7.1f %9.3f %11d %10.2f %9.2f' % (
+                row['layer'], row['calls'], row['time_ms'],
+                100. * row['time_share'], row['gflops'], row['params'],
+                row['activation_mb'], row['index_mb']))
+        lines.append('-' * len(head))
+        lines.append('%-10s %6s %10.2f %7.1f %9.3f %11d %10.2f %9.2f' % (
+            'total', '', sum(r['time_ms'] for r in rows), 100.,
+            sum(r['gflops'] for r in rows), sum(r['params'] for r in rows),
+            sum(r['activation_mb'] for r in rows),
+            sum(r['index_mb'] for r in rows)))
+        return '\n'.join(lines)
+
+    def to_json(self, filename=None):
+        """The summary as a JSON string, written to filename if given"""
+        text = json.dumps({'input_shape': self.input_shape,
+                           'layers': self.summary()}, indent=2)
+        if filename is not None:
+            with open(filename, 'w') as f:
+                f.write(text)
+        return text
+
+
+def profile_model(model, input_shape=(1, 3, 256, 256), steps=5):
+    """Profile of a network on random inputs
+
+    Parameters
+    ----------
+    model : nn.Module
+        The network, profiled in eval mode after one warm up forward.
+
+    input_shape : tuple
+        The shape of the (N, C, H, W) inputs.
+
+    steps : int
+        The number of profiled forwards.
+
+    Returns
+    -------
+    profiler : LayerProfiler
+    """
+    device = torch.device('cpu')
+    for param in model.parameters():
+        device = param.device
+        break
+    training = model.training
+    model.eval()
+    inputs = torch.randn(*input_shape, device=device)
+    profiler = LayerProfiler(model)
+    try:
+        with torch.no_grad():
+            model(inputs)
+            with profiler:
+                for _ in range(steps):
+                    model(inputs)
+    finally:
+        model.train(training)
+    return profiler
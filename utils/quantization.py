@@ -0,0 +1,170 @@
+"""Post training static int8 quantization of the segmentation networks
+
+This module quantizes the networks of ``segmentation/models/nn.py`` for
+cpu inference (eager mode quantization of ``torch.ao.quantization``).
+
+The module structure is the following:
+
+- The ``quantize_model`` function fuses every ``conv2DBatchNormRelu``
+  (conv + BatchNorm + ReLU into one conv + ReLU), observes the
+  activations on a calibration loader and converts the units to int8,
+  the max poolings with indices and the unpoolings stay in float
+- The ``evaluate`` function computes the metrics of a network on a
+  loader with ``utils.metrics.runningConfusion``
+- The ``model_size`` and ``latency`` functions measure the serialized
+  size and the inference time of a network
+- The ``quantization_report`` function compares the float and the int8
+  networks (mIoU, latency and size)
+
+  Example:
+  trainloader, valloader = loader_init(...)
+  qmodel = quantize_model(model, trainloader, n_batches=20)
+  quantization_report(model, trainloader, valloader, n_classes=11)
+"""
+import os
+import io
+import sys
+import copy
+from timeit import default_timer as timer
+import numpy as np
+import torch
+import torch.ao.quantization as quant
+
+_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(_root)
+sys.path.append(os.path.join(_root, 'segmentation', 'models'))
+from layer import conv2DBatchNormRelu
+from utils import metrics
+
+
+def quantize_model(model, calibration_loader, n_batches=None,
+                   backend='x86'):
+    """Int8 copy of a network calibrated on a loader
+
+    Parameters
+    ----------
+    model : nn.Module
+        The float network, left unchanged.
+
+    calibration_loader : DataLoader
+        The loader of (images, labels) batches observed to choose the
+        activation ranges, e.g. the train loader of ``loader_init``.
+
+    n_batches : int
+        The number of calibration batches (None for the whole loader).
+
+    backend : str
+        The quantized engine ('x86', 'fbgemm', 'qnnpack').
+
+    Returns
+    -------
+    qmodel : nn.Module
+        The quantized network, on cpu and in eval mode.
+    """
+    torch.backends.quantized.engine = backend
+    qconfig = quant.get_default_qconfig(backend)
+
+    qmodel = copy.deepcopy(model).cpu().eval()
+    for module in qmodel.modules():
+        if isinstance(module, conv2DBatchNormRelu):
+            module.prepare_quantization()
+            module.qconfig = qconfig
+    quant.prepare(qmodel, inplace=True)
+
+    with torch.no_grad():
+        for i, (images, labels) in enumerate(calibration_loader):
+            if n_batches is not None and i >= n_batches:
+                break
+            qmodel(images.float())
+
+    quant.convert(qmodel, inplace=True)
+    return qmodel
+
+
+def evaluate(model, loader, n_classes, n_batches=None):
+    """Metrics of a network on a loader, see ``runningConfusion.scores``"""
+    confusion = metrics.runningConfusion(n_classes)
+    model.eval()
+    with torch.no_grad():
+        for i, (images, labels) in enumerate(loader):
+            if n_batches is not None and i >= n_batches:
+                break
+            pred = model(images.float()).argmax(1)
+            confusion.update(labels.numpy(), pred.numpy())
+    return confusion.scores()
+
+
+def model_size(model):
+    """Bytes of the serialized state_dict of a network"""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def latency(model, inputs, steps=5):
+    """Median inference time of a network on inputs, after a warm up"""
+    model.eval()
+    times = []
+    with torch.no_grad():
+        model(inputs)
+        for _ in range(steps):
+            start = timer()
+            model(inputs)
+            times.append(timer() - start)
+    return float(np.median(times))
+
+
+def quantization_report(model, calibration_loader, eval_loader, n_classes,
+                        n_calibration=None, n_eval=None, backend='x86',
+                        steps=5):
+    """Compare a float network with its int8 version
+
+    Parameters
+    ----------
+    model : nn.Module
+        The float network.
+
+    calibration_loader : DataLoader
+        The calibration loader, see ``quantize_model``.
+
+    eval_loader : DataLoader
+        The loader on which the mIoU is measured, its first batch times
+        the inference.
+
+    n_classes : int
+        The number of classes.
+
+    n_calibration, n_eval : int
+        The number of calibration and evaluation batches (None for the
+        whole loaders).
+
+    Returns
+    -------
+    report : dict(str, dict)
+        'fp32' and 'int8' : mIoU, latency (s per batch) and size (MB)
+    """
+    model = copy.deepcopy(model).cpu().eval()
+    qmodel = quantize_model(model, calibration_loader, n_calibration,
+                            backend)
+    images = next(iter(eval_loader))[0].float()
+
+    report = {}
+    for name, net in (('fp32', model), ('int8', qmodel)):
+        report[name] = {'mIoU': float(evaluate(net, eval_loader, n_classes,
+                                               n_eval)['IoU']),
+                        'latency': latency(net, images, steps),
+                        'size': model_size(net) / 2. ** 20}
+
+    print('Static int8 quantization (%s), batch %s' % (backend,
+                                                       list(images.shape)))
+    print('%-6s %10s %14s %12s' % ('model', 'mIoU', 'latency (s)',
+                                   'size (MB)'))
+    for name in ('fp32', 'int8'):
+        print('%-6s %10.4f %14.3f %12.1f' % (name, report[name]['mIoU'],
+                                             report[name]['latency'],
+                                             report[name]['size']))
+    print('mIoU drop %.4f, speedup x%.2f, size x%.2f' % (
+        report['fp32']['mIoU'] - report['int8']['mIoU'],
+        report['fp32']['latency'] / report['int8']['latency'],
+        report['fp32']['size'] / report['int8']['size']))
+    return report
@@ -0,0 +1,218 @@
+"""Sliding window inference of the segmentation networks
+
+This module segments images larger than what a network can process at
+once, by splitting them in overlapping tiles.
+
+The module structure is the following:
+
+- The ``tile_starts`` function returns the offsets of the tiles along
+  one axis, the last tile is aligned on the border of the image
+- The ``blending_window`` function returns the weights of the pixels of
+  a tile, lower on its borders so that overlapping tiles blend smoothly
+- The ``TiledInference`` class runs a model over the tiles by batches
+  and blends their logits. The tiles are processed by rows (strips),
+  only the logits of the current strip are kept, in two fixed
+  accumulators reused from strip to strip, and the rows no later tile
+  overlaps are reduced to uint8 labels, memory does not depend on the
+  height of the image.
+
+  Example:
+  tiler = TiledInference(model, tile_size=256, overlap=64, batch_size=4)
+  labels = tiler(image)  # image (C, H, W) -> labels (H, W) uint8
+"""
+import math
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+def tile_starts(length, tile_size, overlap):
+    """Offsets of the tiles covering ``length`` pixels
+
+    Parameters
+    ----------
+    length : int
+        The size of the image along the axis.
+
+    tile_size : int
+        The size of the tiles.
+
+    overlap : int
+        The minimal number of pixels shared by two consecutive tiles.
+
+    Returns
+    -------
+    starts : List[int]
+    """
+    if length <= tile_size:
+        return [0]
+    stride = tile_size - overlap
+    starts = list(range(0, length - tile_size + 1, stride))
+    if starts[-1] + tile_size < length:
+        starts.append(length - tile_size)
+    return starts
+
+
+def blending_window(tile_size, window='hann'):
+    """Weights of the pixels of a tile
+
+    Parameters
+    ----------
+    tile_size : int
+        The size of the (square) tiles.
+
+    window : str
+        'hann' for a sine window, strictly positive and maximal at the
+        center of the tile, 'uniform' for a plain average.
+
+    Returns
+    -------
+    weights : torch.Tensor
+        The (tile_size, tile_size) weights.
+    """
+    if window == 'uniform':
+        return torch.ones(tile_size, tile_size)
+    if window == 'hann':
+        ramp = torch.sin(math.pi * (torch.arange(tile_size).float() + 0.5) /
+                         tile_size)
+        return ramp[:, None] * ramp[None, :]
+    raise ValueError('window has to be hann or uniform')
+
+
+class TiledInference(object):
+    """Segment arbitrarily large images with a network by tiles
+
+    Attributes
+    ----------
+    model : nn.Module
+        The network, any model of ``nn.py`` (in eval mode). The tile size
+        has to be compatible with its poolings (multiple of 32 for
+        SegNet).
+
+    tile_size : int
+        The size of the square tiles fed to the network.
+
+    overlap : int
+        The number of pixels shared by neighbouring tiles.
+
+    batch_size : int
+        The number of tiles per forward.
+
+    window : str
+        The blending window of the tile logits, see ``blending_window``.
+
+    transform : callable
+        Optional function applied to each batch of tiles before the
+        network (e.g. normalization of raw uint8 tiles).
+    """
+    def __init__(self, model, tile_size=256, overlap=64, batch_size=4,
+                 window='hann', transform=None):
+        if not 0 <= overlap < tile_size:
+            raise ValueError('overlap has to be in [0, tile_size)')
+        self.model = model
+        self.tile_size = int(tile_size)
+        self.overlap = int(overlap)
+        self.batch_size = int(batch_size)
+        self.window = blending_window(self.tile_size, window)
+        self.transform = transform
+
+    def _device(self):
+        for param in self.model.parameters():
+            return param.device
+        return torch.device('cpu')
+
+    def _tile(self, image, y, x):
+        """Tile of the image at (y, x), zero padded to tile_size"""
+        tile = image[:, y:y + self.tile_size, x:x + self.tile_size]
+        tile = torch.as_tensor(np.ascontiguousarray(tile)
+                               if isinstance(tile, np.ndarray) else tile)
+        pad_h = self.tile_size - tile.shape[1]
+        pad_w = self.tile_size - tile.shape[2]
+        if pad_h or pad_w:
+            tile = F.pad(tile, (0, pad_w, 0, pad_h))
+        return tile
+
+    def _strips(self, image):
+        """Blended logits of each strip of tiles
+
+        Yields (top, rows, logits) where ``logits`` (C, rows, W) are the
+        final logits of the image rows [top, top + rows). They are a
+        view of the accumulator, only valid until the next strip.
+        """
+        height, width = image.shape[1], image.shape[2]
+        ys = tile_starts(height, self.tile_size, self.overlap)
+        xs = tile_starts(width, self.tile_size, self.overlap)
+        device = self._device()
+        window = self.window.to(device)
+
+        # the rows of a strip still overlapped by the next one are moved
+        # to the top of the other accumulator, no buffer is reallocated
+        acc, spare = None, None
+        norm = torch.zeros(self.tile_size, width, device=device)
+        spare_norm = torch.zeros_like(norm)
+        with torch.no_grad():
+            for row, y in enumerate(ys):
+                for start in range(0, len(xs), self.batch_size):
+                    batch_xs = xs[start:start + self.batch_size]
+                    tiles = torch.stack([self._tile(image, y, x)
+                                         for x in batch_xs]).to(device)
+                    if self.transform is not None:
+                        tiles = self.transform(tiles)
+                    logits = self.model(tiles.float()).float()
+                    if acc is None:
+                        acc = torch.zeros(logits.size(1), self.tile_size,
+                                          width, device=device)
+                        spare = torch.zeros_like(acc)
+                    for x, tile_logits in zip(batch_xs, logits):
+                        cols = min(self.tile_size, width - x)
+                        rows = min(self.tile_size, height - y)
+                        acc[:, :rows, x:x + cols] += \
+                            tile_logits[:, :rows, :cols] * \
+                            window[:rows, :cols]
+                        norm[:rows, x:x + cols] += window[:rows, :cols]
+
+                # rows above the next strip are not overlapped any more
+                if row + 1 < len(ys):
+                    done = ys[row + 1] - y
+                else:
+                    done = min(self.tile_size, height - y)
+                keep = self.tile_size - done
+                spare[:, :keep] = acc[:, done:]
+                spare[:, keep:] = 0
+                spare_norm[:keep] = norm[done:]
+                spare_norm[keep:] = 0
+
+                yield y, done, acc[:, :done].div_(norm[:done])
+
+                acc, spare = spare, acc
+                norm, spare_norm = spare_norm, norm
+
+    def __call__(self, image, out=None):
+        """Labels of an image
+
+        Parameters
+        ----------
+        image : torch.Tensor or np.ndarray
+            The (C, H, W) image, a np.memmap is read tile by tile.
+
+        out : np.ndarray
+            Optional (H, W) uint8 array receiving the labels (e.g. a
+            np.memmap to keep the output out of memory).
+
+        Returns
+        -------
+        out : np.ndarray
+            The (H, W) uint8 labels.
+        """
+        if out is None:
+            out = np.zeros(image.shape[1:3], dtype=np.uint8)
+        for top, rows, logits in self._strips(image):
+            # max(0) is much faster than argmax(0) on a strided view
+            out[top:top + rows] = logits.max(0)[1].to(torch.uint8).cpu()
+        return out
+
+    def logits(self, image):
+        """Blended (C, H, W) logits of an image, held in memory"""
+        strips = [logits.to('cpu', copy=True)
+                  for _, _, logits in self._strips(image)]
+        return torch.cat(strips, dim=1)
@@ -0,0 +1,167 @@
+"""Background writer of prediction maps
+
+This module writes arrays to disk while inference continues.
+
+The module structure is the following:
+
+- The ``AsyncWriter`` class compresses and writes arrays (.npz) from a
+  pool of threads fed by a bounded queue. The producer only blocks when
+  the queue is full, the writer reports its backlog and throughput.
+  It backs the ``writer`` argument of ``Routine.test`` and can be used
+  as any ``sink(index, pred)``.
+
+  Example:
+  with AsyncWriter('out', workers=2, max_pending=32) as writer:
+      for i, pred in enumerate(preds):
+          writer.submit('pred/pred%d' % i, pred=pred)
+  print(writer.stats())
+"""
+import os
+import threading
+from queue import Queue
+from timeit import default_timer as timer
+import numpy as np
+
+
+class AsyncWriter(object):
+    """Thread pool writing compressed arrays behind a bounded queue
+
+    Compression (zlib) and file I/O release the GIL, the threads overlap
+    with the inference of the next batches.
+
+    Attributes
+    ----------
+    directory : str
+        The root of the written files.
+
+    prefix : str
+        The file name prefix used by ``write`` (and ``__call__``).
+
+    workers : int
+        The number of writing threads.
+
+    max_pending : int
+        The size of the queue, ``submit`` blocks when it is full so that
+        the memory held by the pending arrays is bounded.
+
+    compress : bool
+        np.savez_compressed if True, np.savez otherwise.
+    """
+    def __init__(self, directory='.', prefix='pred', workers=2,
+                 max_pending=32, compress=True):
+        self.directory = directory
+        self.prefix = prefix
+        self.compress = compress
+        self._queue = Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._error = None
+        self._closed = False
+
+        self._written = 0
+        self._bytes = 0
+        self._max_backlog = 0
+        self._blocked = 0.
+        self._start = timer()
+        self._end = None
+
+        self._threads = [threading.Thread(target=self._work, daemon=True)
+                         for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                filename, arrays = item
+                if self._error is None:
+                    self._save(filename, arrays)
+            except Exception as e:
+                with self._lock:
+                    if self._error is None:
+                        self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _save(self, filename, arrays):
+        path = os.path.join(self.directory, filename)
+        if not path.endswith('.npz'):
+            path += '.npz'
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(path, 'wb') as f:
+            if self.compress:
+                np.savez_compressed(f, **arrays)
+            else:
+                np.savez(f, **arrays)
+            size = f.tell()
+        with self._lock:
+            self._written += 1
+            self._bytes += size
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, filename, **arrays):
+        """Queue arrays to be written in directory/filename.npz
+
+        The arrays are not copied, they must not be modified afterwards.
+        """
+        self._check()
+        if self._closed:
+            raise ValueError('Writer is closed')
+        start = timer()
+        self._queue.put((filename, arrays))
+        backlog = self._queue.qsize()
+        with self._lock:
+            self._blocked += timer() - start
+            self._max_backlog = max(self._max_backlog, backlog)
+
+    def write(self, index, pred):
+        """Queue a prediction as prefix<index>.npz (key 'pred')"""
+        self.submit('%s%d' % (self.prefix, index), pred=pred)
+
+    __call__ = write
+
+    def stats(self):
+        """Backlog and throughput of the writer
+
+        Returns
+        -------
+        stats : dict
+            'written' : files written
+            'pending' : files queued and not written yet
+            'max_backlog' : largest queue length observed
+            'blocked' : seconds the producer waited on a full queue
+            'files_per_s', 'mb_per_s' : write throughput since creation
+        """
+        with self._lock:
+            end = self._end if self._end is not None else timer()
+            elapsed = max(end - self._start, 1e-9)
+            return {'written': self._written,
+                    'pending': self._queue.qsize(),
+                    'max_backlog': self._max_backlog,
+                    'blocked': self._blocked,
+                    'files_per_s': self._written / elapsed,
+                    'mb_per_s': self._bytes / 2. ** 20 / elapsed}
+
+    def close(self):
+        """Write the pending arrays and stop the threads"""
+        if not self._closed:
+            self._closed = True
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._end = timer()
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()